@@ -604,12 +604,109 @@ class DetailController(rest.RestController):
         return (price_per_day, remaining_day)
 
 
+class OwedController(rest.RestController):
+    """The accounts to notify that they have owed or will owe."""
+
+    @wsexpose([models.OwedAccount], [wtypes.text], int, int, int,
+              wtypes.text, [wtypes.text], bool)
+    def get_all(self, bill_methods=None, days_to_owe=None, limit=None,
+                offset=None, duration=None, user_ids=None, detail=True):
+        """Get a page of the owed accounts and the active orders of their
+        projects, so they are notified without querying every account.
+
+        :param duration: Only the accounts updated within the duration.
+        :param user_ids: Only the accounts of the users.
+        :param detail: Whether to get the projects and orders of the
+                       accounts, the callers that only pick the accounts
+                       to notify can skip them.
+        """
+        check_policy(request.context, "account:all")
+
+        if limit and limit < 0:
+            raise exception.InvalidParameterValue(err="Invalid limit")
+        if offset and offset < 0:
+            raise exception.InvalidParameterValue(err="Invalid offset")
+
+        duration = gringutils.normalize_timedelta(duration)
+        if duration:
+            active_from = datetime.datetime.utcnow() - duration
+        else:
+            active_from = None
+
+        conn = pecan.request.db_conn
+        try:
+            accounts = list(conn.get_owed_accounts(request.context,
+                                                   bill_methods=bill_methods,
+                                                   days_to_owe=days_to_owe,
+                                                   active_from=active_from,
+                                                   user_ids=user_ids,
+                                                   limit=limit,
+                                                   offset=offset))
+            if not detail:
+                return [models.OwedAccount(**account.as_dict())
+                        for account in accounts]
+            user_ids = [account.user_id for account in accounts]
+            if not user_ids:
+                return []
+            projects = conn.get_projects(request.context, user_ids=user_ids)
+            orders = conn.get_active_orders(request.context,
+                                            user_ids=user_ids,
+                                            bill_methods=bill_methods)
+        except Exception as e:
+            LOG.exception('Failed to get owed accounts')
+            raise exception.DBError(reason=e)
+
+        project_orders = {}
+        for order in orders:
+            project_orders.setdefault((order.user_id, order.project_id),
+                                      []).append(
+                models.Order.from_db_model(order))
+        user_projects = {}
+        for project in projects:
+            user_projects.setdefault(project.user_id, []).append(
+                models.OwedProject(
+                    project_id=project.project_id,
+                    orders=project_orders.get(
+                        (project.user_id, project.project_id), [])))
+
+        result = []
+        for account in accounts:
+            result.append(models.OwedAccount(
+                projects=user_projects.get(account.user_id, []),
+                **account.as_dict()))
+        return result
+
+
+class SnapshotsController(rest.RestController):
+    """Fold the deferred ledger entries into the accounts."""
+
+    @wsexpose(int, int)
+    def post(self, limit=None):
+        """Refresh the balance snapshots of at most limit accounts, return
+        the number of the refreshed ones.
+        """
+        check_policy(request.context, "account:all")
+
+        if limit and limit < 0:
+            raise exception.InvalidParameterValue(err="Invalid limit")
+
+        conn = pecan.request.db_conn
+        try:
+            return conn.refresh_balance_snapshots(request.context,
+                                                  limit=limit)
+        except Exception as e:
+            LOG.exception('Failed to refresh balance snapshots')
+            raise exception.DBError(reason=e)
+
+
 class AccountsController(rest.RestController):
     """Manages operations on the accounts collection."""
 
     charges = ChargeController()
     transfer = TransferMoneyController()
     detail = DetailController()
+    owed = OwedController()
+    snapshots = SnapshotsController()
 
     @pecan.expose()
     def _lookup(self, user_id, *remainder):
@@ -618,9 +715,11 @@ class AccountsController(rest.RestController):
         if len(user_id) == 32:
             return AccountController(user_id), remainder
 
-    @wsexpose(models.AdminAccounts, bool, int, int, wtypes.text)
-    def get_all(self, owed=None, limit=None, offset=None, duration=None):
-        """Get all accounts."""
+    @wsexpose(models.AdminAccounts, bool, int, int, wtypes.text,
+              [wtypes.text])
+    def get_all(self, owed=None, limit=None, offset=None, duration=None,
+                fields=None):
+        """Get all accounts, with only the attributes of fields if given."""
 
         check_policy(request.context, "account:all")
 
@@ -640,11 +739,16 @@ class AccountsController(rest.RestController):
         try:
             accounts = self.conn.get_accounts(request.context, owed=owed,
                                               limit=limit, offset=offset,
-                                              active_from=active_from)
+                                              active_from=active_from,
+                                              fields=fields)
+            accounts = [models.AdminAccount.from_db_model(account)
+                        for account in accounts]
             count = self.conn.get_accounts_count(request.context,
                                                  owed=owed,
                                                  active_from=active_from)
             pecan.response.headers['X-Total-Count'] = str(count)
+        except exception.InvalidParameterValue:
+            raise
         except exception.NotAuthorized as e:
             LOG.exception('Failed to get all accounts')
             raise exception.NotAuthorized()
@@ -652,9 +756,6 @@ class AccountsController(rest.RestController):
             LOG.exception('Failed to get all accounts')
             raise exception.DBError(reason=e)
 
-        accounts = [models.AdminAccount.from_db_model(account)
-                    for account in accounts]
-
         return models.AdminAccounts(total_count=count,
                                     accounts=accounts)
 
@@ -183,7 +183,8 @@ class DetailController(rest.RestController):
                                        end_time=end_time,
                                        type=type,
                                        limit=limit,
-                                       offset=offset))
+                                       offset=offset,
+                                       raw=True))
         total_count, total_price = conn.get_bills_count_and_sum(
             pecan.request.context,
             project_id=project_id,
@@ -221,7 +221,8 @@ class OrdersController(rest.RestController):
                                                  with_count=True,
                                                  region_id=region_id,
                                                  user_id=user_id,
-                                                 project_ids=project_ids)
+                                                 project_ids=project_ids,
+                                                 raw=True)
         for order in orders_db:
             price = self._get_order_price(order,
                                           start_time=start_time,
@@ -230,9 +231,9 @@ class OrdersController(rest.RestController):
             project = _get_project(order.project_id)
             if project is None:
                 continue
-            order.created_at += datetime.timedelta(hours=8)
+            created_at = order.created_at + datetime.timedelta(hours=8)
             created_at = \
-                timeutils.strtime(order.created_at, fmt=OUTPUT_TIME_FORMAT)
+                timeutils.strtime(created_at, fmt=OUTPUT_TIME_FORMAT)
             adata = (order.resource_id, order.resource_name,
                      MAP[1][order.type], MAP[0][order.status],
                      order.unit_price, price, order.region_id,
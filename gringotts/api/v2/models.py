@@ -24,7 +24,12 @@ class APIBase(wtypes.Base):
 
     @classmethod
     def from_db_model(cls, m):
-        return cls(**(m.as_dict()))
+        """Build from a storage model, or a SQLAlchemy row directly"""
+        if hasattr(m, 'as_dict'):
+            return cls(**(m.as_dict()))
+        return cls(**dict((k.name, getattr(m, k.name))
+                          for k in wtypes.inspect_class(cls)
+                          if hasattr(m, k.name)))
 
     @classmethod
     def transform(cls, **kwargs):
@@ -239,6 +244,11 @@ class OrderPostBody(APIBase):
     status = wtypes.text
 
 
+class OrderPostBodies(APIBase):
+    """A batch of orders."""
+    orders = [OrderPostBody]
+
+
 class OrderPutBody(APIBase):
     order_id = wtypes.text
     change_to = wtypes.text
@@ -380,6 +390,17 @@ class AdminAccounts(APIBase):
     accounts = [AdminAccount]
 
 
+class OwedProject(APIBase):
+    """A project of an owed account and its active orders."""
+    project_id = wtypes.text
+    orders = [Order]
+
+
+class OwedAccount(AdminAccount):
+    """An account that has owed or will owe, and its projects."""
+    projects = [OwedProject]
+
+
 class UserInDetail(APIBase):
     name = wtypes.text
     domain_id = wtypes.text
@@ -588,6 +609,7 @@ class UserProject(APIBase):
     project_owner = {wtypes.text: wtypes.text}
     project_creator = {wtypes.text: wtypes.text}
     is_historical = bool
+    order_count = int
     created_at = wtypes.text
 
 
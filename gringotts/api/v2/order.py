@@ -422,14 +422,27 @@ class StoppedOrderCountController(rest.RestController):
         return order_count
 
 
+class ChangedController(rest.RestController):
+    """Get ids of projects that have orders created since a time."""
+
+    @wsexpose([wtypes.text], datetime.datetime, wtypes.text)
+    def get_all(self, since, region_id=None):
+        conn = pecan.request.db_conn
+        return conn.get_projects_of_new_orders(request.context,
+                                               since,
+                                               region_id=region_id)
+
+
 class ActiveController(rest.RestController):
     """Get active orders."""
 
     @wsexpose([models.Order], wtypes.text, int, int, wtypes.text,
-              wtypes.text, wtypes.text, bool, bool, [wtypes.text])
+              wtypes.text, wtypes.text, bool, bool, [wtypes.text],
+              [wtypes.text])
     def get_all(self, type=None, limit=None, offset=None,
                 region_id=None, user_id=None, project_id=None,
-                owed=None, charged=None, bill_methods=None):
+                owed=None, charged=None, bill_methods=None, fields=None):
+        """Get active orders, with only the attributes of fields if given"""
 
         if limit and limit < 0:
             raise exception.InvalidParameterValue(err="Invalid limit")
@@ -446,7 +459,8 @@ class ActiveController(rest.RestController):
                                         project_id=project_id,
                                         owed=owed,
                                         charged=charged,
-                                        bill_methods=bill_methods)
+                                        bill_methods=bill_methods,
+                                        fields=fields)
         return [models.Order.from_db_model(order)
                 for order in orders]
 
@@ -463,6 +477,43 @@ class ResetOrderController(rest.RestController):
             LOG.exception("Fail to reset charged orders: %s" % data.order_ids)
 
 
+class BatchController(rest.RestController):
+    """Create a batch of orders."""
+
+    def __init__(self, master_api):
+        self.master_api = master_api
+
+    @wsexpose(None, body=models.OrderPostBodies)
+    def post(self, data):
+        """Create the orders, and notify master of the hourly ones in one
+        batch. An order that fails to be created doesn't stop the others.
+        """
+        conn = pecan.request.db_conn
+        action_time = gringutils.format_datetime(
+            timeutils.strtime(timeutils.utcnow()))
+        created = []
+        for order_data in data.orders:
+            try:
+                order = conn.create_order(request.context,
+                                          **order_data.as_dict())
+                if order.unit in ['month', 'year']:
+                    self.master_api.create_monthly_job(
+                        request.context, order.order_id,
+                        timeutils.isotime(order.cron_time))
+                    continue
+            except Exception as e:
+                LOG.exception('Fail to create order: %s, for reason %s' %
+                              (order_data.as_dict(), e))
+                continue
+            remarks = '%s Has Been Created.' % order.type.capitalize()
+            created.append(dict(order_id=order.order_id,
+                                action_time=action_time,
+                                remarks=remarks))
+        if created:
+            self.master_api.batch(request.context, 'resource_created',
+                                  created)
+
+
 class OrdersController(rest.RestController):
     """The controller of resources."""
 
@@ -470,11 +521,13 @@ class OrdersController(rest.RestController):
     resource = ResourceController()
     count = CountController()
     active = ActiveController()
+    changed = ChangedController()
     stopped = StoppedOrderCountController()
     reset = ResetOrderController()
 
     def __init__(self):
         self.master_api = master.API()
+        self.batch = BatchController(self.master_api)
 
     @pecan.expose()
     def _lookup(self, order_id, *remainder):
@@ -534,14 +587,16 @@ class OrdersController(rest.RestController):
                                                  bill_methods=bill_methods,
                                                  region_id=region_id,
                                                  user_id=user_id,
-                                                 project_ids=project_ids)
+                                                 project_ids=project_ids,
+                                                 raw=True)
         orders = []
         for order in orders_db:
             price = self._get_order_price(order,
                                           start_time=start_time,
                                           end_time=end_time)
+            order = models.Order.from_db_model(order)
             order.total_price = gringutils._quantize_decimal(price)
-            orders.append(models.Order.from_db_model(order))
+            orders.append(order)
 
         return models.Orders.transform(total_count=total_count,
                                        orders=orders)
@@ -12,7 +12,6 @@ from wsmeext.pecan import wsexpose
 from gringotts.api.v2 import models
 from gringotts.db import models as db_models
 from gringotts import exception
-from gringotts.openstack.common import jsonutils
 from gringotts.openstack.common import log
 from gringotts.openstack.common import uuidutils
 from gringotts.price import pricing
@@ -209,15 +208,9 @@ class PriceController(rest.RestController):
                       "product_id and quantity."
                 raise exception.MissingRequiredParams(reason=err)
             try:
-                if product.unit_price:
-                    unit_price_data = jsonutils.loads(product.unit_price)
-                    price_data = pricing.get_price_data(unit_price_data,
-                                                        unit)
-                else:
-                    price_data = None
-
-                unit_price += pricing.calculate_price(
-                    p.quantity, price_data)
+                plan = pricing.get_price_plan(product.unit_price, unit)
+                if plan:
+                    unit_price += plan.calculate(p.quantity)
             except (Exception) as e:
                 LOG.error('Calculate price of product %s failed, %s',
                           p.product_name, e)
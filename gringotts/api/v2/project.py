@@ -204,9 +204,17 @@ class ProjectsController(rest.RestController):
             remainder = remainder[:-1]
         return ProjectController(project_id, self.external_client), remainder
 
-    @wsexpose([models.UserProject], wtypes.text, wtypes.text, wtypes.text)
-    def get_all(self, user_id=None, type=None, duration=None):
-        """Get all projects."""
+    @wsexpose([models.UserProject], wtypes.text, wtypes.text, wtypes.text,
+              bool, wtypes.text)
+    def get_all(self, user_id=None, type=None, duration=None,
+                with_order_count=False, region_id=None):
+        """Get all projects.
+
+        :param with_order_count: Only for admin and the simple type, return
+                                 the active order count of every project in
+                                 the region_id, or in all regions if it is
+                                 not given.
+        """
         user_id = acl.get_limited_to_user(request.headers,
                                           'projects_get') or user_id
         self.conn = pecan.request.db_conn
@@ -304,13 +312,21 @@ class ProjectsController(rest.RestController):
                 return []
 
             k_projects = self._list_keystone_projects()
+            order_counts = {}
+            if with_order_count:
+                if not request.context.is_admin:
+                    raise exception.NotAuthorized()
+                order_counts = self.conn.get_active_order_count_by_project(
+                    request.context, region_id=region_id)
 
             for k, g in itertools.product(k_projects, g_projects):
                 if k.id == g.project_id:
                     up = models.UserProject(project_id=g.project_id,
                                             project_name=k.name,
                                             domain_id=g.domain_id,
-                                            billing_owner=dict(user_id=g.user_id))
+                                            billing_owner=dict(user_id=g.user_id),
+                                            order_count=order_counts.get(
+                                                g.project_id))
                     result.append(up)
 
         return result
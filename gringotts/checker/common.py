@@ -57,24 +57,37 @@ class CheckBase(object):
     def product_items(self):
         pass
 
-    def create_order(self, resource, unit='hour', period=None, renew=None):
-        """Create order for resource. """
+    def get_product_items(self, resource):
+        return self.product_items
+
+    def prepare_order(self, resource, unit='hour', period=None, renew=None):
+        """Create subscriptions for resource and return its order.
+
+        :returns: kwargs of GCLIENT.create_order, so orders of many
+                  resources can be created in one batch.
+        """
         order_id = uuidutils.generate_uuid()
         parsed_resource = self.parse_resource(resource)
         unit_price = self.get_unit_price(resource, method=unit)
 
-        for ext in self.product_items.extensions:
+        for ext in self.get_product_items(resource).extensions:
             state = ext.name.split('_')[0]
             ext.obj.create_subscription(resource.to_env(), resource.to_body(),
                                         order_id, type=state)
 
-        GCLIENT.create_order(order_id,
-                             CONF.region_name,
-                             unit_price,
-                             unit,
-                             period=period,
-                             renew=renew,
-                             **parsed_resource.as_dict())
+        return dict(order_id=order_id,
+                    region_id=CONF.region_name,
+                    unit_price=unit_price,
+                    unit=unit,
+                    period=period,
+                    renew=renew,
+                    **parsed_resource.as_dict())
+
+    def create_order(self, resource, unit='hour', period=None, renew=None):
+        """Create order for resource. """
+        order = self.prepare_order(resource, unit=unit, period=period,
+                                   renew=renew)
+        GCLIENT.create_order(**order)
 
     def get_unit_price(self, resource, method):
         """Caculate unit price of this order.
@@ -84,7 +97,7 @@ class CheckBase(object):
 
         """
         unit_price = 0
-        for ext in self.product_items.extensions:
+        for ext in self.get_product_items(resource).extensions:
             if ext.name.startswith('running'):
                 price = ext.obj.get_unit_price(resource.to_env(),
                                                resource.to_body(), method)
@@ -181,29 +194,8 @@ class NeutronCheck(CheckBase):
         for name in ['floatingip', 'router', 'listener']:
             self.product_items[name] = get_product_items(name)
 
-    def create_order(self, resource, unit='hour', period=None, renew=None):
-        """Create order for resource. """
-        order_id = uuidutils.generate_uuid()
-        parsed_resource = self.parse_resource(resource)
-        unit_price = self.get_unit_price(resource, method=unit)
-
-        for ext in self.product_items[resource.resource_type].extensions:
-            state = ext.name.split('_')[0]
-            ext.obj.create_subscription(resource.to_env(), resource.to_body(),
-                                        order_id, type=state)
-
-        GCLIENT.create_order(order_id, CONF.region_name,
-                             unit_price, period=period,
-                             renew=renew, **parsed_resource.as_dict)
-
-    def get_unit_price(self, resource, method):
-        unit_price = 0
-        for ext in self.product_items[resource.resource_type].extensions:
-            if ext.name.startswith('running'):
-                price = ext.obj.get_unit_price(resource.to_env(),
-                                               resource.to_body(), method)
-                unit_price += price
-        return unit_price
+    def get_product_items(self, resource):
+        return self.product_items[resource.resource_type]
 
     def change_unit_price(self, resource, status, order_id):
         quantity = None
@@ -0,0 +1,125 @@
+"""Fix the orders and resources that the checker found in batches.
+"""
+
+from gringotts import constants as const
+from gringotts.openstack.common import log
+from gringotts import utils
+
+
+LOG = log.getLogger(__name__)
+
+
+class BatchFixer(object):
+    """Fix the items of Situation 1-5 in batches
+
+    Items are grouped by situation and fixed *batch_size* at a time. The
+    orders of the resources of Situation 1 are created by one API call per
+    batch, the items of Situation 2-4 are sent to master in one message per
+    master per batch. Changing the unit price of Situation 5 has no bulk
+    endpoint, so its items are fixed one by one. Items are throttled to
+    *rate* per second, 0 means no limit.
+
+    With *dry_run* nothing is changed, fix() only reports what would be
+    fixed.
+    """
+
+    def __init__(self, gclient, master_api, ctxt, create_map,
+                 batch_size=100, rate=0, dry_run=False):
+        self.gclient = gclient
+        self.master_api = master_api
+        self.ctxt = ctxt
+        self.create_map = create_map
+        self.batch_size = max(batch_size, 1)
+        self.dry_run = dry_run
+        self.bucket = None
+        if rate > 0:
+            self.bucket = utils.TokenBucket(rate,
+                                            max(rate, self.batch_size))
+
+    def fix(self, situations):
+        """Fix the items of every situation
+
+        :param situations: A dict of situation -> items.
+        :returns: A dict of situation -> ids of the orders, or the
+                  resources for Situation 1, that are fixed, or would be
+                  fixed if it is a dry run.
+        """
+        report = {}
+        for situation in sorted(situations):
+            items = situations[situation]
+            if not items:
+                continue
+            fix_batch = getattr(self, '_fix_situation_%s' % situation)
+            report[situation] = []
+            for i in range(0, len(items), self.batch_size):
+                batch = items[i:i + self.batch_size]
+                if not self.dry_run:
+                    if self.bucket:
+                        self.bucket.consume(len(batch))
+                    try:
+                        fix_batch(batch)
+                    except Exception:
+                        LOG.exception('Fail to fix a batch of %s items of '
+                                      'Situation %s', len(batch), situation)
+                        continue
+                report[situation].extend(
+                    item.id if situation == '1' else item.order_id
+                    for item in batch)
+        return report
+
+    def _fix_situation_1(self, resources):
+        orders = []
+        for resource in resources:
+            create_cls = self.create_map[resource.resource_type]
+            try:
+                orders.append(create_cls.prepare_order(resource))
+            except Exception:
+                LOG.exception('Fail to prepare the order of resource %s',
+                              resource.id)
+        if orders:
+            self.gclient.create_orders(orders)
+
+    def _fix_situation_2(self, items):
+        stopped = []
+        changed = []
+        for item in items:
+            if (item.resource_type == const.RESOURCE_INSTANCE and
+                    item.change_to == const.STATE_STOPPED):
+                stopped.append(dict(order_id=item.order_id,
+                                    action_time=item.action_time))
+            else:
+                changed.append(dict(order_id=item.order_id,
+                                    action_time=item.action_time,
+                                    change_to=item.change_to,
+                                    remarks="System Adjust"))
+        if stopped:
+            self.master_api.batch(self.ctxt, 'instance_stopped', stopped)
+        if changed:
+            self.master_api.batch(self.ctxt, 'resource_changed', changed)
+
+    def _fix_situation_3(self, items):
+        self.master_api.batch(
+            self.ctxt, 'resource_created_again',
+            [dict(order_id=item.order_id,
+                  action_time=item.resource_created_at,
+                  remarks="System Adjust")
+             for item in items])
+
+    def _fix_situation_4(self, items):
+        self.master_api.batch(
+            self.ctxt, 'resource_deleted',
+            [dict(order_id=item.order_id,
+                  action_time=item.deleted_at,
+                  remarks="Resource Has Been Deleted")
+             for item in items])
+
+    def _fix_situation_5(self, items):
+        for item in items:
+            create_cls = self.create_map[item.resource.resource_type]
+            try:
+                create_cls.change_unit_price(item.resource,
+                                             item.resource.status,
+                                             item.order_id)
+            except Exception:
+                LOG.exception('Fail to change the unit price of order %s',
+                              item.order_id)
@@ -1,18 +1,69 @@
 import abc
 
+from eventlet import greenpool
 from stevedore import extension
+from gringotts.openstack.common import jsonutils
 from gringotts.openstack.common import log
 
 
 LOG = log.getLogger(__name__)
 
 
+class NotificationSink(object):
+    """Collect the notifications of a run and publish them in background
+
+    The same notification to the same recipient is published only once
+    until flush() is called, and at most *workers* notifications are
+    published at the same time, so the caller doesn't wait for each of
+    them. Every run gets its own sink from NotifierService.new_sink(), so
+    runs at the same time don't flush or dedup the notifications of each
+    other.
+    """
+
+    def __init__(self, workers):
+        self._pool = greenpool.GreenPool(max(workers, 1))
+        self._published = set()
+        self.duplicated = 0
+
+    def add(self, notifier, context, event_type, payload):
+        key = (notifier.publisher_id, event_type,
+               jsonutils.dumps(payload, sort_keys=True))
+        if key in self._published:
+            self.duplicated += 1
+            return
+        self._published.add(key)
+        self._pool.spawn_n(self._publish, notifier, context, event_type,
+                           payload)
+
+    @staticmethod
+    def _publish(notifier, context, event_type, payload):
+        try:
+            notifier.info(context, event_type, payload)
+        except Exception:
+            LOG.exception('Fail to publish notification %s', event_type)
+
+    def flush(self):
+        """Wait for the notifications to be published"""
+        self._pool.waitall()
+        if self.duplicated:
+            LOG.warn('Skipped %s duplicated notifications', self.duplicated)
+        self._published.clear()
+        self.duplicated = 0
+
+
 class NotifierService(object):
 
     EXTENSIONS_NAMESPACE = 'gringotts.notifier'
 
-    def __init__(self, level):
+    def __init__(self, level, workers=0):
+        """Notify with the notifiers of the level
+
+        If workers is greater than 0, new_sink() returns a NotificationSink
+        for a run, which is passed to the notify methods as the sink
+        keyword argument, and flushed at the end of the run.
+        """
         self.level = level or 0
+        self.workers = workers
         self.notifiers = []
         extensions = extension.ExtensionManager(self.EXTENSIONS_NAMESPACE,
                                                 invoke_on_load=True)
@@ -26,6 +77,11 @@ class NotifierService(object):
             self.notifiers.append(extensions['email'].obj)
             self.notifiers.append(extensions['sms'].obj)
 
+    def new_sink(self):
+        """Return a new sink for a run, or None if workers is 0"""
+        if self.workers > 0:
+            return NotificationSink(self.workers)
+
     def notify_before_owed(self, context, account, contact, projects, price_per_day, days_to_owe, **kwargs):
         for notifier in self.notifiers:
             notifier.notify_before_owed(context, account, contact, projects, price_per_day, days_to_owe, **kwargs)
@@ -48,10 +104,23 @@ class NotifierService(object):
 
 
 class Notifier(object):
-    """Base class for notifier"""
+    """Base class for notifier
+
+    The notifiers that publish notifications set *notifier*, and publish
+    them by _notify(), through the sink of the run if the caller passes
+    one.
+    """
 
     __metaclass__ = abc.ABCMeta
 
+    notifier = None
+
+    def _notify(self, context, event_type, payload, sink=None):
+        if sink:
+            sink.add(self.notifier, context, event_type, payload)
+        else:
+            self.notifier.info(context, event_type, payload)
+
     @abc.abstractmethod
     def notify_has_owed(context, account, contact, projects, **kwargs):
         """Notify account has owed
@@ -14,8 +14,11 @@ LOG = log.getLogger(__name__)
 
 class EmailNotifier(notifier.Notifier):
 
-    @staticmethod
-    def notify_has_owed(context, account, contact, projects, **kwargs):
+    def __init__(self):
+        # NOTE: Reuse one notifier rather than creating one per message
+        self.notifier = gring_notifier.get_notifier(service='checker')
+
+    def notify_has_owed(self, context, account, contact, projects, **kwargs):
         # TODO(chengkun): Now we can't get user contact info,
         # and it will be "unknown". we will add in the future
         account_name = contact.get('real_name') or contact['email'].split('@')[0]
@@ -45,8 +48,8 @@ class EmailNotifier(notifier.Notifier):
                 }
             }
         }
-        notify = gring_notifier.get_notifier(service='checker')
-        notify.info(context, 'uos.account.owed', payload)
+        self._notify(context, 'uos.account.owed', payload,
+                     sink=kwargs.get('sink'))
 
         # Notify us
         if cfg.CONF.checker.support_email:
@@ -70,11 +73,11 @@ class EmailNotifier(notifier.Notifier):
                     }
                 }
             }
-            notify = gring_notifier.get_notifier(service='checker')
-            notify.info(context, 'uos.account.owed', payload)
+            self._notify(context, 'uos.account.owed', payload,
+                         sink=kwargs.get('sink'))
 
-    @staticmethod
-    def notify_before_owed(context, account, contact, projects, price_per_day, days_to_owe, **kwargs):
+    def notify_before_owed(self, context, account, contact, projects,
+                           price_per_day, days_to_owe, **kwargs):
         # Get account info
         account_name = contact.get('real_name') or contact['email'].split('@')[0]
         mobile_number = contact.get('mobile_number') or "unknown"
@@ -100,8 +103,8 @@ class EmailNotifier(notifier.Notifier):
                 }
             }
         }
-        notify = gring_notifier.get_notifier(service='checker')
-        notify.info(context, 'uos.account.will_owed', payload)
+        self._notify(context, 'uos.account.will_owed', payload,
+                     sink=kwargs.get('sink'))
 
         # Notify us
         if cfg.CONF.checker.support_email:
@@ -127,11 +130,11 @@ class EmailNotifier(notifier.Notifier):
                     }
                 }
             }
-            notify = gring_notifier.get_notifier(service='checker')
-            notify.info(context, 'uos.account.will_owed', payload)
+            self._notify(context, 'uos.account.will_owed', payload,
+                         sink=kwargs.get('sink'))
 
-    @staticmethod
-    def notify_order_billing_owed(context, account, contact, order,**kwargs):
+    def notify_order_billing_owed(self, context, account, contact, order,
+                                  **kwargs):
         """Only notify for user with has_owed or will_owed order
         """
         # Get account info
@@ -157,11 +160,11 @@ class EmailNotifier(notifier.Notifier):
                 }
             }
         }
-        notify = gring_notifier.get_notifier(service='checker')
-        notify.info(context, 'uos.account.order_billing_owed', payload)
+        self._notify(context, 'uos.account.order_billing_owed', payload,
+                     sink=kwargs.get('sink'))
 
-    @staticmethod
-    def notify_account_charged(context, account, contact, type, value, bonus=None, **kwargs):
+    def notify_account_charged(self, context, account, contact, type, value,
+                               bonus=None, **kwargs):
         account_name = contact.get('real_name') or contact['email'].split('@')[0]
         mobile_number = contact.get('mobile_number') or "unknown"
         company = contact.get('company') or "unknown"
@@ -184,8 +187,8 @@ class EmailNotifier(notifier.Notifier):
                 }
             }
         }
-        notify = gring_notifier.get_notifier(service='checker')
-        notify.info(context, 'uos.account.charged', payload)
+        self._notify(context, 'uos.account.charged', payload,
+                     sink=kwargs.get('sink'))
 
         # Notify us
         if cfg.CONF.checker.support_email:
@@ -213,8 +216,8 @@ class EmailNotifier(notifier.Notifier):
                     }
                 }
             }
-            notify = gring_notifier.get_notifier(service='checker')
-            notify.info(context, 'uos.account.charged', payload)
+            self._notify(context, 'uos.account.charged', payload,
+                         sink=kwargs.get('sink'))
 
     @staticmethod
     def send_account_info(context, account_infos, email_addr_name):
@@ -2,9 +2,14 @@ import datetime
 import time
 
 from apscheduler.schedulers import background  # noqa
+import eventlet
+from eventlet.green import threading as gthreading  # noqa
+from eventlet import greenpool
+from eventlet import semaphore
 from oslo_config import cfg  # noqa
 import pytz
 
+from gringotts.checker import fixer
 from gringotts.checker import notifier
 from gringotts.client import client
 from gringotts import constants as const
@@ -22,9 +27,23 @@ from gringotts import utils
 
 
 LOG = log.getLogger(__name__)
+
+# Look back a bit more than the last high-water mark, in case the clocks of
+# the services are a bit behind ours
+INCREMENTAL_CHECK_OVERLAP = datetime.timedelta(seconds=60)
+
+# The number of owed accounts whose projects and orders are got in one
+# request, their user ids are passed in the query string
+OWED_ACCOUNTS_DETAIL_CHUNK = 50
+
 TIMESTAMP_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 ISO8601_UTC_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
+# The only attributes of the orders needed to notify the owed accounts
+NOTIFY_ORDER_FIELDS = ['order_id', 'region_id', 'resource_id',
+                       'resource_name', 'type', 'owed', 'date_time',
+                       'cron_time']
+
 
 OPTS = [
     cfg.BoolOpt('try_to_fix',
@@ -60,7 +79,62 @@ OPTS = [
                help="The interval to check if resources match with orders"),
     cfg.IntOpt('check_cron_jobs_interval',
                default=12,
-               help="The interval to check if resources match with orders")
+               help="The interval to check if resources match with orders"),
+    cfg.BoolOpt('balance_by_order_count',
+                default=True,
+                help="Balance the projects across the checkers by their "
+                     "order counts rather than by their numbers"),
+    cfg.IntOpt('chunk_size',
+               default=500,
+               help="The number of assigned projects that are checked and "
+                    "fixed together. A cycle stops at the chunk that fails, "
+                    "and the next cycle starts from it, so the chunks after "
+                    "it are not starved. 0 means all the assigned projects "
+                    "are one chunk"),
+    cfg.IntOpt('incremental_check_interval',
+               default=0,
+               help="The interval in minutes to check only the assigned "
+                    "projects whose resources or orders changed since the "
+                    "last such check. The full check still runs every "
+                    "check_resources_interval hours as a slow sweep. 0 "
+                    "disables it"),
+    cfg.IntOpt('check_workers',
+               default=1,
+               help="The number of projects that are checked concurrently "
+                    "in the region, the resources of a project are listed "
+                    "from all the services concurrently if it is greater "
+                    "than 1"),
+    cfg.IntOpt('service_concurrency',
+               default=4,
+               help="The max number of concurrent list requests to every "
+                    "service when check_workers is greater than 1, so a "
+                    "slow service doesn't take all the workers"),
+    cfg.IntOpt('notify_page_size',
+               default=500,
+               help="The number of owed accounts that are got with their "
+                    "projects and orders in one request when notifying "
+                    "them"),
+    cfg.IntOpt('contact_workers',
+               default=8,
+               help="The number of contacts of the owed accounts that are "
+                    "got from keystone concurrently"),
+    cfg.IntOpt('notify_workers',
+               default=8,
+               help="The number of notifications that are published "
+                    "concurrently in background during a check, the same "
+                    "notifications to a contact are published once"),
+    cfg.IntOpt('fix_batch_size',
+               default=100,
+               help="The number of items of a situation that are fixed in "
+                    "one batch when try_to_fix is enabled"),
+    cfg.FloatOpt('fix_rate',
+                 default=0,
+                 help="The max number of items that are fixed per second, "
+                      "0 means no limit"),
+    cfg.BoolOpt('fix_dry_run',
+                default=False,
+                help="Only report the items that would be fixed when "
+                     "try_to_fix is enabled, without fixing them"),
 ]
 
 cfg.CONF.register_opts(OPTS, group="checker")
@@ -146,8 +220,15 @@ class CheckerService(os_service.Service):
         self.gclient = client.get_client()
         self.master_api = master.API()
         self.ctxt = context.get_admin_context()
+        # job name -> the first project_id of the chunk that failed
+        self.resume_points = {}
+        # project_id -> assigned project, as of the last full check
+        self.assigned_projects = {}
+        self.changes_high_water_mark = None
+        self.resources_check_lock = gthreading.Lock()
         self.notifier = notifier.NotifierService(
-            cfg.CONF.checker.notifier_level)
+            cfg.CONF.checker.notifier_level,
+            workers=cfg.CONF.checker.notify_workers)
 
         job_defaults = {
             'misfire_grace_time': 604800,
@@ -159,6 +240,11 @@ class CheckerService(os_service.Service):
             timezone=pytz.utc)
 
         self.RESOURCE_LIST_METHOD = services.RESOURCE_LIST_METHOD
+        self.RESOURCE_CHANGES_METHOD = services.RESOURCE_CHANGES_METHOD
+        self.service_semaphores = dict(
+            (method, semaphore.Semaphore(
+                max(cfg.CONF.checker.service_concurrency, 1)))
+            for method in self.RESOURCE_LIST_METHOD)
         self.DELETE_METHOD_MAP = services.DELETE_METHOD_MAP
         self.STOP_METHOD_MAP = services.STOP_METHOD_MAP
         self.RESOURCE_STOPPED_STATE = services.RESOURCE_STOPPED_STATE
@@ -170,6 +256,12 @@ class CheckerService(os_service.Service):
         from gringotts.checker import common  # noqa
 
         self.RESOURCE_CREATE_MAP = services.RESOURCE_CREATE_MAP
+        self.fixer = fixer.BatchFixer(
+            self.gclient, self.master_api, self.ctxt,
+            self.RESOURCE_CREATE_MAP,
+            batch_size=cfg.CONF.checker.fix_batch_size,
+            rate=cfg.CONF.checker.fix_rate,
+            dry_run=cfg.CONF.checker.fix_dry_run)
 
         super(CheckerService, self).__init__(*args, **kwargs)
 
@@ -190,6 +282,9 @@ class CheckerService(os_service.Service):
             self.apsched.add_job(self.partition_coordinator.heartbeat,
                                  'interval',
                                  seconds=cfg.CONF.coordination.heartbeat)
+            self.apsched.add_job(self.partition_coordinator.run_watchers,
+                                 'interval',
+                                 seconds=cfg.CONF.coordination.check_watchers)
 
         # NOTE(suo): apscheduler must be started in child process
         self.apsched.start()
@@ -231,6 +326,11 @@ class CheckerService(os_service.Service):
                                      'interval',
                                      hours=period,
                                      start_date=start_date)
+            if cfg.CONF.checker.incremental_check_interval > 0:
+                self.apsched.add_job(
+                    self.check_if_changed_resources_match_orders,
+                    'interval',
+                    minutes=cfg.CONF.checker.incremental_check_interval)
 
         if cfg.CONF.checker.enable_center_jobs:
             for job, period, start_date in center_jobs:
@@ -328,48 +428,154 @@ class CheckerService(os_service.Service):
                                                   deleted_at,
                                                   order['project_id']))
 
+    def _list_resources(self, method, project):
+        with self.service_semaphores[method]:
+            return method(project['project_id'],
+                          region_name=self.region_name,
+                          project_name=project['project_name'])
+
+    def _list_project_resources(self, project):
+        """Yield the resources of the project from every service"""
+        if cfg.CONF.checker.check_workers <= 1:
+            for method in self.RESOURCE_LIST_METHOD:
+                yield method(project['project_id'],
+                             region_name=self.region_name,
+                             project_name=project['project_name'])
+            return
+
+        threads = [eventlet.spawn(self._list_resources, method, project)
+                   for method in self.RESOURCE_LIST_METHOD]
+        results = []
+        error = None
+        # wait for all of them, so no request is left behind
+        for thread in threads:
+            try:
+                results.append(thread.wait())
+            except Exception as e:
+                error = error or e
+        if error:
+            raise error
+        for resources in results:
+            yield resources
+
+    def _check_project(self, project, bad_resources, try_to_fix):
+        # Get all active orders
+        resource_to_order = {}
+        orders = self.gclient.get_active_orders(
+            region_id=self.region_name,
+            project_id=project['project_id'])
+        for order in orders:
+            if not isinstance(order, dict):
+                order = order.as_dict()
+            order['checked'] = False
+            resource_to_order[order['resource_id']] = order
+
+        # Check resource to order
+        for resources in self._list_project_resources(project):
+            for resource in resources:
+                self._check_resource_to_order(resource,
+                                              resource_to_order,
+                                              bad_resources,
+                                              try_to_fix)
+        # Check order to resource
+        for resource_id, order in resource_to_order.items():
+            if order['checked']:
+                continue
+            self._check_order_to_resource(resource_id, order, try_to_fix)
+
     def _check_if_resources_match_orders(self, bad_resources, try_to_fix,
                                          projects):
         """Check one time to collect orders/resources that may need to fix and
         notify
+
+        With check_workers greater than 1, projects are checked concurrently
+        and their findings are merged. The first failure stops checking the
+        projects that are not started yet and is raised once the started
+        ones complete.
         """
-        for project in projects:
-            if project['project_id'] in cfg.CONF.ignore_tenants:
-                continue
-            # Get all active orders
-            resource_to_order = {}
-            orders = self.gclient.get_active_orders(
-                region_id=self.region_name,
-                project_id=project['project_id'])
-            for order in orders:
-                if not isinstance(order, dict):
-                    order = order.as_dict()
-                order['checked'] = False
-                resource_to_order[order['resource_id']] = order
+        projects = [p for p in projects
+                    if p['project_id'] not in cfg.CONF.ignore_tenants]
+        if cfg.CONF.checker.check_workers <= 1:
+            for project in projects:
+                self._check_project(project, bad_resources, try_to_fix)
+            return
 
-            # Check resource to order
-            for method in self.RESOURCE_LIST_METHOD:
-                resources = method(project['project_id'],
-                                   region_name=self.region_name,
-                                   project_name=project['project_name'])
-                for resource in resources:
-                    self._check_resource_to_order(resource,
-                                                  resource_to_order,
-                                                  bad_resources,
-                                                  try_to_fix)
-            # Check order to resource
-            for resource_id, order in resource_to_order.items():
-                if order['checked']:
-                    continue
-                self._check_order_to_resource(resource_id, order, try_to_fix)
+        failures = []
+
+        def check(project):
+            if failures:
+                return
+            project_bad_resources = []
+            project_try_to_fix = dict((k, []) for k in try_to_fix)
+            try:
+                self._check_project(project, project_bad_resources,
+                                    project_try_to_fix)
+            except Exception as e:
+                failures.append(e)
+                return
+            return project_bad_resources, project_try_to_fix
+
+        pool = greenpool.GreenPool(cfg.CONF.checker.check_workers)
+        for result in pool.imap(check, projects):
+            if not result:
+                continue
+            project_bad_resources, project_try_to_fix = result
+            bad_resources.extend(project_bad_resources)
+            for k, items in project_try_to_fix.items():
+                try_to_fix[k].extend(items)
+        if failures:
+            raise failures[0]
 
     def _assigned_projects(self):
         """Only check the active projects
+
+        Projects are assigned by project_id, which never changes, and
+        balanced by their order counts, so that a huge project doesn't make
+        its checker much slower than the others.
+
+        NOTE: The bounded assignment depends on the order counts, which
+        every checker reads on its own at its own time. If the counts
+        change between the reads, the checkers may not agree on the
+        assignment until their next full checks, and a project may be
+        checked by two checkers or by none meanwhile. The assignment by
+        project_id only, without balance_by_order_count, is always agreed.
         """
-        projects = list(self.gclient.get_projects(type='simple',
-                                                  duration='30d'))
-        return self.partition_coordinator.extract_my_subset(
-            self.PARTITIONING_GROUP_NAME, projects)
+        balance = cfg.CONF.checker.balance_by_order_count
+        projects = list(self.gclient.get_projects(
+            type='simple', duration='30d',
+            with_order_count=balance or None,
+            region_id=self.region_name if balance else None))
+        size = None
+        if balance:
+            def size(project):
+                return max(project.get('order_count') or 0, 1)
+        projects = self.partition_coordinator.extract_my_subset(
+            self.PARTITIONING_GROUP_NAME, projects,
+            key=lambda p: p['project_id'], size=size)
+        self.assigned_projects = dict((p['project_id'], p)
+                                      for p in projects)
+        return sorted(projects, key=lambda p: p['project_id'])
+
+    def _iter_chunks(self, job, projects):
+        """Split the sorted projects into chunks
+
+        The chunks start from the one that failed in the last cycle of the
+        job, if any.
+
+        NOTE: The chunks are only split from the projects assigned to this
+        checker, and the resume points are kept in this process, they are
+        not claimed from a queue shared by the checkers. The projects of a
+        checker that dies or hangs are not checked until the members of
+        the group change and they are assigned to the others.
+        """
+        resume_from = self.resume_points.pop(job, None)
+        if resume_from:
+            index = next((i for i, p in enumerate(projects)
+                          if p['project_id'] >= resume_from), 0)
+            projects = projects[index:] + projects[:index]
+        chunk_size = cfg.CONF.checker.chunk_size or len(projects) or 1
+        for i in range(0, len(projects), chunk_size):
+            yield projects[i:i + chunk_size]
 
     def check_if_resources_match_orders(self):
         """Check if resources match with orders
@@ -388,33 +594,137 @@ class CheckerService(os_service.Service):
 
         For auto-recovery, we only do this if we can ensure all services are
         ok, or it will skip this circle, do the check and auto-recovery in the
-        next circle.
+        next circle. The assigned projects are checked and fixed chunk by
+        chunk, the next circle starts from the chunk that failed.
         """
-        bad_resources_1 = []
-        bad_resources_2 = []
-        try_to_fix_1 = {'1': [], '2': [], '3': [], '4': [], '5': []}
-        try_to_fix_2 = {'1': [], '2': [], '3': [], '4': [], '5': []}
-
         projects = self._assigned_projects()
         LOG.warn("[%s] Checking if resources match with orders, assigned "
                  "projects number: %s", self.member_id, len(projects))
 
-        try:
-            self._check_if_resources_match_orders(bad_resources_1,
-                                                  try_to_fix_1,
-                                                  projects)
-            time.sleep(30)
-            self._check_if_resources_match_orders(bad_resources_2,
-                                                  try_to_fix_2,
-                                                  projects)
-        except Exception:
-            LOG.exception("Some exceptions occurred when checking whether "
-                          "resources match with orders, skip this checking "
-                          "circle.")
+        with self.resources_check_lock:
+            failed_chunk = self._check_chunks_if_resources_match_orders(
+                self._iter_chunks('resources', projects))
+            if failed_chunk:
+                self.resume_points['resources'] = \
+                    failed_chunk[0]['project_id']
+
+    def _get_changed_projects(self, since):
+        """Return the assigned projects that changed since the time
+
+        A project changed if it has orders created, or resources changed in
+        the services that can tell, since the time.
+        """
+        project_ids = set(self.gclient.get_changed_order_projects(
+            since.isoformat(), region_id=self.region_name))
+        for method in self.RESOURCE_CHANGES_METHOD:
+            project_ids.update(method(since, region_name=self.region_name))
+        project_ids -= set(cfg.CONF.ignore_tenants)
+
+        if not self.assigned_projects:
+            self._assigned_projects()
+        projects = [self.assigned_projects[project_id]
+                    for project_id in project_ids
+                    if project_id in self.assigned_projects]
+
+        # Projects that are new since the last full check are assigned by
+        # their ids only, until the next full check knows their sizes
+        new_project_ids = self.partition_coordinator.extract_my_subset(
+            self.PARTITIONING_GROUP_NAME,
+            [project_id for project_id in project_ids
+             if project_id not in self.assigned_projects])
+        projects.extend({'project_id': project_id, 'project_name': None}
+                        for project_id in new_project_ids)
+        return sorted(projects, key=lambda p: p['project_id'])
+
+    def check_if_changed_resources_match_orders(self):
+        """Check if resources match with orders in the changed projects
+
+        It does the same check as check_if_resources_match_orders, but only
+        for the projects that changed since the high-water mark of the last
+        successful check, which is only moved forward if all of them are
+        checked, so no change is missed. It is skipped while the full check
+        is running.
+        """
+        if not self.resources_check_lock.acquire(False):
+            LOG.warn("[%s] The full check is running, skip checking the "
+                     "changed projects", self.member_id)
             return
+        try:
+            now = datetime.datetime.utcnow()
+            if self.changes_high_water_mark:
+                since = self.changes_high_water_mark
+            else:
+                since = now - datetime.timedelta(
+                    minutes=cfg.CONF.checker.incremental_check_interval)
+            since -= INCREMENTAL_CHECK_OVERLAP
 
-        # NOTE(suo): We only do the auto-fix when there is not any exceptions
+            try:
+                projects = self._get_changed_projects(since)
+            except Exception:
+                LOG.exception("Fail to get the projects changed since %s",
+                              since)
+                return
+            LOG.warn("[%s] Checking if resources match with orders, changed "
+                     "projects number: %s", self.member_id, len(projects))
+
+            if self._check_chunks_if_resources_match_orders(
+                    self._iter_chunks('changed_resources', projects)):
+                return
+            self.changes_high_water_mark = now
+        finally:
+            self.resources_check_lock.release()
+
+    def _check_chunks_if_resources_match_orders(self, chunks):
+        """Check the chunks twice, 30 seconds apart, and fix them
+
+        Every chunk is checked once before the pass sleeps, so the pass
+        sleeps only once however many chunks it has. Then every chunk is
+        checked again, and fixed if it is checked twice successfully.
+
+        :returns: The chunk that failed, which the next circle starts from,
+                  or None if all of them are checked.
+        """
+        failed_chunk = None
+        checked = []
+        for chunk in chunks:
+            bad_resources = []
+            try_to_fix = {'1': [], '2': [], '3': [], '4': [], '5': []}
+            try:
+                self._check_if_resources_match_orders(bad_resources,
+                                                      try_to_fix, chunk)
+            except Exception:
+                LOG.exception("Some exceptions occurred when checking "
+                              "whether resources match with orders, skip "
+                              "this checking circle.")
+                failed_chunk = chunk
+                break
+            checked.append((chunk, bad_resources, try_to_fix))
+
+        if checked:
+            time.sleep(30)
 
+        for chunk, bad_resources_1, try_to_fix_1 in checked:
+            bad_resources_2 = []
+            try_to_fix_2 = {'1': [], '2': [], '3': [], '4': [], '5': []}
+            try:
+                self._check_if_resources_match_orders(bad_resources_2,
+                                                      try_to_fix_2, chunk)
+            except Exception:
+                LOG.exception("Some exceptions occurred when checking "
+                              "whether resources match with orders, skip "
+                              "this checking circle.")
+                return chunk
+
+            # NOTE(suo): We only do the auto-fix when there is not any
+            # exceptions
+            self._fix_resources_not_match_orders(bad_resources_1,
+                                                 try_to_fix_1,
+                                                 bad_resources_2,
+                                                 try_to_fix_2)
+        return failed_chunk
+
+    def _fix_resources_not_match_orders(self, bad_resources_1, try_to_fix_1,
+                                        bad_resources_2, try_to_fix_2):
         # Warning bad resources
         bad_resources = [x for x in bad_resources_2 if x in bad_resources_1]
         if bad_resources:
@@ -437,59 +747,39 @@ class CheckerService(os_service.Service):
             LOG.warn("[%s] Situation 1: In project(%s), the resource(%s) "
                      "has no order",
                      self.member_id, resource.project_id, resource.id)
-            if cfg.CONF.checker.try_to_fix:
-                create_cls = self.RESOURCE_CREATE_MAP[resource.resource_type]
-                create_cls.create_order(resource)
         # Situation 2
         for item in try_to_fix_situ_2:
             LOG.warn("[%s] Situation 2: In project(%s), the order(%s) and "
                      "its resource's status doesn't match",
                      self.member_id, item.project_id, item.order_id)
-            if cfg.CONF.checker.try_to_fix:
-                if (item.resource_type == const.RESOURCE_INSTANCE and
-                        item.change_to == const.STATE_STOPPED):
-                    self.master_api.instance_stopped(self.ctxt,
-                                                     item.order_id,
-                                                     item.action_time)
-                else:
-                    self.master_api.resource_changed(self.ctxt,
-                                                     item.order_id,
-                                                     item.action_time,
-                                                     change_to=item.change_to,
-                                                     remarks="System Adjust")
         # Situation 3
         for item in try_to_fix_situ_3:
             LOG.warn("[%s] Situation 3: In project(%s), the order(%s) "
                      "has no bills",
                      self.member_id, item.project_id, item.order_id)
-            if cfg.CONF.checker.try_to_fix:
-                self.master_api.resource_created_again(
-                    self.ctxt,
-                    item.order_id,
-                    item.resource_created_at,
-                    "Sytstem Adjust")
         # Situation 4
         for item in try_to_fix_situ_4:
             LOG.warn("[%s] Situation 4: In project(%s), the order(%s)'s "
                      "resource has been deleted.",
                      self.member_id, item.project_id, item.order_id)
-            if cfg.CONF.checker.try_to_fix:
-                self.master_api.resource_deleted(self.ctxt,
-                                                 item.order_id,
-                                                 item.deleted_at,
-                                                 "Resource Has Been Deleted")
         # Situation 5
         for item in try_to_fix_situ_5:
             LOG.warn("[%s] Situation 5: In project(%s), the order(%s)'s "
                      "unit_price is wrong, should be %s",
                      self.member_id, item.project_id,
                      item.order_id, item.unit_price)
-            if cfg.CONF.checker.try_to_fix:
-                resource_type = item.resource.resource_type
-                create_cls = self.RESOURCE_CREATE_MAP[resource_type]
-                create_cls.change_unit_price(item.resource,
-                                             item.resource.status,
-                                             item.order_id)
+
+        if cfg.CONF.checker.try_to_fix:
+            report = self.fixer.fix({'1': try_to_fix_situ_1,
+                                     '2': try_to_fix_situ_2,
+                                     '3': try_to_fix_situ_3,
+                                     '4': try_to_fix_situ_4,
+                                     '5': try_to_fix_situ_5})
+            for situation, ids in sorted(report.items()):
+                LOG.warn("[%s] Situation %s: %s %s items: %s",
+                         self.member_id, situation,
+                         'would fix' if self.fixer.dry_run else 'fixed',
+                         len(ids), ids)
 
     def _check_if_owed_resources_match_owed_orders(self,
                                                    should_stop_resources,
@@ -540,34 +830,68 @@ class CheckerService(os_service.Service):
                     should_stop_resources.append(resource)
 
     def check_if_owed_resources_match_owed_orders(self):
-        should_stop_resources_1 = []
-        should_stop_resources_2 = []
-        should_delete_resources_1 = []
-        should_delete_resources_2 = []
-
         projects = self._assigned_projects()
         LOG.warn("[%s] Checking if owed resources match with owed orders, "
                  "assigned project number: %s",
                  self.member_id, len(projects))
 
-        try:
-            self._check_if_owed_resources_match_owed_orders(
-                should_stop_resources_1,
-                should_delete_resources_1,
-                projects)
-            time.sleep(30)
-            self._check_if_owed_resources_match_owed_orders(
-                should_stop_resources_2,
-                should_delete_resources_2,
-                projects)
-        except Exception:
-            LOG.exception("Some exceptions occurred when checking whether "
-                          "owed resources match with owed orders, skip this "
-                          "checking circle.")
-            return
+        failed_chunk = self._check_chunks_if_owed_resources_match_owed_orders(
+            self._iter_chunks('owed_resources', projects))
+        if failed_chunk:
+            self.resume_points['owed_resources'] = \
+                failed_chunk[0]['project_id']
 
-        # NOTE(suo): We only do the auto-fix when there is not any exceptions
+    def _check_chunks_if_owed_resources_match_owed_orders(self, chunks):
+        """Check the chunks twice, 30 seconds apart, and fix them
+
+        Like _check_chunks_if_resources_match_orders, the pass sleeps only
+        once, and returns the chunk that failed, or None.
+        """
+        failed_chunk = None
+        checked = []
+        for chunk in chunks:
+            should_stop_resources = []
+            should_delete_resources = []
+            try:
+                self._check_if_owed_resources_match_owed_orders(
+                    should_stop_resources, should_delete_resources, chunk)
+            except Exception:
+                LOG.exception("Some exceptions occurred when checking "
+                              "whether owed resources match with owed "
+                              "orders, skip this checking circle.")
+                failed_chunk = chunk
+                break
+            checked.append((chunk, should_stop_resources,
+                            should_delete_resources))
+
+        if checked:
+            time.sleep(30)
 
+        for chunk, should_stop_resources_1, should_delete_resources_1 in \
+                checked:
+            should_stop_resources_2 = []
+            should_delete_resources_2 = []
+            try:
+                self._check_if_owed_resources_match_owed_orders(
+                    should_stop_resources_2, should_delete_resources_2, chunk)
+            except Exception:
+                LOG.exception("Some exceptions occurred when checking "
+                              "whether owed resources match with owed "
+                              "orders, skip this checking circle.")
+                return chunk
+
+            # NOTE(suo): We only do the auto-fix when there is not any
+            # exceptions
+            self._fix_owed_resources(should_stop_resources_1,
+                                     should_delete_resources_1,
+                                     should_stop_resources_2,
+                                     should_delete_resources_2)
+        return failed_chunk
+
+    def _fix_owed_resources(self, should_stop_resources_1,
+                            should_delete_resources_1,
+                            should_stop_resources_2,
+                            should_delete_resources_2):
         should_stop_resources = [x for x in should_stop_resources_2
                                  if x in should_stop_resources_1]
         should_delete_resources = [x for x in should_delete_resources_2
@@ -657,179 +981,249 @@ class CheckerService(os_service.Service):
     def _assigned_accounts(self):
         accounts = list(self.gclient.get_accounts(duration='30d'))
         return self.partition_coordinator.extract_my_subset(
-            self.PARTITIONING_GROUP_NAME, accounts)
+            self.PARTITIONING_GROUP_NAME, accounts,
+            key=lambda a: a['user_id'])
 
-    def check_owed_hour_resources_and_notify(self):  # noqa
-        """Check owed hour-billing resources and notify them
+    def _iter_owed_accounts(self, bill_methods, days_to_owe=None):
+        """Yield the assigned accounts that have owed or will owe page by page
+
+        Only the accounts active within 30 days are notified. Every checker
+        pages through the accounts without their projects and orders, and
+        only gets them for the accounts assigned to it, so the orders of an
+        account are only got by its checker.
 
-        Get owed accounts, send them sms/email notifications.
+        Every account comes with its projects and their active orders.
         """
-        try:
-            accounts = self._assigned_accounts()
-        except Exception:
-            LOG.exception("Fail to get assigned accounts")
-            accounts = []
-        LOG.warn("[%s] Notifying owed accounts, assigned accounts number: %s",
-                 self.member_id, len(accounts))
+        limit = cfg.CONF.checker.notify_page_size
+        offset = 0
+        while True:
+            accounts = self.gclient.get_owed_accounts(
+                bill_methods=bill_methods,
+                days_to_owe=days_to_owe,
+                duration='30d',
+                detail=False,
+                limit=limit,
+                offset=offset)
+            if not accounts:
+                return
+            user_ids = [account['user_id'] for account in
+                        self.partition_coordinator.extract_my_subset(
+                            self.PARTITIONING_GROUP_NAME, accounts,
+                            key=lambda a: a['user_id'])]
+            for i in range(0, len(user_ids), OWED_ACCOUNTS_DETAIL_CHUNK):
+                yield self.gclient.get_owed_accounts(
+                    bill_methods=bill_methods,
+                    days_to_owe=days_to_owe,
+                    user_ids=user_ids[i:i + OWED_ACCOUNTS_DETAIL_CHUNK])
+            if len(accounts) < limit:
+                return
+            offset += limit
 
-        bill_methods=['hour',]
+    def _get_project_names(self):
+        project_names = {}
+        for domain in keystone.get_domain_list():
+            for project in keystone.get_project_list(domain.id):
+                project_names[project.id] = project.name
+        return project_names
 
-        for account in accounts:
-            try:
-                if not isinstance(account, dict):
-                    account = account.as_dict()
+    def _prefetch_contacts(self, user_ids, get_contact):
+        """Get the contacts of the users concurrently
 
-                if account['level'] == 9:
+        The users whose contacts fail to be got are left out.
+        """
+        def get(user_id):
+            try:
+                return user_id, get_contact(user_id)
+            except Exception:
+                LOG.exception("Fail to get the contact of user %s", user_id)
+                return user_id, None
+
+        pool = greenpool.GreenPool(
+            max(cfg.CONF.checker.contact_workers, 1))
+        return dict((user_id, contact)
+                    for user_id, contact in pool.imap(get, user_ids)
+                    if contact)
+
+    def _resource_exists(self, order):
+        resource = self.RESOURCE_GET_MAP[order['type']](
+            order['resource_id'],
+            region_name=order['region_id'])
+        if not resource:
+            LOG.warn("[%s] The resource(%s|%s) has been deleted",
+                     self.member_id, order['type'], order['resource_id'])
+        return bool(resource)
+
+    def _get_has_owed_projects(self, account, project_names):
+        projects = []
+        for project in account['projects']:
+            orders = []
+            for order in project['orders']:
+                if not order['owed'] or not self._resource_exists(order):
                     continue
 
-                if account['owed']:
-                    orders = list(
-                        self.gclient.get_active_orders(
-                            user_id=account['user_id'],
-                            owed=True,
-                            bill_methods=bill_methods)
-                    )
-                    if not orders:
-                        continue
+                order_d = {}
+                order_d['order_id'] = order['order_id']
+                order_d['region_id'] = order['region_id']
+                order_d['resource_id'] = order['resource_id']
+                order_d['resource_name'] = order['resource_name']
+                order_d['type'] = order['type']
 
-                    contact = keystone.get_user(account['user_id']).to_dict()
-                    _projects = self.gclient.get_projects(
-                        user_id=account['user_id'],
-                        type='simple')
-
-                    orders_dict = {}
-                    for project in _projects:
-                        orders_dict[project['project_id']] = []
-
-                    for order in orders:
-                        # check if the resource exists
-                        resource = self.RESOURCE_GET_MAP[order['type']](
-                            order['resource_id'],
-                            region_name=order['region_id'])
-                        if not resource:
-                            # NOTE(chengkun): just warning if the resource not exists
-                            LOG.warn("[%s] The resource(%s|%s) has been "
-                                     "deleted",
-                                     self.member_id,
-                                     order['type'], order['resource_id'])
-                            continue
-
-                        order_d = {}
-                        order_d['order_id'] = order['order_id']
-                        order_d['region_id'] = order['region_id']
-                        order_d['resource_id'] = order['resource_id']
-                        order_d['resource_name'] = order['resource_name']
-                        order_d['type'] = order['type']
-
-                        if isinstance(order['date_time'], basestring):
-                            order['date_time'] = timeutils.parse_strtime(
-                                order['date_time'],
-                                fmt=ISO8601_UTC_TIME_FORMAT)
-
-                        now = datetime.datetime.utcnow()
-                        reserved_days = (order['date_time'] - now).days
-                        if reserved_days < 0:
-                            LOG.warn("[%s] The order %s reserved_days is "
-                                     "less than 0",
-                                     self.member_id, order['order_id'])
-                            reserved_days = 0
-                        order_d['reserved_days'] = reserved_days
-
-                        order_d['date_time'] = timeutils.strtime(
-                            order['date_time'],
-                            fmt=ISO8601_UTC_TIME_FORMAT)
+                if isinstance(order['date_time'], basestring):
+                    order['date_time'] = timeutils.parse_strtime(
+                        order['date_time'],
+                        fmt=ISO8601_UTC_TIME_FORMAT)
 
-                        orders_dict[order['project_id']].append(order_d)
+                now = datetime.datetime.utcnow()
+                reserved_days = (order['date_time'] - now).days
+                if reserved_days < 0:
+                    LOG.warn("[%s] The order %s reserved_days is "
+                             "less than 0",
+                             self.member_id, order['order_id'])
+                    reserved_days = 0
+                order_d['reserved_days'] = reserved_days
+
+                order_d['date_time'] = timeutils.strtime(
+                    order['date_time'],
+                    fmt=ISO8601_UTC_TIME_FORMAT)
+                orders.append(order_d)
+
+            if orders:
+                projects.append({
+                    'project_id': project['project_id'],
+                    'project_name': project_names.get(project['project_id']),
+                    'orders': orders,
+                })
+        return projects
+
+    def _get_before_owed_projects(self, account, project_names):
+        """Return the projects and the price per day of the account if it
+        will owe within days_to_owe days, or None
+        """
+        estimation = {}
+        price_per_hour = 0
+        for project in account['projects']:
+            estimation[project['project_id']] = 0
+            for order in project['orders']:
+                if not self._resource_exists(order):
+                    continue
+                unit_price = utils._quantize_decimal(order['unit_price'])
+                price_per_hour += unit_price
+                estimation[project['project_id']] += unit_price
 
-                    projects = []
-                    for project in _projects:
-                        if orders_dict[project['project_id']]:
-                            adict = {}
-                            adict['project_id'] = project['project_id']
-                            adict['project_name'] = project['project_name']
-                            adict['orders'] = (orders_dict[
-                                               project['project_id']])
-                            projects.append(adict)
+        price_per_day = price_per_hour * 24
+        if price_per_day == 0:
+            return
 
-                    if not projects:
-                        continue
+        account_balance = utils._quantize_decimal(account['balance'])
+        days_to_owe = round(float(account_balance / price_per_day))
+        if days_to_owe > cfg.CONF.checker.days_to_owe:
+            return
 
-                    reserved_days = utils.cal_reserved_days(account['level'])
-                    account['reserved_days'] = reserved_days
-                    country_code = contact.get("country_code") or "86"
-                    language = "en_US" if country_code != '86' else "zh_CN"
-                    self.notifier.notify_has_owed(self.ctxt, account, contact,
-                                                  projects, language=language)
-                else:
-                    orders = self.gclient.get_active_orders(
-                        user_id=account['user_id'],
-                        bill_methods=bill_methods)
-                    if not orders:
-                        continue
+        projects = []
+        for project in account['projects']:
+            projects.append({
+                'project_id': project['project_id'],
+                'project_name': project_names.get(project['project_id']),
+                'estimation': str(estimation[project['project_id']] * 24),
+            })
+        if not projects:
+            return
+        return projects, price_per_day, days_to_owe
 
-                    _projects = self.gclient.get_projects(
-                        user_id=account['user_id'], type='simple')
-
-                    estimation = {}
-                    for project in _projects:
-                        estimation[project['project_id']] = 0
-
-                    price_per_hour = 0
-                    for order in orders:
-                        # check if the resource exists
-                        resource = self.RESOURCE_GET_MAP[order['type']](
-                            order['resource_id'],
-                            region_name=order['region_id'])
-                        if not resource:
-                            # just warning the resource not exists
-                            LOG.warn("[%s] The resource(%s|%s) may has been "
-                                     "deleted",
-                                     self.member_id, order['type'],
-                                     order['resource_id'])
-                            continue
-
-                        price_per_hour += utils._quantize_decimal(
-                            order['unit_price'])
-                        estimation[order['project_id']] += \
-                            utils._quantize_decimal(order['unit_price'])
-
-                    price_per_day = price_per_hour * 24
-                    account_balance = utils._quantize_decimal(
-                        account['balance'])
-
-                    if price_per_day == 0:
-                        continue
+    def check_owed_hour_resources_and_notify(self):
+        """Check owed hour-billing resources and notify them
 
-                    days_to_owe_d = float(account_balance / price_per_day)
-                    days_to_owe = round(days_to_owe_d)
+        The accounts that have owed or will owe, with the active orders of
+        their projects, are got page by page, and the contacts of a page
+        are got concurrently before it is notified.
+        """
+        LOG.warn("[%s] Notifying owed accounts of hourly orders",
+                 self.member_id)
+        try:
+            project_names = self._get_project_names()
+        except Exception:
+            LOG.exception("Fail to get the names of the projects")
+            return
 
-                    if days_to_owe > cfg.CONF.checker.days_to_owe:
-                        continue
+        pages = self._iter_owed_accounts(
+            ['hour'], days_to_owe=cfg.CONF.checker.days_to_owe)
+        sink = self.notifier.new_sink()
+        notified = 0
+        while True:
+            try:
+                accounts = next(pages)
+            except StopIteration:
+                break
+            except Exception:
+                LOG.exception("Fail to get owed accounts")
+                break
 
-                    # caculate projects
-                    projects = []
-                    for project in _projects:
-                        adict = {}
-                        adict['project_id'] = project['project_id']
-                        adict['project_name'] = project['project_name']
-                        adict['estimation'] = str(
-                            estimation[project['project_id']] * 24)
-                        projects.append(adict)
-
-                    if not projects:
-                        continue
+            has_owed = []
+            before_owed = []
+            for account in accounts:
+                try:
+                    if account['owed']:
+                        projects = self._get_has_owed_projects(account,
+                                                               project_names)
+                        if projects:
+                            has_owed.append((account, projects))
+                    else:
+                        result = self._get_before_owed_projects(
+                            account, project_names)
+                        if result:
+                            before_owed.append((account, result))
+                except Exception:
+                    LOG.exception("Some exceptions occurred when checking "
+                                  "owed account: %s", account['user_id'])
+
+            contacts = self._prefetch_contacts(
+                [account['user_id'] for account, _ in has_owed],
+                lambda user_id: keystone.get_user(user_id).to_dict())
+            uos_contacts = self._prefetch_contacts(
+                [account['user_id'] for account, _ in before_owed],
+                keystone.get_uos_user)
+
+            for account, projects in has_owed:
+                contact = contacts.get(account['user_id'])
+                if not contact:
+                    continue
+                try:
+                    account['reserved_days'] = utils.cal_reserved_days(
+                        account['level'])
+                    country_code = contact.get("country_code") or "86"
+                    language = "en_US" if country_code != '86' else "zh_CN"
+                    self.notifier.notify_has_owed(self.ctxt, account,
+                                                  contact, projects,
+                                                  language=language,
+                                                  sink=sink)
+                    notified += 1
+                except Exception:
+                    LOG.exception("Fail to notify owed account: %s",
+                                  account['user_id'])
 
-                    contact = keystone.get_uos_user(account['user_id'])
+            for account, (projects, price_per_day, days_to_owe) in \
+                    before_owed:
+                contact = uos_contacts.get(account['user_id'])
+                if not contact:
+                    continue
+                try:
                     country_code = contact.get("country_code") or "86"
                     language = "en_US" if country_code != '86' else "zh_CN"
                     self.notifier.notify_before_owed(self.ctxt, account,
                                                      contact, projects,
                                                      str(price_per_day),
                                                      days_to_owe,
-                                                     language=language)
-            except Exception:
-                LOG.exception("Some exceptions occurred when checking owed "
-                              "account: %s", account['user_id'])
+                                                     language=language,
+                                                     sink=sink)
+                    notified += 1
+                except Exception:
+                    LOG.exception("Fail to notify account that will owe: "
+                                  "%s", account['user_id'])
+
+        if sink:
+            sink.flush()
+        LOG.warn("[%s] Notified %s owed accounts of hourly orders",
+                 self.member_id, notified)
 
     def check_owed_order_resources_and_notify(self):  #noqa
         """Check order-billing resources and notify related accounts
@@ -845,6 +1239,7 @@ class CheckerService(os_service.Service):
                  self.member_id, len(accounts))
 
         bill_methods = ['month', 'year']
+        sink = self.notifier.new_sink()
 
         for account in accounts:
             try:
@@ -862,7 +1257,8 @@ class CheckerService(os_service.Service):
                 orders = list(
                     self.gclient.get_active_orders(
                         user_id=account['user_id'],
-                        bill_methods=bill_methods)
+                        bill_methods=bill_methods,
+                        fields=NOTIFY_ORDER_FIELDS)
                 )
 
                 for order in orders:
@@ -920,13 +1316,17 @@ class CheckerService(os_service.Service):
 
                     is_notify_will_owed = (order_d['reserved_days'] <= cfg.CONF.checker.days_to_owe)
                     if order_d['owed'] or (not order_d['owed'] and is_notify_will_owed):
-                        self.notifier.notify_order_billing_owed(self.ctxt, account, contact,
-                                                                order_d, language=language)
+                        self.notifier.notify_order_billing_owed(
+                            self.ctxt, account, contact, order_d,
+                            language=language, sink=sink)
 
             except Exception:
                 LOG.exception("Some exceptions occurred when checking owed "
                               "account: %s", account['user_id'])
 
+        if sink:
+            sink.flush()
+
     def _figure_out_difference(self, alist, akey, blist, bkey):
         ab = []
         s = 0
@@ -944,7 +1344,7 @@ class CheckerService(os_service.Service):
         return ab
 
     def _check_user_to_account(self):
-        accounts = sorted(self.gclient.get_accounts(),
+        accounts = sorted(self.gclient.get_accounts(fields=['user_id']),
                           key=lambda account: account['user_id'])
         users = sorted(keystone.get_user_list(), key=lambda user: user.id)
 
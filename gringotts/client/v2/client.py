@@ -102,6 +102,15 @@ class Client(object):
                      **kwargs)
         self.client.post('/orders', body=_body)
 
+    def create_orders(self, orders):
+        """Create a batch of orders
+
+        :param orders: A list of dicts, each has the keys of create_order.
+        """
+        _body = dict(orders=[dict(order, unit_price=str(order['unit_price']))
+                             for order in orders])
+        self.client.post('/orders/batch', body=_body)
+
     def change_order(self, order_id, change_to, cron_time=None,
                      change_order_status=True, first_change_to=None):
         _body = dict(order_id=order_id,
@@ -128,18 +137,26 @@ class Client(object):
         return []
 
     def get_active_orders(self, user_id=None, project_id=None, owed=None,
-                          charged=None, region_id=None, bill_methods=None):
+                          charged=None, region_id=None, bill_methods=None,
+                          fields=None):
         params = dict(user_id=user_id,
                       project_id=project_id,
                       owed=owed,
                       charged=charged,
                       region_id=region_id,
-                      bill_methods=bill_methods)
+                      bill_methods=bill_methods,
+                      fields=fields)
         resp, body = self.client.get('/orders/active', params=params)
         if body:
             return body
         return []
 
+    def get_changed_order_projects(self, since, region_id=None):
+        params = dict(since=since,
+                      region_id=region_id)
+        resp, body = self.client.get('/orders/changed', params=params)
+        return body or []
+
     def get_active_order_count(self, region_id=None, owed=None, type=None,
                                bill_methods=None):
         params = dict(region_id=region_id,
@@ -184,12 +201,31 @@ class Client(object):
                      **kwargs)
         self.client.post('/accounts', body=_body)
 
-    def get_accounts(self, owed=None, duration=None):
+    def get_accounts(self, owed=None, duration=None, fields=None):
         params = dict(owed=owed,
-                      duration=duration)
+                      duration=duration,
+                      fields=fields)
         resp, body = self.client.get('/accounts', params=params)
         return body['accounts']
 
+    def get_owed_accounts(self, bill_methods=None, days_to_owe=None,
+                          duration=None, user_ids=None, detail=None,
+                          limit=None, offset=None):
+        params = dict(bill_methods=bill_methods,
+                      days_to_owe=days_to_owe,
+                      duration=duration,
+                      user_ids=user_ids,
+                      detail=detail,
+                      limit=limit,
+                      offset=offset)
+        resp, body = self.client.get('/accounts/owed', params=params)
+        return body
+
+    def refresh_balance_snapshots(self, limit=None):
+        params = dict(limit=limit)
+        resp, body = self.client.post('/accounts/snapshots', params=params)
+        return body
+
     def get_account(self, user_id):
         resp, body = self.client.get('/accounts/%s' % user_id)
         return body
@@ -207,10 +243,13 @@ class Client(object):
                      consumption=consumption)
         self.client.post('/projects', body=_body)
 
-    def get_projects(self, user_id=None, type=None, duration=None):
+    def get_projects(self, user_id=None, type=None, duration=None,
+                     with_order_count=None, region_id=None):
         params = dict(user_id=user_id,
                       type=type,
-                      duration=duration)
+                      duration=duration,
+                      with_order_count=with_order_count,
+                      region_id=region_id)
         resp, body = self.client.get('/projects', params=params)
         return body
 
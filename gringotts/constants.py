@@ -59,5 +59,14 @@ BILL_ORDER_OWED = 2
 BILL_OWED_ACCOUNT_CHARGED = 3
 
 
+# Ledger entry type
+LEDGER_BILL = 'bill'
+LEDGER_CHARGE = 'charge'
+LEDGER_BONUS = 'bonus'
+LEDGER_TRANSFER = 'transfer'
+LEDGER_PRECHARGE = 'precharge'
+LEDGER_EXTERNAL = 'external'
+
+
 ORDER_TYPE = ['instance', 'image', 'snapshot', 'volume', 'router',
               'listener', 'floatingip', 'alarm', 'share']
@@ -13,6 +13,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import json
+import time
 import uuid
 
 from oslo_config import cfg
@@ -37,7 +39,12 @@ OPTS = [
     cfg.FloatOpt('check_watchers',
                  default=10.0,
                  help='Number of seconds between checks to see if group '
-                      'membership has changed')
+                      'membership has changed'),
+    cfg.IntOpt('member_weight',
+               default=1,
+               help='The weight of this member in the partitioning groups '
+                    'it joins, a member of weight 2 is assigned twice as '
+                    'many objects as a member of weight 1.'),
 
 ]
 cfg.CONF.register_opts(OPTS, group='coordination')
@@ -62,6 +69,9 @@ class PartitionCoordinator(object):
         self._groups = set()
         self._my_id = my_id or str(uuid.uuid4())
         self._started = False
+        # group_id -> (members, hash ring, expire time)
+        self._rings = {}
+        self._watched_groups = set()
 
     def start(self):
         backend_url = cfg.CONF.coordination.backend_url
@@ -90,6 +100,8 @@ class PartitionCoordinator(object):
         finally:
             self._coordinator = None
             self._started = False
+            self._rings.clear()
+            self._watched_groups.clear()
 
     def is_active(self):
         return self._coordinator is not None
@@ -117,9 +129,12 @@ class PartitionCoordinator(object):
     def join_group(self, group_id):
         if not self._coordinator or not self._started or not group_id:
             return
+        capabilities = json.dumps(
+            {'weight': cfg.CONF.coordination.member_weight})
         while True:
             try:
-                join_req = self._coordinator.join_group(group_id)
+                join_req = self._coordinator.join_group(
+                    group_id, capabilities=capabilities)
                 join_req.get()
                 LOG.info('Joined partitioning group %s', group_id)
                 break
@@ -132,6 +147,13 @@ class PartitionCoordinator(object):
                 except tooz.coordination.GroupAlreadyExist:
                     pass
         self._groups.add(group_id)
+        if group_id not in self._watched_groups:
+            self.watch_group(group_id, self._members_changed)
+            self._watched_groups.add(group_id)
+
+    def _members_changed(self, event):
+        # the ring is rebuilt the next time it is used
+        self._rings.pop(event.group_id, None)
 
     def leave_group(self, group_id):
         if group_id not in self._groups:
@@ -139,6 +161,7 @@ class PartitionCoordinator(object):
         if self._coordinator:
             self._coordinator.leave_group(group_id)
             self._groups.remove(group_id)
+            self._rings.pop(group_id, None)
             LOG.info('Left partitioning group %s', group_id)
 
     def _get_members(self, group_id):
@@ -161,23 +184,97 @@ class PartitionCoordinator(object):
                 # It will do noting when first time to join group.
                 return []
 
-    def extract_my_subset(self, group_id, iterable):
+    def get_members(self, group_id):
+        """Return the members of the group without joining it.
+
+        An empty list is returned if the coordination backend is not
+        available, so the caller can fall back to unpartitioned work.
+        """
+        if not self._coordinator:
+            return []
+        try:
+            return list(self._coordinator.get_members(group_id).get())
+        except tooz.coordination.ToozError:
+            LOG.exception('Error getting group membership info from '
+                          'coordination backend.')
+            return []
+
+    def _get_weights(self, group_id, members):
+        weights = {}
+        requests = [(member, self._coordinator.get_member_capabilities(
+            group_id, member)) for member in members]
+        for member, request in requests:
+            try:
+                capabilities = json.loads(request.get() or '{}')
+                weights[member] = int(capabilities.get('weight', 1))
+            except (tooz.coordination.ToozError, ValueError,
+                    AttributeError, TypeError):
+                weights[member] = 1
+        return weights
+
+    def get_ring(self, group_id, join=True):
+        """Return the hash ring of the group
+
+        The ring is cached until the members of the group change, which is
+        noticed by the watchers, or by comparing the members every
+        `check_watchers` seconds in case the watchers are not run.
+
+        :param join: Whether to join the group if this agent is not a member
+                     of it, callers that only route objects to the members
+                     should not join.
+        """
+        now = time.time()
+        members, ring, expire_at = self._rings.get(group_id,
+                                                   (None, None, 0))
+        if now < expire_at:
+            return ring
+
+        if join:
+            current = self._get_members(group_id)
+        else:
+            current = self.get_members(group_id)
+        if not current:
+            return None
+        current = frozenset(current)
+        if current != members:
+            weights = (self._get_weights(group_id, current)
+                       if self._coordinator else None)
+            ring = utils.HashRing(sorted(current), weights=weights)
+            LOG.debug('Rebuilt the ring of group %s: %s', group_id, weights)
+        self._rings[group_id] = (
+            current, ring, now + cfg.CONF.coordination.check_watchers)
+        return ring
+
+    def extract_my_subset(self, group_id, iterable, key=None, size=None):
         """Filters an iterable, returning only objects assigned to this agent.
 
         We have a list of objects and get a list of active group members from
         `tooz`. We then hash all the objects into buckets and return only
         the ones that hashed into *our* bucket.
+
+        :param key: Optional function that returns the stable key of an
+                    object to hash, the object itself is hashed by default.
+        :param size: Optional function that returns the size of an object,
+                     if it is given, members are assigned objects of about
+                     the same total size, in proportion to their weights.
         """
         if not group_id:
             return iterable
         if group_id not in self._groups:
             self.join_group(group_id)
         try:
-            members = self._get_members(group_id)
-            LOG.debug('Members of group: %s', members)
-            hr = utils.HashRing(members)
-            filtered = [v for v in iterable
-                        if hr.get_node(v) == self._my_id]
+            ring = self.get_ring(group_id)
+            if not ring:
+                return []
+            items = list(iterable)
+            keys = [key(v) for v in items] if key else items
+            if size:
+                nodes = ring.get_nodes_bounded(keys,
+                                               [size(v) for v in items])
+            else:
+                nodes = ring.get_nodes(keys)
+            filtered = [v for v, node in zip(items, nodes)
+                        if node == self._my_id]
             LOG.debug('My subset: %s', filtered)
             return filtered
         except tooz.coordination.ToozError:
@@ -5,16 +5,24 @@ This model is the abstraction layer across all DB backends.
 
 class Model(object):
     """Base class for storage API models.
+
+    The fields of a model are its __slots__, so the instances have no
+    __dict__, which keeps them small and fast to create when a page or an
+    export has tens of thousands of rows.
     """
+    __slots__ = ()
 
     def __init__(self, **kwds):
-        self.fields = list(kwds)
         for k, v in kwds.iteritems():
             setattr(self, k, v)
 
+    @property
+    def fields(self):
+        return self.__slots__
+
     def as_dict(self):
         d = {}
-        for f in self.fields:
+        for f in self.__slots__:
             v = getattr(self, f)
             if isinstance(v, Model):
                 v = v.as_dict()
@@ -24,6 +32,9 @@ class Model(object):
         return d
 
     def __eq__(self, other):
+        if type(self) is type(other):
+            return all(getattr(self, f) == getattr(other, f)
+                       for f in self.__slots__)
         return self.as_dict() == other.as_dict()
 
     def __setitem__(self, key, value):
@@ -46,6 +57,10 @@ class Product(Model):
     :param deleted: If the product has been deleted
     :param unit_price: The unit price of the product
     """
+    __slots__ = ('product_id', 'name', 'service', 'region_id', 'description',
+                 'deleted', 'unit_price', 'created_at', 'updated_at',
+                 'deleted_at')
+
     def __init__(self,
                  product_id, name, service, region_id, description,
                  deleted, unit_price, created_at=None, updated_at=None,
@@ -81,6 +96,12 @@ class Order(Model):
     :param user_id: The user id this subscription belongs to
     :param project_id: The project id this subscription belongs to
     """
+    __slots__ = ('order_id', 'resource_id', 'resource_name', 'type', 'status',
+                 'unit_price', 'unit', 'total_price', 'cron_time', 'date_time',
+                 'user_id', 'project_id', 'region_id', 'domain_id', 'owed',
+                 'renew', 'renew_method', 'renew_period', 'charged',
+                 'created_at', 'updated_at')
+
     def __init__(self,
                  order_id, resource_id, resource_name, type, status,
                  unit_price, unit, total_price, cron_time, date_time,
@@ -124,6 +145,10 @@ class Subscription(Model):
     :param user_id: The user id this subscription belongs to
     :param project_id: The project id this subscription belongs to
     """
+    __slots__ = ('subscription_id', 'type', 'product_id', 'unit_price',
+                 'quantity', 'order_id', 'user_id', 'project_id', 'region_id',
+                 'domain_id', 'created_at', 'updated_at')
+
     def __init__(self,
                  subscription_id, type, product_id, unit_price,
                  quantity, order_id, user_id, project_id,
@@ -162,6 +187,11 @@ class Bill(Model):
     :param project_id: The project id this bill belongs to
     """
 
+    __slots__ = ('bill_id', 'start_time', 'end_time', 'type', 'status',
+                 'unit_price', 'unit', 'total_price', 'order_id',
+                 'resource_id', 'remarks', 'user_id', 'project_id',
+                 'region_id', 'domain_id', 'created_at', 'updated_at')
+
     def __init__(self,
                  bill_id, start_time, end_time, type, status, unit_price, unit,
                  total_price, order_id, resource_id, remarks, user_id,
@@ -196,6 +226,10 @@ class Account(Model):
     :param currency: The currency of the user
     """
 
+    __slots__ = ('user_id', 'domain_id', 'balance', 'consumption', 'level',
+                 'deleted', 'owed', 'created_at', 'updated_at', 'deleted_at',
+                 'frozen_balance')
+
     def __init__(self,
                  user_id, domain_id, balance, consumption,
                  level, deleted=None, owed=None, created_at=None, updated_at=None,
@@ -223,6 +257,10 @@ class Charge(Model):
     :param charge_time: The charge time
     """
 
+    __slots__ = ('charge_id', 'user_id', 'domain_id', 'value', 'charge_time',
+                 'type', 'come_from', 'trading_number', 'operator', 'remarks',
+                 'created_at', 'updated_at')
+
     def __init__(self, charge_id, user_id, domain_id,
                  value, charge_time,
                  type=None, come_from=None, trading_number=None,
@@ -247,6 +285,10 @@ class Charge(Model):
 class PreCharge(Model):
     """The precharge model
     """
+    __slots__ = ('code', 'price', 'used', 'dispatched', 'deleted',
+                 'operator_id', 'user_id', 'project_id', 'domain_id',
+                 'created_at', 'deleted_at', 'expired_at', 'remarks')
+
     def __init__(self, code, price, used, dispatched, deleted,
                  operator_id, user_id, project_id, domain_id,
                  created_at=None, deleted_at=None, expired_at=None,
@@ -268,6 +310,9 @@ class PreCharge(Model):
 
 
 class Project(Model):
+    __slots__ = ('user_id', 'project_id', 'domain_id', 'consumption',
+                 'created_at', 'updated_at')
+
     def __init__(self, user_id, project_id, domain_id, consumption,
                  created_at=None, updated_at=None):
         Model.__init__(self,
@@ -280,6 +325,9 @@ class Project(Model):
 
 
 class UserProject(Model):
+    __slots__ = ('user_id', 'project_id', 'user_consumption',
+                 'project_consumption', 'is_historical')
+
     def __init__(self, user_id, project_id, user_consumption,
                  project_consumption, is_historical):
         Model.__init__(self,
@@ -291,6 +339,9 @@ class UserProject(Model):
 
 
 class Deduct(Model):
+    __slots__ = ('req_id', 'deduct_id', 'type', 'money', 'remark', 'order_id',
+                 'created_at')
+
     def __init__(self, req_id, deduct_id, type, money, remark,
                  order_id, created_at):
         Model.__init__(self,
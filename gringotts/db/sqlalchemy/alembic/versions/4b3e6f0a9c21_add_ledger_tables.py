@@ -0,0 +1,54 @@
+"""add ledger and balance snapshot tables
+
+Revision ID: 4b3e6f0a9c21
+Revises: 1d22a66f81f0
+Create Date: 2026-10-19 10:12:31.204117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b3e6f0a9c21'
+down_revision = '1d22a66f81f0'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'ledger',
+
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.String(255)),
+        sa.Column('project_id', sa.String(255)),
+        sa.Column('type', sa.String(64)),
+        sa.Column('balance', sa.DECIMAL(20, 4)),
+        sa.Column('consumption', sa.DECIMAL(20, 4)),
+        sa.Column('deferred', sa.Boolean),
+        sa.Column('ref_id', sa.String(255)),
+
+        sa.Column('created_at', sa.DateTime),
+
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+
+    op.create_index('ix_ledger_user_id_id', 'ledger', ['user_id', 'id'])
+    op.create_index('ix_ledger_created_at', 'ledger', ['created_at'])
+
+    op.create_table(
+        'balance_snapshot',
+
+        sa.Column('user_id', sa.String(255), primary_key=True),
+        sa.Column('ledger_id', sa.Integer),
+
+        sa.Column('updated_at', sa.DateTime),
+
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+
+
+def downgrade():
+    op.drop_table('balance_snapshot')
+    op.drop_table('ledger')
@@ -0,0 +1,119 @@
+"""add price plan table
+
+Revision ID: 5a7c2e9d1b34
+Revises: 4b3e6f0a9c21
+Create Date: 2026-10-19 16:40:12.518233
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a7c2e9d1b34'
+down_revision = '4b3e6f0a9c21'
+
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from gringotts.price import pricing
+
+
+price_plan = sa.table('price_plan',
+                      sa.column('id', sa.Integer),
+                      sa.column('plan_hash', sa.String),
+                      sa.column('unit_price', sa.Text),
+                      sa.column('created_at', sa.DateTime))
+
+# The plans of the distinct unit prices of a table, only used while
+# upgrading, so the rows are updated in one statement
+price_plan_text = sa.table('price_plan_text',
+                           sa.column('unit_price', sa.Text),
+                           sa.column('price_plan_id', sa.Integer))
+
+
+def _get_or_create_plan(bind, unit_price):
+    plan_hash = pricing.price_plan_hash(unit_price)
+    row = bind.execute(sa.select([price_plan.c.id]).
+                       where(price_plan.c.plan_hash == plan_hash)).first()
+    if row:
+        return row[0]
+    result = bind.execute(price_plan.insert().values(
+        plan_hash=plan_hash,
+        unit_price=unit_price,
+        created_at=datetime.datetime.utcnow()))
+    return result.inserted_primary_key[0]
+
+
+def upgrade():
+    op.create_table(
+        'price_plan',
+
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('plan_hash', sa.String(40)),
+        sa.Column('unit_price', sa.Text),
+
+        sa.Column('created_at', sa.DateTime),
+
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+
+    op.create_index('ix_price_plan_plan_hash', 'price_plan', ['plan_hash'],
+                    unique=True)
+    op.add_column('product', sa.Column('price_plan_id', sa.Integer))
+    op.add_column('subscription', sa.Column('price_plan_id', sa.Integer))
+
+    # Move the unit prices to the plans, the ones of the subscriptions are
+    # cleared as they are only read from the plans now. The unit_price
+    # column is not indexed, so every table is updated in one pass rather
+    # than one pass per distinct unit price.
+    op.create_table(
+        'price_plan_text',
+        sa.Column('unit_price', sa.Text),
+        sa.Column('price_plan_id', sa.Integer),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8',
+    )
+    bind = op.get_bind()
+    for name in ('product', 'subscription'):
+        table = sa.table(name,
+                         sa.column('unit_price', sa.Text),
+                         sa.column('price_plan_id', sa.Integer))
+        unit_prices = [row[0] for row in bind.execute(
+            sa.select([table.c.unit_price]).
+            where(table.c.unit_price != None).  # noqa
+            distinct())]
+        if not unit_prices:
+            continue
+        bind.execute(price_plan_text.delete())
+        bind.execute(price_plan_text.insert(),
+                     [dict(unit_price=unit_price,
+                           price_plan_id=_get_or_create_plan(bind,
+                                                             unit_price))
+                      for unit_price in unit_prices])
+        bind.execute(table.update().
+                     where(table.c.unit_price != None).  # noqa
+                     values(price_plan_id=sa.select(
+                         [price_plan_text.c.price_plan_id]).
+                         where(price_plan_text.c.unit_price ==
+                               table.c.unit_price).
+                         as_scalar()))
+        if name == 'subscription':
+            bind.execute(table.update().
+                         where(table.c.price_plan_id != None).  # noqa
+                         values(unit_price=None))
+    op.drop_table('price_plan_text')
+
+
+def downgrade():
+    subscription = sa.table('subscription',
+                            sa.column('unit_price', sa.Text),
+                            sa.column('price_plan_id', sa.Integer))
+    op.get_bind().execute(subscription.update().values(
+        unit_price=sa.select([price_plan.c.unit_price]).
+        where(price_plan.c.id == subscription.c.price_plan_id).
+        as_scalar()))
+
+    op.drop_column('subscription', 'price_plan_id')
+    op.drop_column('product', 'price_plan_id')
+    op.drop_table('price_plan')
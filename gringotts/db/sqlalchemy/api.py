@@ -3,17 +3,22 @@
 from __future__ import absolute_import
 import datetime
 import functools
+import itertools
 import os
 import threading
+import time
 
 from oslo_config import cfg
 from oslo_db import api as oslo_db_api
 from oslo_db import exception as db_exc
 from oslo_db import options as oslo_db_options
 from oslo_db.sqlalchemy import session as db_session
+from sqlalchemy import bindparam
 from sqlalchemy import desc, asc
+from sqlalchemy import distinct
 from sqlalchemy import func
 from sqlalchemy import not_
+from sqlalchemy import or_
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 import wsme
 
@@ -38,9 +43,73 @@ cfg.CONF.import_opt('allow_delay_seconds',
                     'gringotts.master.service', group='master')
 cfg.CONF.register_opts(oslo_db_options.database_opts, 'database')
 
+ledger_opts = [
+    cfg.BoolOpt('defer_hourly_deduction',
+                default=False,
+                help="Append the hourly deductions to the ledger without "
+                     "updating the account, they are folded into the "
+                     "account when the balance snapshots are refreshed, so "
+                     "the hourly bills of an account don't contend for "
+                     "its row"),
+    cfg.IntOpt('ledger_fold_delay',
+               default=60,
+               help="Only fold the ledger entries that were created this "
+                    "many seconds ago into the balance snapshots, it "
+                    "should be longer than any transaction that appends "
+                    "to the ledger"),
+]
+
+cfg.CONF.register_opts(ledger_opts)
+
+replica_opts = [
+    cfg.BoolOpt('use_replica',
+                default=True,
+                help="Run the read-only queries, e.g. the listings and "
+                     "summaries of bills, orders and accounts, on "
+                     "database.slave_connection if it is set, unless "
+                     "use_replica=False is passed to them"),
+    cfg.IntOpt('max_replica_lag',
+               default=30,
+               help="Read from the primary while the replica lags behind "
+                    "it more than this many seconds"),
+    cfg.IntOpt('replica_lag_check_interval',
+               default=10,
+               help="The interval to check the lag of the replica, unit is "
+                    "second"),
+]
+
+cfg.CONF.register_opts(replica_opts)
+
+query_opts = [
+    cfg.IntOpt('query_yield_per',
+               default=1000,
+               help="The column projected listings fetch this many rows "
+                    "from the database at a time instead of loading all "
+                    "of them at once"),
+    cfg.IntOpt('count_cache_ttl',
+               default=0,
+               help="Cache the total counts of the paged listings, e.g. "
+                    "orders and invitees, for this many seconds, so they "
+                    "are approximate but not counted again for every page "
+                    "of a large listing. 0 means counting every time"),
+]
+
+cfg.CONF.register_opts(query_opts)
+
+# The max number of total counts that are cached
+COUNT_CACHE_SIZE = 1024
+
 _FACADE = None
+_COUNT_CACHE = {}
+# The unit prices of the price plans by id, and the ids by the plan hash
+_PRICE_PLANS = {}
+_PRICE_PLAN_IDS = {}
 _LOCK = threading.Lock()
 
+# Whether the sessions got by the current (green) thread go to the replica
+_READER = threading.local()
+_REPLICA_STATE = {'checked_at': 0, 'fresh': None}
+
 quantize = gringutils._quantize_decimal
 
 
@@ -88,6 +157,57 @@ def require_domain_context(f):
     return wrapper
 
 
+def reader(f):
+    """Decorator to mark a read-only method of Connection.
+
+    The sessions got in the method go to the replica, if there is one and
+    it doesn't lag too much. Pass use_replica=False to the method to read
+    from the primary, e.g. right after writing.
+    """
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        use_replica = kwargs.pop('use_replica', cfg.CONF.use_replica)
+        if (getattr(_READER, 'use_slave', False) or not use_replica or
+                not cfg.CONF.database.slave_connection or
+                not _replica_is_fresh()):
+            return f(*args, **kwargs)
+
+        _READER.use_slave = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _READER.use_slave = False
+    return wrapper
+
+
+def _replica_is_fresh():
+    """Check if the replica lag is acceptable, the result is cached for
+    replica_lag_check_interval seconds.
+    """
+    now = time.time()
+    if now - _REPLICA_STATE['checked_at'] < \
+            cfg.CONF.replica_lag_check_interval:
+        return _REPLICA_STATE['fresh']
+    _REPLICA_STATE['checked_at'] = now
+
+    try:
+        status = get_engine(use_slave=True).execute(
+            'SHOW SLAVE STATUS').first()
+        lag = status['Seconds_Behind_Master'] if status else None
+    except Exception:
+        LOG.exception('Failed to check the lag of the replica')
+        lag = None
+
+    # lag is None if the replication is broken
+    fresh = lag is not None and lag <= cfg.CONF.max_replica_lag
+    if not fresh and _REPLICA_STATE['fresh'] is not False:
+        LOG.warning('The replica lags %s seconds behind the primary, '
+                    'read from the primary', lag)
+    _REPLICA_STATE['fresh'] = fresh
+    return fresh
+
+
 def _create_facade_lazily():
     global _LOCK, _FACADE
 
@@ -98,20 +218,89 @@ def _create_facade_lazily():
     return _FACADE
 
 
-def get_engine():
+def get_engine(use_slave=False):
     facade = _create_facade_lazily()
-    return facade.get_engine()
+    return facade.get_engine(use_slave=use_slave)
 
 
-def get_session():
+def get_session(use_slave=None):
+    """Get a session of the primary, or the replica in a reader method"""
+    if use_slave is None:
+        use_slave = getattr(_READER, 'use_slave', False)
     facade = _create_facade_lazily()
-    return facade.get_session()
+    return facade.get_session(use_slave=use_slave)
 
 
 def get_backend():
     return Connection(cfg.CONF)
 
 
+def _cache_price_plan(plan_id, plan_hash, unit_price):
+    if len(_PRICE_PLANS) >= pricing.PRICE_PLAN_CACHE_SIZE:
+        _PRICE_PLANS.clear()
+        _PRICE_PLAN_IDS.clear()
+    _PRICE_PLANS[plan_id] = unit_price
+    _PRICE_PLAN_IDS[plan_hash] = plan_id
+
+
+def get_price_plan_id(unit_price):
+    """Get the id of the price plan of the unit_price JSON text
+
+    The plan is created if there is none of the same content yet, in its
+    own transaction, so it can be shared by the other transactions at
+    once. The ids are cached by the plan hash.
+    """
+    if not unit_price:
+        return None
+    plan_hash = pricing.price_plan_hash(unit_price)
+    try:
+        return _PRICE_PLAN_IDS[plan_hash]
+    except KeyError:
+        pass
+
+    session = get_session(use_slave=False)
+    query = session.query(sa_models.PricePlan.id).\
+        filter_by(plan_hash=plan_hash)
+    row = query.first()
+    if row:
+        plan_id = row.id
+    else:
+        plan = sa_models.PricePlan(plan_hash=plan_hash,
+                                   unit_price=unit_price)
+        try:
+            with session.begin():
+                session.add(plan)
+            plan_id = plan.id
+        except db_exc.DBDuplicateEntry:
+            # created by others at the same time
+            plan_id = query.one().id
+    _cache_price_plan(plan_id, plan_hash, unit_price)
+    return plan_id
+
+
+def get_plan_unit_price(plan_id, unit_price=None, session=None):
+    """Get the unit_price JSON text of the price plan
+
+    The plans never change once created, so they are read once and cached
+    by id. unit_price is returned if there is no plan_id, e.g. for the
+    rows written before the plans.
+    """
+    if not plan_id:
+        return unit_price
+    try:
+        return _PRICE_PLANS[plan_id]
+    except KeyError:
+        pass
+
+    session = session or get_session()
+    plan = session.query(sa_models.PricePlan).filter_by(id=plan_id).first()
+    if not plan:
+        LOG.warning('Price plan %s not found', plan_id)
+        return unit_price
+    _cache_price_plan(plan.id, plan.plan_hash, plan.unit_price)
+    return plan.unit_price
+
+
 def model_query(context, model, *args, **kwargs):
     """Query helper for simpler session usage.
 
@@ -132,7 +321,7 @@ def model_query(context, model, *args, **kwargs):
 
 
 def paginate_query(context, model, limit=None, offset=None,
-                   sort_key=None, sort_dir=None, query=None):
+                   sort_key=None, sort_dir=None, query=None, yield_per=None):
     if not query:
         query = model_query(context, model)
     sort_keys = ['id']
@@ -146,9 +335,71 @@ def paginate_query(context, model, limit=None, offset=None,
             sort_keys.insert(0, k)
     query = _paginate_query(query, model, limit, sort_keys,
                             offset=offset, sort_dir=sort_dir)
+    if yield_per:
+        return query.yield_per(yield_per)
     return query.all()
 
 
+def count_query(query, column, distinct_values=False):
+    """Turn query into the one that counts its rows in a single aggregate
+
+    The entities and the ORDER BY of query are replaced, so it isn't
+    wrapped in a subquery as Query.count() does. The distinct values of
+    column are counted if distinct_values is True, e.g. the orders of a
+    query joined with their bills.
+    """
+    if distinct_values:
+        column = distinct(column)
+    return query.with_entities(func.count(column)).order_by(None)
+
+
+def _get_count(count, cache_ttl=None):
+    if not cache_ttl:
+        return count.scalar() or 0
+
+    statement = count.statement.compile()
+    key = (str(statement), repr(sorted(statement.params.items())))
+    now = time.time()
+    cached = _COUNT_CACHE.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    total_count = count.scalar() or 0
+    if len(_COUNT_CACHE) >= COUNT_CACHE_SIZE:
+        _COUNT_CACHE.clear()
+    _COUNT_CACHE[key] = (total_count, now + cache_ttl)
+    return total_count
+
+
+def paginate_query_with_count(context, model, count, limit=None, offset=None,
+                              sort_key=None, sort_dir=None, query=None,
+                              cache_ttl=None):
+    """Return a page of query and the total count of its rows
+
+    count is the query that counts the rows, see count_query(), it's not
+    executed if the total count can be told from the page, i.e. the page
+    is the last one. Its result is cached for cache_ttl seconds if given.
+    """
+    rows = paginate_query(context, model, limit=limit, offset=offset,
+                          sort_key=sort_key, sort_dir=sort_dir, query=query)
+    if (rows or not offset) and (limit is None or len(rows) < limit):
+        return rows, (offset or 0) + len(rows)
+    return rows, _get_count(count, cache_ttl=cache_ttl)
+
+
+def project_query(query, model, fields):
+    """Select only the columns of fields instead of the whole entities
+
+    The rows are returned as named tuples, which are neither tracked by
+    the session nor copied to the storage models.
+    """
+    invalid = set(fields) - set(model.__table__.columns.keys())
+    if invalid:
+        raise exception.InvalidParameterValue(
+            err="Invalid fields: %s" % ', '.join(sorted(invalid)))
+    return query.with_entities(*[getattr(model, f) for f in fields])
+
+
 def _paginate_query(query, model, limit, sort_keys, offset=None,
                     sort_dir=None, sort_dirs=None):
     if 'id' not in sort_keys:
@@ -252,7 +503,8 @@ class Connection(api.Connection):
         return db_models.Subscription(subscription_id=row.subscription_id,
                                       type=row.type,
                                       product_id=row.product_id,
-                                      unit_price=row.unit_price,
+                                      unit_price=get_plan_unit_price(
+                                          row.price_plan_id, row.unit_price),
                                       quantity=row.quantity,
                                       order_id=row.order_id,
                                       user_id=row.user_id,
@@ -364,6 +616,7 @@ class Connection(api.Connection):
                         sorted(new_segmented, key=lambda p: p['count'],
                                reverse=True)
             p_dict['unit_price'] = jsonutils.dumps(p_dict['unit_price'])
+            p_dict['price_plan_id'] = get_price_plan_id(p_dict['unit_price'])
         except KeyError:
             LOG.error("The unit_price lack of some key words.")
             return None
@@ -383,6 +636,97 @@ class Connection(api.Connection):
                       'we will fetch another one')
             raise db_exc.RetryRequest(failed_exception)
 
+    def _update_relatively(self, context, session, row, keys, deltas,
+                           criteria=None, **params):
+        """Add deltas to the columns of the row in one UPDATE statement
+
+        e.g. SET balance = balance - :price. Concurrent updates of the row
+        are serialized by the database instead of conflicting with each
+        other, so they are never retried. The row must also match
+        *criteria*, which are checked atomically with the update. The row is
+        selected again, so its new values can be used to check the owed
+        state.
+
+        Returns False if the row doesn't match, nothing is updated then.
+        """
+        model = type(row)
+        values = dict(updated_at=datetime.datetime.utcnow())
+        for column, delta in deltas.items():
+            values[column] = getattr(model, column) + delta
+        values.update(params)
+
+        query = model_query(context, model, session=session).\
+            filter_by(**dict((k, getattr(row, k)) for k in keys))
+        if criteria is not None:
+            query = query.filter(criteria)
+        if not query.update(values, synchronize_session=False):
+            return False
+        session.refresh(row)
+        return True
+
+    @staticmethod
+    def _ledger_entry(type, user_id, balance=0, consumption=0,
+                      project_id=None, ref_id=None, deferred=False):
+        return dict(type=type, user_id=user_id, project_id=project_id,
+                    balance=balance, consumption=consumption,
+                    ref_id=ref_id, deferred=deferred,
+                    created_at=timeutils.utcnow())
+
+    def _append_ledger(self, session, *entries):
+        """Append the entries made by _ledger_entry in one INSERT"""
+        if entries:
+            session.execute(sa_models.Ledger.__table__.insert(),
+                            list(entries))
+
+    def _get_ledger_tail(self, session, user_id):
+        """Sum the deferred entries that are not folded into the account
+
+        Returns the (balance, consumption) that should be added to the
+        account.
+        """
+        Ledger = sa_models.Ledger
+        deferred = Ledger.deferred == True  # noqa
+        ledger_id = session.query(sa_models.BalanceSnapshot.ledger_id).\
+            filter_by(user_id=user_id).\
+            as_scalar()
+        balance, consumption = session.query(
+            func.sum(Ledger.balance), func.sum(Ledger.consumption)).\
+            filter(Ledger.user_id == user_id).\
+            filter(deferred).\
+            filter(Ledger.id > func.coalesce(ledger_id, 0)).\
+            one()
+        return quantize(balance or 0), quantize(consumption or 0)
+
+    def _get_balance(self, session, account):
+        """Get the balance of the account including the deferred tail"""
+        if not cfg.CONF.defer_hourly_deduction:
+            return account.balance
+        return account.balance + self._get_ledger_tail(
+            session, account.user_id)[0]
+
+    def _balance_at_least(self, session, user_id, value):
+        """Return the criterion that the balance of the account, including
+        the deferred tail, is not less than value
+
+        The tail is summed by a subquery of the UPDATE, so it is checked
+        atomically with the update too.
+        """
+        balance = sa_models.Account.balance
+        if cfg.CONF.defer_hourly_deduction:
+            Ledger = sa_models.Ledger
+            deferred = Ledger.deferred == True  # noqa
+            ledger_id = session.query(
+                sa_models.BalanceSnapshot.ledger_id).\
+                filter_by(user_id=user_id).\
+                as_scalar()
+            tail = session.query(func.coalesce(func.sum(Ledger.balance), 0)).\
+                filter(Ledger.user_id == user_id).\
+                filter(deferred).\
+                filter(Ledger.id > func.coalesce(ledger_id, 0)).\
+                as_scalar()
+            balance = balance + tail
+        return balance >= value
+
     def create_product(self, context, product):
         session = get_session()
         with session.begin():
@@ -391,10 +735,9 @@ class Connection(api.Connection):
             session.add(product_ref)
         return self._row_to_db_product_model(product_ref)
 
+    @reader
     def get_products_count(self, context, filters=None):
-        query = get_session().query(
-            sa_models.Product,
-            func.count(sa_models.Product.id).label('count'))
+        query = get_session().query(sa_models.Product)
         if 'name' in filters:
             query = query.filter_by(name=filters['name'])
         if 'service' in filters:
@@ -403,8 +746,9 @@ class Connection(api.Connection):
             query = query.filter_by(region_id=filters['region_id'])
         query = query.filter_by(deleted=False)
 
-        return query.one().count or 0
+        return count_query(query, sa_models.Product.id).scalar() or 0
 
+    @reader
     def get_products(self, context, filters=None, read_deleted=False,
                      limit=None, offset=None, sort_key=None,
                      sort_dir=None):
@@ -463,46 +807,106 @@ class Connection(api.Connection):
 
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
                                retry_on_request=True)
-    def reset_product(self, context, product, excluded_projects=[]):
+    def reset_product(self, context, product, excluded_projects=[],
+                      chunk_size=500):
+        """Reprice the subscriptions and active orders of the product
+
+        The subscriptions are updated in one statement, then the unit
+        prices of the affected orders are recomputed from one read of
+        their subscriptions grouped by order, and written in chunks of
+        chunk_size orders, each in its own transaction.
+
+        Returns the number of the repriced orders.
+        """
+        Order = sa_models.Order
+        Subscription = sa_models.Subscription
         session = get_session()
-        with session.begin():
-            # get all active orders in specified region
-            orders = session.query(sa_models.Order).\
-                filter_by(region_id=product.region_id).\
-                filter(not_(sa_models.Order.status == const.STATE_DELETED)).\
-                filter(sa_models.Order.project_id.notin_(excluded_projects)).\
-                all()
-            for order in orders:
-                # get all subscriptions of this order that belongs to
-                # this product
-                p_subs = session.query(sa_models.Subscription).\
-                    filter_by(order_id=order.order_id).\
-                    filter_by(product_id=product.product_id).\
-                    all()
-                # update subscription's unit price
-                for s in p_subs:
-                    s.unit_price = product.unit_price
-
-                # update order's unit price
-                t_subs = session.query(sa_models.Subscription).\
-                    filter_by(order_id=order.order_id).\
-                    filter_by(type=order.status).\
-                    all()
-                unit_price = 0
-                for s in t_subs:
-                    price_data = None
-                    if s.unit_price:
-                        try:
-                            unit_price_data = jsonutils.loads(s.unit_price)
-                            price_data = unit_price_data.get('price', None)
-                        except (Exception):
-                            pass
 
-                    unit_price += pricing.calculate_price(
-                        s.quantity, price_data)
+        # all active orders in specified region
+        orders = session.query(Order.order_id).\
+            filter_by(region_id=product.region_id).\
+            filter(not_(Order.status == const.STATE_DELETED)).\
+            filter(Order.project_id.notin_(excluded_projects))
+        affected = session.query(Subscription.order_id).\
+            filter_by(product_id=product.product_id).\
+            filter(Subscription.order_id.in_(orders.subquery()))
 
-                if order.unit_price != 0:
-                    order.unit_price = unit_price
+        price_plan_id = get_price_plan_id(product.unit_price)
+        with session.begin():
+            session.query(Subscription).\
+                filter_by(product_id=product.product_id).\
+                filter(Subscription.order_id.in_(orders.subquery())).\
+                update({'price_plan_id': price_plan_id,
+                        'unit_price': None},
+                       synchronize_session=False)
+
+        # the subscriptions of the current status of the affected orders
+        rows = session.query(Order.order_id, Order.status,
+                             Subscription.price_plan_id,
+                             Subscription.unit_price,
+                             Subscription.quantity).\
+            join(Subscription, Subscription.order_id == Order.order_id).\
+            filter(Subscription.type == Order.status).\
+            filter(not_(Order.unit_price == 0)).\
+            filter(Order.order_id.in_(affected.subquery())).\
+            order_by(Order.order_id)
+
+        count = 0
+        chunk = []
+        orders = 0
+        for order_id, subs in itertools.groupby(rows, lambda r: r[0]):
+            chunk.extend(subs)
+            orders += 1
+            if orders >= chunk_size:
+                count += self._reprice_orders(chunk)
+                LOG.info('Repriced %s orders of product %s',
+                         count, product.product_id)
+                chunk = []
+                orders = 0
+        if chunk:
+            count += self._reprice_orders(chunk)
+        LOG.info('Reset product %s, repriced %s orders',
+                 product.product_id, count)
+        return count
+
+    def _reprice_orders(self, subs):
+        """Set the unit prices of the orders in one transaction
+
+        The prices are calculated from the subs, which are rows of
+        (order_id, status, price_plan_id, unit_price, quantity). The
+        quantities of the same price plan are calculated at once.
+
+        An order is skipped if its status has been changed since its price
+        was computed, as the subscriptions of the new status are charged.
+        Returns the number of the updated orders.
+        """
+        orders = {}
+        plans = {}
+        for order_id, status, plan_id, unit_price, quantity in subs:
+            orders.setdefault(order_id, dict(b_order_id=order_id,
+                                             b_status=status,
+                                             b_unit_price=0))
+            unit_price = get_plan_unit_price(plan_id, unit_price)
+            plans.setdefault(unit_price, []).append((order_id, quantity))
+        for unit_price, items in plans.items():
+            plan = pricing.get_price_plan(unit_price)
+            if not plan:
+                continue
+            prices = plan.calculate_many([q for _order_id, q in items])
+            for (order_id, _q), price in zip(items, prices):
+                orders[order_id]['b_unit_price'] += price
+
+        table = sa_models.Order.__table__
+        session = get_session()
+        with session.begin():
+            result = session.execute(
+                table.update().
+                where(table.c.order_id == bindparam('b_order_id')).
+                where(table.c.status == bindparam('b_status')).
+                where(table.c.unit_price != 0).
+                values(unit_price=bindparam('b_unit_price')),
+                orders.values())
+        return result.rowcount
 
     def get_product_by_name(self, context, product_name, service, region_id):
         try:
@@ -525,21 +929,13 @@ class Connection(api.Connection):
 
         return self._row_to_db_product_model(product)
 
-    def _update_consumption(self, context, session,
-                            obj, model, total_price,
-                            user_id=False):
-        consumption = obj.consumption + total_price
-        params = dict(consumption=consumption,
-                      updated_at = datetime.datetime.utcnow())
-        filters = params.keys()
-        filters.append('project_id')
-        if user_id:
-            filters.append('user_id')
-        self._compare_and_swap(model_query(context,
-                                           model,
-                                           session=session),
-                               obj, filters, params,
-                               exception.ConsumptionUpdateFailed())
+    def _update_consumption(self, context, session, obj, total_price):
+        """Add total_price to the consumption of a project or user_project"""
+        keys = ['project_id']
+        if isinstance(obj, sa_models.UserProject):
+            keys.append('user_id')
+        self._update_relatively(context, session, obj, keys,
+                                dict(consumption=total_price))
 
     @require_admin_context
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
@@ -646,10 +1042,9 @@ class Connection(api.Connection):
                         project_id=order['project_id'])
 
                 self._update_consumption(context, session, project,
-                                         sa_models.Project, total_price)
+                                         total_price)
                 self._update_consumption(context, session, user_project,
-                                         sa_models.UserProject, total_price,
-                                         True)
+                                         total_price)
 
                 # Update account
                 try:
@@ -662,18 +1057,15 @@ class Connection(api.Connection):
                               project.user_id)
                     raise exception.AccountNotFound(user_id=project.user_id)
 
-                frozen_balance = account.frozen_balance - total_price
-                consumption = account.consumption + total_price
-                params = dict(frozen_balance=frozen_balance,
-                              consumption=consumption,
-                              updated_at=datetime.datetime.utcnow())
-                filters = params.keys()
-                filters.append('user_id')
-                self._compare_and_swap(model_query(context,
-                                                   sa_models.Account,
-                                                   session=session),
-                                       account, filters, params,
-                                       exception.AccountUpdateFailed())
+                self._update_relatively(
+                    context, session, account, ['user_id'],
+                    dict(frozen_balance=-total_price,
+                         consumption=total_price))
+                self._append_ledger(session, self._ledger_entry(
+                    const.LEDGER_BILL, account.user_id,
+                    balance=-total_price, consumption=total_price,
+                    project_id=order['project_id'],
+                    ref_id=bill.bill_id))
 
         return self._row_to_db_order_model(ref)
 
@@ -696,16 +1088,10 @@ class Connection(api.Connection):
             unit_price = 0
 
             for sub in subs:
-                price_data = None
-                if sub.unit_price:
-                    try:
-                        unit_price_data = jsonutils.loads(sub.unit_price)
-                        price_data = unit_price_data.get('price', None)
-                    except (Exception):
-                        pass
-
-                unit_price += pricing.calculate_price(
-                    sub.quantity, price_data)
+                plan = pricing.get_price_plan(get_plan_unit_price(
+                    sub.price_plan_id, sub.unit_price, session=session))
+                if plan:
+                    unit_price += plan.calculate(sub.quantity)
 
             # update the order
             order = model_query(context, sa_models.Order, session=session).\
@@ -780,15 +1166,23 @@ class Connection(api.Connection):
 
         return self._row_to_db_order_model(ref)
 
+    # NOTE: The orders and their counts are read from the primary, as
+    # master loads the jobs of the orders and checker compares the counts
+    # with the jobs, which must see the orders created right before.
     @require_context
     def get_orders(self, context, start_time=None, end_time=None, type=None,
                    status=None, limit=None, offset=None, sort_key=None,
                    sort_dir=None, with_count=False, region_id=None,
                    user_id=None, project_ids=None, owed=None, resource_id=None,
-                   bill_methods=None, read_deleted=True):
+                   bill_methods=None, read_deleted=True, raw=False,
+                   fields=None):
         """Get orders that have bills during start_time and end_time.
         If start_time is None or end_time is None, will ignore the datetime
         range, and return all orders
+
+        The SQLAlchemy rows are returned without being copied to the
+        storage models if raw is True, they should only be read. Only the
+        columns of fields are selected and streamed if fields is given.
         """
         query = get_session().query(sa_models.Order)
 
@@ -819,16 +1213,31 @@ class Connection(api.Connection):
             )
             query = query.filter(sa_models.Bill.start_time >= start_time,
                                  sa_models.Bill.start_time < end_time)
+            count = count_query(query, sa_models.Order.id,
+                                distinct_values=True)
             query = query.group_by(sa_models.Bill.order_id)
+        else:
+            count = count_query(query, sa_models.Order.id)
 
-        if with_count:
-            total_count = query.count()
+        if fields:
+            query = project_query(query, sa_models.Order, fields)
 
-        result = paginate_query(context, sa_models.Order,
-                                limit=limit, offset=offset,
-                                sort_key=sort_key, sort_dir=sort_dir,
-                                query=query)
-        rows = (self._row_to_db_order_model(o) for o in result)
+        if with_count:
+            result, total_count = paginate_query_with_count(
+                context, sa_models.Order, count,
+                limit=limit, offset=offset,
+                sort_key=sort_key, sort_dir=sort_dir,
+                query=query, cache_ttl=cfg.CONF.count_cache_ttl)
+        else:
+            result = paginate_query(
+                context, sa_models.Order,
+                limit=limit, offset=offset,
+                sort_key=sort_key, sort_dir=sort_dir,
+                query=query, yield_per=fields and cfg.CONF.query_yield_per)
+        if raw or fields:
+            rows = result
+        else:
+            rows = (self._row_to_db_order_model(o) for o in result)
         if with_count:
             return rows, total_count
         else:
@@ -837,8 +1246,7 @@ class Connection(api.Connection):
     @require_admin_context
     def get_active_order_count(self, context, region_id=None,
                                owed=None, type=None, bill_methods=None):
-        query = model_query(context, sa_models.Order,
-                            func.count(sa_models.Order.id).label('count'))
+        query = model_query(context, sa_models.Order)
         if region_id:
             query = query.filter_by(region_id=region_id)
         if owed is not None:
@@ -855,13 +1263,37 @@ class Connection(api.Connection):
             query = query.filter(
                 not_(sa_models.Order.cron_time == None)  # noqa
             )
-        return query.one().count or 0
+        return count_query(query, sa_models.Order.id).scalar() or 0
 
     @require_admin_context
-    def get_stopped_order_count(self, context, region_id=None,
-                                owed=None, type=None, bill_methods=None):
+    @reader
+    def get_active_order_count_by_project(self, context, region_id=None):
+        """Return a dict of the active order count of every project"""
         query = model_query(context, sa_models.Order,
+                            sa_models.Order.project_id,
                             func.count(sa_models.Order.id).label('count'))
+        if region_id:
+            query = query.filter_by(region_id=region_id)
+        query = query.filter(
+            not_(sa_models.Order.status == const.STATE_DELETED))
+        query = query.group_by(sa_models.Order.project_id)
+        return dict((row.project_id, row.count) for row in query)
+
+    @require_admin_context
+    def get_projects_of_new_orders(self, context, created_since,
+                                   region_id=None):
+        """Return the ids of projects that have orders created since"""
+        query = model_query(context, sa_models.Order,
+                            sa_models.Order.project_id).distinct()
+        if region_id:
+            query = query.filter_by(region_id=region_id)
+        query = query.filter(sa_models.Order.created_at > created_since)
+        return [row.project_id for row in query]
+
+    @require_admin_context
+    def get_stopped_order_count(self, context, region_id=None,
+                                owed=None, type=None, bill_methods=None):
+        query = model_query(context, sa_models.Order)
         if region_id:
             query = query.filter_by(region_id=region_id)
         if owed is not None:
@@ -874,15 +1306,18 @@ class Connection(api.Connection):
         query = query.filter(sa_models.Order.status == const.STATE_STOPPED)
         query = query.filter(
             sa_models.Order.unit_price == quantize('0'))
-        return query.one().count or 0
+        return count_query(query, sa_models.Order.id).scalar() or 0
 
     @require_context
     def get_active_orders(self, context, type=None, limit=None, offset=None,
                           sort_key=None, sort_dir=None, region_id=None,
                           user_id=None, project_id=None, owed=None,
                           charged=None, within_one_hour=None,
-                          bill_methods=None):
+                          bill_methods=None, user_ids=None, fields=None):
         """Get all active orders
+
+        Only the columns of fields are selected and streamed as named
+        tuples if fields is given.
         """
         query = get_session().query(sa_models.Order)
 
@@ -892,6 +1327,8 @@ class Connection(api.Connection):
             query = query.filter_by(region_id=region_id)
         if user_id:
             query = query.filter_by(user_id=user_id)
+        if user_ids is not None:
+            query = query.filter(sa_models.Order.user_id.in_(user_ids))
         if project_id:
             query = query.filter_by(project_id=project_id)
         if owed is not None:
@@ -908,10 +1345,16 @@ class Connection(api.Connection):
         query = query.filter(
             not_(sa_models.Order.status == const.STATE_DELETED))
 
+        if fields:
+            query = project_query(query, sa_models.Order, fields)
+
         result = paginate_query(context, sa_models.Order,
                                 limit=limit, offset=offset,
                                 sort_key=sort_key, sort_dir=sort_dir,
-                                query=query)
+                                query=query,
+                                yield_per=fields and cfg.CONF.query_yield_per)
+        if fields:
+            return result
         return (self._row_to_db_order_model(o) for o in result)
 
     @require_admin_context
@@ -950,7 +1393,8 @@ class Connection(api.Connection):
                 subscription_id=uuidutils.generate_uuid(),
                 type=subscription['type'],
                 product_id=product.product_id,
-                unit_price=product.unit_price,
+                price_plan_id=(product.price_plan_id or
+                               get_price_plan_id(product.unit_price)),
                 order_id=subscription['order_id'],
                 user_id=subscription['user_id'],
                 project_id=subscription['project_id'],
@@ -968,22 +1412,11 @@ class Connection(api.Connection):
     def update_subscription(self, context, **kwargs):
         session = get_session()
         with session.begin():
-            subs = model_query(
-                context, sa_models.Subscription, session=session).\
+            model_query(context, sa_models.Subscription, session=session).\
                 filter_by(order_id=kwargs['order_id']).\
                 filter_by(type=kwargs['change_to']).\
-                all()
-
-            for sub in subs:
-                params = dict(quantity=kwargs['quantity'])
-                filters = params.keys()
-                filters.append('type')
-                filters.append('order_id')
-                self._compare_and_swap(model_query(context,
-                                                   sa_models.Subscription,
-                                                   session=session),
-                                       sub, filters, params,
-                                       exception.SubscriptionUpdateFailed())
+                update(dict(quantity=kwargs['quantity']),
+                       synchronize_session=False)
 
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
                                retry_on_request=True)
@@ -1049,7 +1482,9 @@ class Connection(api.Connection):
                 LOG.error(msg)
                 return None
 
-            params = dict(unit_price=new_product.unit_price,
+            price_plan_id = (new_product.price_plan_id or
+                             get_price_plan_id(new_product.unit_price))
+            params = dict(price_plan_id=price_plan_id,
                           product_id=new_product.product_id)
             filters = params.keys()
             filters.append('order_id')
@@ -1132,6 +1567,7 @@ class Connection(api.Connection):
         return (self._row_to_db_bill_model(r) for r in ref)
 
     @require_context
+    @reader
     def get_bills_by_order_id(self, context, order_id, type=None,
                               start_time=None, end_time=None,
                               limit=None, offset=None, sort_key=None,
@@ -1153,9 +1589,13 @@ class Connection(api.Connection):
         return (self._row_to_db_bill_model(r) for r in result)
 
     @require_context
+    @reader
     def get_bills(self, context, start_time=None, end_time=None,
                   project_id=None, type=None, limit=None, offset=None,
-                  sort_key=None, sort_dir=None):
+                  sort_key=None, sort_dir=None, raw=False, fields=None):
+        """Get the payed bills, as the read-only SQLAlchemy rows if raw,
+        or as the named tuples of the columns of fields if fields is given
+        """
         query = model_query(context, sa_models.Bill)
 
         if type:
@@ -1172,19 +1612,24 @@ class Connection(api.Connection):
             query = query.filter(sa_models.Bill.start_time >= start_time,
                                  sa_models.Bill.start_time < end_time)
 
+        if fields:
+            query = project_query(query, sa_models.Bill, fields)
+
         result = paginate_query(context, sa_models.Bill,
                                 limit=limit, offset=offset,
                                 sort_key=sort_key, sort_dir=sort_dir,
-                                query=query)
+                                query=query,
+                                yield_per=fields and cfg.CONF.query_yield_per)
 
+        if raw or fields:
+            return result
         return (self._row_to_db_bill_model(b) for b in result)
 
     @require_context
+    @reader
     def get_bills_count(self, context, order_id=None, project_id=None,
                         type=None, start_time=None, end_time=None):
-        query = get_session().query(
-            sa_models.Bill,
-            func.count(sa_models.Bill.id).label('count'))
+        query = get_session().query(sa_models.Bill)
         if order_id:
             query = query.filter_by(order_id=order_id)
         if project_id:
@@ -1198,9 +1643,10 @@ class Connection(api.Connection):
             query = query.filter(sa_models.Bill.start_time >= start_time,
                                  sa_models.Bill.start_time < end_time)
 
-        return query.one().count or 0
+        return count_query(query, sa_models.Bill.id).scalar() or 0
 
     @require_context
+    @reader
     def get_bills_sum(self, context, region_id=None, start_time=None,
                       end_time=None, order_id=None, user_id=None,
                       project_id=None, type=None):
@@ -1226,6 +1672,7 @@ class Connection(api.Connection):
         return query.one().sum or 0
 
     @require_context
+    @reader
     def get_bills_count_and_sum(self, context, order_id=None, project_id=None,
                                 type=None, start_time=None, end_time=None):
         query = model_query(context, sa_models.Bill,
@@ -1244,7 +1691,8 @@ class Connection(api.Connection):
             query = query.filter(sa_models.Bill.start_time >= start_time,
                                  sa_models.Bill.start_time < end_time)
 
-        return query.one().count or 0, query.one().sum or 0
+        result = query.one()
+        return result.count or 0, result.sum or 0
 
     def create_account(self, context, account):
         session = get_session()
@@ -1266,7 +1714,95 @@ class Connection(api.Connection):
             ref = query.one()
         except NoResultFound:
             raise exception.AccountNotFound(user_id=user_id)
-        return self._row_to_db_account_model(ref)
+
+        # the row is the snapshot, add the deferred entries after it
+        account = self._row_to_db_account_model(ref)
+        if cfg.CONF.defer_hourly_deduction:
+            balance, consumption = self._get_ledger_tail(query.session,
+                                                         ref.user_id)
+            account.balance += balance
+            account.consumption += consumption
+        return account
+
+    @require_admin_context
+    def refresh_balance_snapshots(self, context, limit=None):
+        """Fold the deferred ledger entries into the accounts
+
+        Entries are folded in the order of id up to the last one that was
+        created ledger_fold_delay seconds ago, so the entries of the
+        transactions that are not committed yet, which may have smaller
+        ids, are not skipped.
+
+        Returns the number of the refreshed accounts.
+        """
+        Ledger = sa_models.Ledger
+        deferred = Ledger.deferred == True  # noqa
+        session = get_session()
+        before = timeutils.utcnow() - datetime.timedelta(
+            seconds=cfg.CONF.ledger_fold_delay)
+        last_id = session.query(func.max(Ledger.id)).\
+            filter(Ledger.created_at < before).\
+            scalar()
+        if not last_id:
+            return 0
+
+        ledger_id = session.query(sa_models.BalanceSnapshot.ledger_id).\
+            filter(sa_models.BalanceSnapshot.user_id == Ledger.user_id).\
+            as_scalar()
+        query = session.query(Ledger.user_id).\
+            filter(deferred).\
+            filter(Ledger.id <= last_id).\
+            filter(Ledger.id > func.coalesce(ledger_id, 0)).\
+            distinct()
+        if limit:
+            query = query.limit(limit)
+
+        count = 0
+        for user_id, in query.all():
+            if self._fold_ledger(context, user_id, last_id):
+                count += 1
+        return count
+
+    @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
+                               retry_on_request=True)
+    def _fold_ledger(self, context, user_id, last_id):
+        Ledger = sa_models.Ledger
+        deferred = Ledger.deferred == True  # noqa
+        session = get_session()
+        with session.begin():
+            snapshot = session.query(sa_models.BalanceSnapshot).\
+                filter_by(user_id=user_id).\
+                with_lockmode('update').first()
+            if not snapshot:
+                snapshot = sa_models.BalanceSnapshot(user_id=user_id,
+                                                     ledger_id=0)
+                session.add(snapshot)
+                try:
+                    session.flush()
+                except db_exc.DBDuplicateEntry as e:
+                    # created by another transaction, lock it next time
+                    raise db_exc.RetryRequest(e)
+
+            balance, consumption, folded_id = session.query(
+                func.sum(Ledger.balance), func.sum(Ledger.consumption),
+                func.max(Ledger.id)).\
+                filter(Ledger.user_id == user_id).\
+                filter(deferred).\
+                filter(Ledger.id > snapshot.ledger_id).\
+                filter(Ledger.id <= last_id).\
+                one()
+            if not folded_id:
+                return False
+
+            account = session.query(sa_models.Account).\
+                filter_by(user_id=user_id).\
+                one()
+            self._update_relatively(context, session, account, ['user_id'],
+                                    dict(balance=quantize(balance),
+                                         consumption=quantize(consumption)))
+            snapshot.ledger_id = folded_id
+            snapshot.updated_at = datetime.datetime.utcnow()
+        return True
 
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
                                retry_on_request=True)
@@ -1296,21 +1832,27 @@ class Connection(api.Connection):
             for user_project in user_projects:
                 session.delete(user_project)
 
+    @reader
     def get_invitees(self, context, inviter, limit=None, offset=None):
         query = get_session().query(sa_models.Account).\
             filter_by(inviter=inviter)
 
-        total_count = len(query.all())
-
-        result = paginate_query(context, sa_models.Account,
-                                limit=limit, offset=offset,
-                                query=query)
+        result, total_count = paginate_query_with_count(
+            context, sa_models.Account,
+            count_query(query, sa_models.Account.id),
+            limit=limit, offset=offset, query=query,
+            cache_ttl=cfg.CONF.count_cache_ttl)
 
         return (self._row_to_db_account_model(r) for r in result), total_count
 
+    @reader
     def get_accounts(self, context, user_id=None, read_deleted=False,
                      owed=None, limit=None, offset=None,
-                     sort_key=None, sort_dir=None, active_from=None):
+                     sort_key=None, sort_dir=None, active_from=None,
+                     fields=None):
+        """Get accounts, as the named tuples of the columns of fields if
+        fields is given
+        """
         query = get_session().query(sa_models.Account)
         if owed is not None:
             query = query.filter_by(owed=owed)
@@ -1320,18 +1862,70 @@ class Connection(api.Connection):
             query = query.filter(sa_models.Account.updated_at > active_from)
         if not read_deleted:
             query = query.filter_by(deleted=False)
+        if fields:
+            query = project_query(query, sa_models.Account, fields)
 
         result = paginate_query(context, sa_models.Account,
                                 limit=limit, offset=offset,
                                 sort_key=sort_key, sort_dir=sort_dir,
-                                query=query)
+                                query=query,
+                                yield_per=fields and cfg.CONF.query_yield_per)
 
+        if fields:
+            return result
         return (self._row_to_db_account_model(r) for r in result)
 
+    def get_owed_accounts(self, context, bill_methods=None, days_to_owe=None,
+                          active_from=None, user_ids=None, limit=None,
+                          offset=None):
+        """Get the accounts that have owed, or will owe within days_to_owe
+        days, and have active orders of bill_methods
+
+        The accounts that will owe are judged by the unit prices of all
+        their active orders, and the days are compared before they are
+        rounded, so the result is a superset of the accounts whose rounded
+        days are not more than days_to_owe. The caller should still check
+        them by the orders whose resources exist. Accounts of level 9 are
+        excluded.
+        """
+        session = get_session()
+        prices = session.query(
+            sa_models.Order.user_id,
+            func.sum(sa_models.Order.unit_price).label('unit_price')).\
+            filter(not_(sa_models.Order.status == const.STATE_DELETED))
+        if bill_methods:
+            prices = prices.filter(sa_models.Order.unit.in_(bill_methods))
+        prices = prices.group_by(sa_models.Order.user_id).subquery()
+
+        query = session.query(sa_models.Account).\
+            join(prices, prices.c.user_id == sa_models.Account.user_id).\
+            filter(sa_models.Account.deleted == False).\
+            filter(sa_models.Account.level != 9)  # noqa
+        if active_from:
+            query = query.filter(sa_models.Account.updated_at > active_from)
+        if user_ids:
+            query = query.filter(sa_models.Account.user_id.in_(user_ids))
+
+        owed = sa_models.Account.owed == True  # noqa
+        if days_to_owe is not None:
+            # round(balance / price_per_day) <= days_to_owe
+            query = query.filter(or_(
+                owed,
+                sa_models.Account.balance <=
+                prices.c.unit_price * 24 * (days_to_owe + 0.5)))
+        else:
+            query = query.filter(owed)
+
+        result = paginate_query(context, sa_models.Account,
+                                limit=limit, offset=offset,
+                                sort_key='user_id', sort_dir='asc',
+                                query=query)
+        return (self._row_to_db_account_model(r) for r in result)
+
+    @reader
     def get_accounts_count(self, context, read_deleted=False,
                            user_id=None, owed=None, active_from=None):
-        query = get_session().query(sa_models.Account,
-                                    func.count(sa_models.Account.id).label('count'))
+        query = get_session().query(sa_models.Account)
         if owed is not None:
             query = query.filter_by(owed=owed)
         if user_id:
@@ -1341,7 +1935,7 @@ class Connection(api.Connection):
         if not read_deleted:
             query = query.filter_by(deleted=False)
 
-        return query.one().count or 0
+        return count_query(query, sa_models.Account.id).scalar() or 0
 
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
                                retry_on_request=True)
@@ -1374,11 +1968,17 @@ class Connection(api.Connection):
             account = session.query(sa_models.Account).\
                 filter_by(user_id=user_id).\
                 one()
-            account.balance += data['value']
+            self._update_relatively(context, session, account, ['user_id'],
+                                    dict(balance=data['value']))
 
-            if account.balance >= 0:
+            if self._get_balance(session, account) >= 0:
                 account.owed = False
 
+            self._append_ledger(session, self._ledger_entry(
+                const.LEDGER_BONUS if data.get('type') == 'bonus'
+                else const.LEDGER_CHARGE,
+                account.user_id, balance=data['value']))
+
             is_first_charge = False
             if data.get('type') == 'money' and not account.charged:
                 account.charged = True
@@ -1423,16 +2023,12 @@ class Connection(api.Connection):
                 account = session.query(sa_models.Account).\
                     filter_by(user_id=user_id).\
                     one()
-
-                params = dict(balance=account.balance-data['money'])
-                filters = params.keys()
-                filters.append('user_id')
-
-                self._compare_and_swap(model_query(context,
-                                                   sa_models.Account,
-                                                   session=session),
-                                       account, filters, params,
-                                       exception.AccountUpdatetFailed())
+                self._update_relatively(context, session, account,
+                                        ['user_id'],
+                                        dict(balance=-data['money']))
+                self._append_ledger(session, self._ledger_entry(
+                    const.LEDGER_EXTERNAL, user_id, balance=-data['money'],
+                    ref_id=data['reqId']))
 
             deduct = sa_models.Deduct(req_id=data['reqId'],
                                       deduct_id=uuidutils.generate_uuid(),
@@ -1492,6 +2088,7 @@ class Connection(api.Connection):
                     continue
                 order.charged = False
 
+    @reader
     def get_charges(self, context, user_id=None, project_id=None, type=None,
                     start_time=None, end_time=None,
                     limit=None, offset=None, sort_key=None, sort_dir=None):
@@ -1517,6 +2114,7 @@ class Connection(api.Connection):
 
         return (self._row_to_db_charge_model(r) for r in result)
 
+    @reader
     def get_charges_price_and_count(self, context, user_id=None,
                                     project_id=None, type=None,
                                     start_time=None, end_time=None):
@@ -1538,7 +2136,8 @@ class Connection(api.Connection):
             query = query.filter(sa_models.Charge.charge_time >= start_time,
                                  sa_models.Charge.charge_time < end_time)
 
-        return query.one().sum or 0, query.one().count or 0
+        result = query.one()
+        return result.sum or 0, result.count or 0
 
     def create_project(self, context, project):
         session = get_session()
@@ -1584,13 +2183,17 @@ class Connection(api.Connection):
             except NoResultFound:
                 raise exception.AccountNotFound(user_id=project.user_id)
 
-            if account.balance < total_price and account.level != 9:
+            # check the balance atomically with the update
+            if not self._update_relatively(
+                    context, session, account, ['user_id'],
+                    dict(balance=-total_price, frozen_balance=total_price),
+                    criteria=or_(self._balance_at_least(session,
+                                                        account.user_id,
+                                                        total_price),
+                                 sa_models.Account.level == 9)):
                 raise exception.NotSufficientFund(user_id=project.user_id,
                                                   project_id=project_id)
 
-            account.balance -= total_price
-            account.frozen_balance += total_price
-
         return self._row_to_db_account_model(account)
 
     @require_admin_context
@@ -1612,13 +2215,13 @@ class Connection(api.Connection):
             except NoResultFound:
                 raise exception.AccountNotFound(user_id=project.user_id)
 
-            if account.frozen_balance < total_price:
+            if not self._update_relatively(
+                    context, session, account, ['user_id'],
+                    dict(balance=total_price, frozen_balance=-total_price),
+                    criteria=sa_models.Account.frozen_balance >= total_price):
                 raise exception.NotSufficientFrozenBalance(
                     user_id=project.user_id, project_id=project_id)
 
-            account.balance += total_price
-            account.frozen_balance -= total_price
-
         return self._row_to_db_account_model(account)
 
     def get_project(self, context, project_id):
@@ -1631,6 +2234,7 @@ class Connection(api.Connection):
         return self._row_to_db_project_model(project)
 
     @require_context
+    @reader
     def get_user_projects(self, context, user_id=None,
                           limit=None, offset=None):
         # get user's all historical projects
@@ -1669,11 +2273,14 @@ class Connection(api.Connection):
         return (self._row_to_db_project_model(p) for p in projects)
 
     @require_context
-    def get_projects(self, context, user_id=None, active_from=None):
+    def get_projects(self, context, user_id=None, active_from=None,
+                     user_ids=None):
         query = model_query(context, sa_models.Project)
 
         if user_id:
             query = query.filter_by(user_id=user_id)
+        if user_ids is not None:
+            query = query.filter(sa_models.Project.user_id.in_(user_ids))
         if active_from:
             query = query.filter(sa_models.Project.updated_at > active_from)
 
@@ -1684,11 +2291,19 @@ class Connection(api.Connection):
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
                                retry_on_request=True)
     def change_billing_owner(self, context, project_id, user_id):
+        """Change the payer of the project and all its orders
+
+        The orders, the project and the relationship between the user and
+        the project are updated with one statement each.
+
+        Returns the number of the orders whose payer is changed.
+        """
+        start = time.time()
         session = get_session()
         with session.begin():
             # ensure user exists
             try:
-                model_query(context, sa_models.Account).\
+                model_query(context, sa_models.Account, session=session).\
                     filter_by(user_id=user_id).one()
             except NoResultFound:
                 LOG.error("Could not find the user: %s" % user_id)
@@ -1705,50 +2320,40 @@ class Connection(api.Connection):
                 raise exception.ProjectNotFound(project_id=project_id)
 
             # change user_id of all orders belongs to this project
-            orders = model_query(context, sa_models.Order, session=session).\
+            Order = sa_models.Order
+            orders = model_query(context, Order, session=session).\
                 filter_by(project_id=project_id).\
-                all()
-            for order in orders:
-                params = dict(user_id=user_id)
-                filters = params.keys()
-                filters.append('project_id')
-                self._compare_and_swap(model_query(context,
-                                                   sa_models.Order,
-                                                   session=session),
-                                       order, filters, params,
-                                       exception.OrderUpdateFailed())
+                filter(or_(Order.user_id != user_id,
+                           Order.user_id.is_(None))).\
+                update(dict(user_id=user_id), synchronize_session=False)
 
             # change payer of this project
-            params = dict(user_id=user_id)
-            filters = params.keys()
-            filters.append('project_id')
-            self._compare_and_swap(model_query(context,
-                                               sa_models.Project,
-                                               session=session),
-                                   project, filters, params,
-                                   exception.ProjectUpdateFailed())
+            model_query(context, sa_models.Project, session=session).\
+                filter_by(project_id=project_id).\
+                update(dict(user_id=user_id), synchronize_session=False)
 
             # add/update relationship between user and project
-            try:
-                user_project = model_query(
-                    context, sa_models.UserProject, session=session).\
-                    filter_by(user_id=user_id).\
-                    filter_by(project_id=project_id).\
-                    one()
-                params = dict(updated_at=timeutils.utcnow())
-                filters = params.keys()
-                filters.append('user_id')
-                filters.append('project_id')
-                self._compare_and_swap(model_query(context,
-                                                   sa_models.UserProject,
-                                                   session=session),
-                                       user_project, filters, params,
-                                       exception.UserProjectUpdateFailed())
-            except NoResultFound:
-                session.add(sa_models.UserProject(user_id=user_id,
-                                                  project_id=project_id,
-                                                  consumption='0',
-                                                  domain_id=project.domain_id))
+            now = timeutils.utcnow()
+            updated = model_query(
+                context, sa_models.UserProject, session=session).\
+                filter_by(user_id=user_id).\
+                filter_by(project_id=project_id).\
+                update(dict(updated_at=now), synchronize_session=False)
+            if not updated:
+                try:
+                    session.execute(
+                        sa_models.UserProject.__table__.insert(),
+                        dict(user_id=user_id, project_id=project_id,
+                             consumption=0, domain_id=project.domain_id,
+                             created_at=now, updated_at=now))
+                except db_exc.DBDuplicateEntry as e:
+                    # added by a concurrent transaction, update it instead
+                    raise db_exc.RetryRequest(e)
+
+        LOG.info('Changed the billing owner of project %s to %s with %s '
+                 'orders in %.3f seconds', project_id, user_id, orders,
+                 time.time() - start)
+        return orders
 
     @require_admin_context
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
@@ -1819,6 +2424,7 @@ class Connection(api.Connection):
                     region_id=order.region_id,
                     domain_id=order.domain_id)
                 session.add(new_bill)
+                bill = new_bill
             else:
                 # update the latest bill
                 bill.end_time += datetime.timedelta(hours=1)
@@ -1845,10 +2451,10 @@ class Connection(api.Connection):
                 raise exception.UserProjectNotFound(
                     user_id=project.user_id,
                     project_id=order.project_id)
-            project.consumption += order.unit_price
-            project.updated_at = datetime.datetime.utcnow()
-            user_project.consumption += order.unit_price
-            user_project.updated_at = datetime.datetime.utcnow()
+            self._update_consumption(context, session, project,
+                                     order.unit_price)
+            self._update_consumption(context, session, user_project,
+                                     order.unit_price)
 
             # Update account
             try:
@@ -1860,15 +2466,11 @@ class Connection(api.Connection):
                 LOG.error('Could not find the account: %s', project.user_id)
                 raise exception.AccountNotFound(user_id=project.user_id)
 
-            # override account balance before deducting
-            if external_balance is not None:
-                external_balance = quantize(
-                    external_balance)
-                account.balance = external_balance
-
-            account.balance -= order.unit_price
-            account.consumption += order.unit_price
-            account.updated_at = datetime.datetime.utcnow()
+            self._deduct_account(context, session, account,
+                                 order.unit_price, external_balance,
+                                 project_id=project.project_id,
+                                 ref_id=bill.bill_id,
+                                 defer=cfg.CONF.defer_hourly_deduction)
 
             result['user_id'] = account.user_id
             result['project_id'] = project.project_id
@@ -1882,7 +2484,8 @@ class Connection(api.Connection):
                 return result
 
             # Account is owed
-            if self._check_if_account_first_owed(account):
+            if self._check_if_account_first_owed(
+                    account, self._get_balance(session, account)):
                 account.owed = True
                 result['type'] = const.BILL_ACCOUNT_OWED
             # Order is owed
@@ -1968,7 +2571,9 @@ class Connection(api.Connection):
             # override account balance before deducting
             if external_balance is not None:
                 external_balance = quantize(external_balance)
-                account.balance = external_balance
+                self._update_relatively(context, session, account,
+                                        ['user_id'], {},
+                                        balance=external_balance)
 
             result['user_id'] = account.user_id
             result['project_id'] = project.project_id
@@ -2002,7 +2607,8 @@ class Connection(api.Connection):
                 next_cron_time = gringutils.add_months(action_time, months)
                 total_price = order.unit_price * order.renew_period
 
-                if account.balance < total_price and account.level != 9:
+                if self._get_balance(session, account) < total_price and \
+                        account.level != 9:
                     reserved_days = gringutils.cal_reserved_days(account.level)
                     date_time = (datetime.datetime.utcnow() +
                                  datetime.timedelta(days=reserved_days))
@@ -2058,15 +2664,14 @@ class Connection(api.Connection):
                 raise exception.UserProjectNotFound(
                     user_id=project.user_id,
                     project_id=order.project_id)
-            project.consumption += total_price
-            project.updated_at = datetime.datetime.utcnow()
-            user_project.consumption += total_price
-            user_project.updated_at = datetime.datetime.utcnow()
+            self._update_consumption(context, session, project, total_price)
+            self._update_consumption(context, session, user_project,
+                                     total_price)
 
             # Update account
-            account.balance -= total_price
-            account.consumption += total_price
-            account.updated_at = datetime.datetime.utcnow()
+            self._deduct_account(context, session, account, total_price,
+                                 project_id=project.project_id,
+                                 ref_id=bill.bill_id)
 
             result['type'] = const.BILL_NORMAL
 
@@ -2077,7 +2682,8 @@ class Connection(api.Connection):
                 return result
 
             # Account is owed
-            if self._check_if_account_first_owed(account):
+            if self._check_if_account_first_owed(
+                    account, self._get_balance(session, account)):
                 account.owed = True
                 result['type'] = const.BILL_ACCOUNT_OWED
             # Order is owed
@@ -2101,6 +2707,41 @@ class Connection(api.Connection):
 
             return result
 
+    def _deduct_account(self, context, session, account, total_price,
+                        external_balance=None, project_id=None, ref_id=None,
+                        defer=False):
+        """Deduct total_price from the balance into the consumption
+
+        The balance is overridden by external_balance before deducting if it
+        is not None. The deduction is only appended to the ledger if defer
+        is True, it is applied to the account when the balance snapshots
+        are refreshed.
+        """
+        entries = []
+        deltas = dict(consumption=total_price)
+        params = {}
+        if external_balance is not None:
+            balance = self._get_balance(session, account)
+            external_balance = quantize(external_balance)
+            entries.append(self._ledger_entry(
+                const.LEDGER_EXTERNAL, account.user_id,
+                balance=external_balance - balance))
+            # the deferred tail is still to be folded into the account
+            params['balance'] = (external_balance - total_price -
+                                 (balance - account.balance))
+            defer = False
+        else:
+            deltas['balance'] = -total_price
+        entries.append(self._ledger_entry(
+            const.LEDGER_BILL, account.user_id, balance=-total_price,
+            consumption=total_price, project_id=project_id, ref_id=ref_id,
+            deferred=defer))
+
+        if not defer:
+            self._update_relatively(context, session, account, ['user_id'],
+                                    deltas, **params)
+        self._append_ledger(session, *entries)
+
     def _check_if_account_charged(self, account, order):
         if not account.owed and order.owed:
             return True
@@ -2111,10 +2752,12 @@ class Connection(api.Connection):
             return True
         return False
 
-    def _check_if_account_first_owed(self, account):
+    def _check_if_account_first_owed(self, account, balance=None):
         if account.level == 9:
             return False
-        if not account.owed and account.balance <= 0:
+        if balance is None:
+            balance = account.balance
+        if not account.owed and balance <= 0:
             return True
         else:
             return False
@@ -2169,8 +2812,7 @@ class Connection(api.Connection):
                 LOG.error('Could not find the project: %s', order.project_id)
                 raise exception.ProjectNotFound(project_id=order.project_id)
 
-            project.consumption -= more_fee
-            project.updated_at = datetime.datetime.utcnow()
+            self._update_consumption(context, session, project, -more_fee)
 
             # Update user_project
             try:
@@ -2186,8 +2828,8 @@ class Connection(api.Connection):
                 raise exception.UserProjectNotFound(
                     user_id=project.user_id,
                     project_id=order.project_id)
-            user_project.consumption -= more_fee
-            user_project.updated_at = datetime.datetime.utcnow()
+            self._update_consumption(context, session, user_project,
+                                     -more_fee)
 
             # Update the account
             try:
@@ -2199,14 +2841,10 @@ class Connection(api.Connection):
                 LOG.error('Could not find the account: %s' % order.project_id)
                 raise exception.AccountNotFound(project_id=order.project_id)
 
-            # override account balance before deducting
-            if external_balance is not None:
-                external_balance = quantize(external_balance)
-                account.balance = external_balance
-
-            account.balance += more_fee
-            account.consumption -= more_fee
-            account.updated_at = datetime.datetime.utcnow()
+            self._deduct_account(context, session, account, -more_fee,
+                                 external_balance,
+                                 project_id=project.project_id,
+                                 ref_id=bill.bill_id)
 
             result['user_id'] = account.user_id
             result['project_id'] = project.project_id
@@ -2219,7 +2857,7 @@ class Connection(api.Connection):
             if not cfg.CONF.enable_owe:
                 return result
 
-            if account.owed and account.balance > 0:
+            if account.owed and self._get_balance(session, account) > 0:
                 result['type'] = const.BILL_ACCOUNT_NOT_OWED
                 account.owed = False
 
@@ -2260,8 +2898,10 @@ class Connection(api.Connection):
             order.cron_time = bill.end_time
             order.total_price -= more_fee
 
-            account.balance += more_fee
-            account.consumption -= more_fee
+            # refund the fee that is deducted in advance
+            self._deduct_account(context, session, account, -more_fee,
+                                 project_id=order.project_id,
+                                 ref_id=order_id)
 
     @require_context
     def create_precharge(self, context, **kwargs):
@@ -2284,6 +2924,7 @@ class Connection(api.Connection):
                     else:
                         break
 
+    @reader
     def get_precharges(self, context, user_id=None, limit=None, offset=None,
                        sort_key=None, sort_dir=None):
         query = model_query(context, sa_models.PreCharge).\
@@ -2299,6 +2940,7 @@ class Connection(api.Connection):
 
         return (self._row_to_db_precharge_model(r) for r in result)
 
+    @reader
     def get_precharges_count(self, context, user_id=None):
         query = model_query(context, sa_models.PreCharge,
                             func.count(sa_models.PreCharge.id).
@@ -2389,9 +3031,13 @@ class Connection(api.Connection):
             except NoResultFound:
                 raise exception.AccountNotFound(user_id=user_id)
 
-            account.balance += precharge.price
-            if account.balance >= 0:
+            self._update_relatively(context, session, account, ['user_id'],
+                                    dict(balance=precharge.price))
+            if self._get_balance(session, account) >= 0:
                 account.owed = False
+            self._append_ledger(session, self._ledger_entry(
+                const.LEDGER_PRECHARGE, account.user_id,
+                balance=precharge.price, ref_id=code))
 
             # Add charge records
             charge_time = datetime.datetime.utcnow()
@@ -2441,8 +3087,10 @@ class Connection(api.Connection):
             if new_order.total_price > 0:
                 account = session.query(sa_models.Account).\
                     filter_by(project_id=new_order.project_id).one()
-                account.balance += new_order.total_price
-                account.consumption -= new_order.total_price
+                self._deduct_account(context, session, account,
+                                     -new_order.total_price,
+                                     project_id=new_order.project_id,
+                                     ref_id=new_order.order_id)
 
             bills = session.query(sa_models.Bill).\
                 filter_by(order_id=new_order.order_id)
@@ -2508,8 +3156,9 @@ class Connection(api.Connection):
             order.cron_time = cron_time
 
             order.total_price -= more_fee
-            account.balance += more_fee
-            account.consumption -= more_fee
+            self._deduct_account(context, session, account, -more_fee,
+                                 project_id=order.project_id,
+                                 ref_id=order.order_id)
 
     @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
                                retry_on_request=True)
@@ -2528,14 +3177,28 @@ class Connection(api.Connection):
                     account_to.domain_id != account_from.domain_id:
                 raise exception.NotAuthorized()
 
-            if account_from.balance <= 0:
-                raise exception.NoBalanceToTransfer(value=account_from.balance)
-
-            if account_from.balance < data.money:
+            balance_from = self._get_balance(session, account_from)
+            if balance_from <= 0:
+                raise exception.NoBalanceToTransfer(value=balance_from)
+
+            # check the balance atomically with the update
+            if not self._update_relatively(
+                    cxt, session, account_from, ['user_id'],
+                    dict(balance=-data.money),
+                    criteria=self._balance_at_least(session,
+                                                    account_from.user_id,
+                                                    data.money)):
                 raise exception.InvalidTransferMoneyValue(value=data.money)
-
-            account_to.balance += data.money
-            account_from.balance -= data.money
+            self._update_relatively(cxt, session, account_to, ['user_id'],
+                                    dict(balance=data.money))
+            self._append_ledger(
+                session,
+                self._ledger_entry(const.LEDGER_TRANSFER,
+                                   account_from.user_id, balance=-data.money,
+                                   ref_id=account_to.user_id),
+                self._ledger_entry(const.LEDGER_TRANSFER,
+                                   account_to.user_id, balance=data.money,
+                                   ref_id=account_from.user_id))
 
             remarks = data.remarks if data.remarks != wsme.Unset else None
             charge_time = datetime.datetime.utcnow()
@@ -2586,6 +3249,7 @@ class Connection(api.Connection):
                     LOG.warning('Account %s does not exist', user_id)
                     raise exception.AccountNotFound(user_id=user_id)
 
+    @reader
     def get_salesperson_amount(self, context, sales_id):
         session = get_session()
         query = session.query(
@@ -2601,6 +3265,7 @@ class Connection(api.Connection):
 
         return result.count, result.sales_amount
 
+    @reader
     def get_salesperson_customer_accounts(self, context, sales_id,
                                           offset=None, limit=None):
         session = get_session()
@@ -2660,11 +3325,12 @@ class Connection(api.Connection):
                     filter_by(type=const.STATE_RUNNING).\
                     with_lockmode('read').all()
                 for sub in subs:
-                    unit_price = jsonutils.loads(sub.unit_price)
-                    price_data = pricing.get_price_data(
-                        unit_price, order.renew_method)
-                    new_unit_price += pricing.calculate_price(
-                        sub.quantity, price_data)
+                    plan = pricing.get_price_plan(
+                        get_plan_unit_price(sub.price_plan_id, sub.unit_price,
+                                            session=session),
+                        order.renew_method)
+                    if plan:
+                        new_unit_price += plan.calculate(sub.quantity)
                 order.unit = renew.method
                 order.unit_price = new_unit_price
 
@@ -2755,17 +3421,19 @@ class Connection(api.Connection):
                     with_lockmode('read').all()
                 unit_price = 0
                 for sub in subs:
-                    unit_price = jsonutils.loads(sub.unit_price)
-                    price_data = pricing.get_price_data(
-                        unit_price, renew.method)
-                    unit_price += pricing.calculate_price(
-                        sub.quantity, price_data)
+                    plan = pricing.get_price_plan(
+                        get_plan_unit_price(sub.price_plan_id, sub.unit_price,
+                                            session=session),
+                        renew.method)
+                    if plan:
+                        unit_price += plan.calculate(sub.quantity)
             else:
                 unit_price = order.unit_price
 
             total_price = unit_price * renew.period
 
-            if account.balance < total_price and account.level != 9:
+            if self._get_balance(session, account) < total_price and \
+                    account.level != 9:
                 raise exception.NotSufficientFund(user_id=project.user_id,
                                                   project_id=order.project_id)
 
@@ -2825,14 +3493,13 @@ class Connection(api.Connection):
                 raise exception.UserProjectNotFound(
                     user_id=project.user_id,
                     project_id=order.project_id)
-            project.consumption += total_price
-            project.updated_at = datetime.datetime.utcnow()
-            user_project.consumption += total_price
-            user_project.updated_at = datetime.datetime.utcnow()
+            self._update_consumption(context, session, project, total_price)
+            self._update_consumption(context, session, user_project,
+                                     total_price)
 
             # Update account
-            account.balance -= total_price
-            account.consumption += total_price
-            account.updated_at = datetime.datetime.utcnow()
+            self._deduct_account(context, session, account, total_price,
+                                 project_id=project.project_id,
+                                 ref_id=bill.bill_id)
 
         return self._row_to_db_order_model(order), total_price
@@ -83,6 +83,7 @@ class Product(Base):
     description = Column(String(255))
 
     unit_price = Column(Text)
+    price_plan_id = Column(Integer)
     deleted = Column(Boolean)
 
     created_at = Column(DateTime, default=timeutils.utcnow)
@@ -146,7 +147,9 @@ class Subscription(Base):
     type = Column(String(64))
 
     product_id = Column(String(255))
+    # NULL since the price plans are normalized, see price_plan_id
     unit_price = Column(Text)
+    price_plan_id = Column(Integer)
     quantity = Column(Integer)
 
     order_id = Column(String(255))
@@ -159,6 +162,25 @@ class Subscription(Base):
     updated_at = Column(DateTime)
 
 
+class PricePlan(Base):
+    """The unit price of products and subscriptions, stored once
+
+    A plan never changes once created, the subscriptions of the same unit
+    price share one plan found by the hash of its content.
+    """
+
+    __tablename__ = 'price_plan'
+    __table_args__ = (
+        Index('ix_price_plan_plan_hash', 'plan_hash', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    plan_hash = Column(String(40))
+    unit_price = Column(Text)
+
+    created_at = Column(DateTime, default=timeutils.utcnow)
+
+
 class Bill(Base):
 
     __tablename__ = 'bill'
@@ -300,3 +322,39 @@ class Deduct(Base):
 
     order_id = Column(String(255))
     created_at = Column(DateTime, default=timeutils.utcnow)
+
+
+class Ledger(Base):
+    """Append-only entries of the changes of the accounts"""
+
+    __tablename__ = 'ledger'
+    __table_args__ = (
+        Index('ix_ledger_user_id_id', 'user_id', 'id'),
+        Index('ix_ledger_created_at', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String(255))
+    project_id = Column(String(255))
+    # bill, charge, bonus, transfer, precharge or external
+    type = Column(String(64))
+    # signed changes of the balance and consumption of the account
+    balance = Column(DECIMAL(20, 4), default=0)
+    consumption = Column(DECIMAL(20, 4), default=0)
+    # the entry is not applied to the account until it is folded into
+    # the balance snapshot
+    deferred = Column(Boolean, default=False)
+    ref_id = Column(String(255))
+
+    created_at = Column(DateTime, default=timeutils.utcnow)
+
+
+class BalanceSnapshot(Base):
+    """The last deferred ledger entry folded into the account"""
+
+    __tablename__ = 'balance_snapshot'
+
+    user_id = Column(String(255), primary_key=True)
+    ledger_id = Column(Integer, default=0)
+
+    updated_at = Column(DateTime, default=timeutils.utcnow)
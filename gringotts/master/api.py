@@ -42,6 +42,12 @@ class LocalAPI(object):
     def get_apsched_jobs_count(self, ctxt):
         return self._service.get_apsched_jobs_count(ctxt)
 
+    def get_deduct_stats(self, ctxt):
+        return self._service.get_deduct_stats(ctxt)
+
+    def batch(self, ctxt, method, items):
+        self._service.batch(ctxt, method, items)
+
     def resource_created(self, ctxt, order_id, action_time, remarks):
         self._service.resource_created(ctxt, order_id, action_time, remarks)
 
@@ -1,10 +1,14 @@
 from oslo_config import cfg
 
+from gringotts import coordination
+from gringotts.master import service as master_service
 from gringotts.openstack.common.rpc import proxy
 
 
 cfg.CONF.import_opt('master_topic', 'gringotts.master.service',
                     group='master')
+cfg.CONF.import_opt('enable_partitioning', 'gringotts.master.service',
+                    group='master')
 
 
 class MasterAPI(proxy.RpcProxy):
@@ -14,12 +18,32 @@ class MasterAPI(proxy.RpcProxy):
         super(MasterAPI, self).__init__(
             topic=cfg.CONF.master.master_topic,
             default_version=self.BASE_RPC_VERSION)
+        self.partition_coordinator = None
+        if cfg.CONF.master.enable_partitioning:
+            self.partition_coordinator = coordination.PartitionCoordinator()
+            self.partition_coordinator.start()
+
+    def _order_topic(self, order_id):
+        """Return the node topic of the master that owns the order
+
+        None means the shared topic, which is used if partitioning is
+        disabled or no master is known.
+        """
+        if not self.partition_coordinator or \
+                not self.partition_coordinator.is_active():
+            return None
+        ring = self.partition_coordinator.get_ring(
+            master_service.PARTITIONING_GROUP_NAME, join=False)
+        if not ring:
+            return None
+        return '%s.%s' % (self.topic, ring.get_node(order_id))
 
     def create_monthly_job(self, ctxt, order_id, run_date):
         return self.cast(ctxt,
                          self.make_msg('create_monthly_job',
                                        order_id=order_id,
-                                       run_date=run_date))
+                                       run_date=run_date),
+                         topic=self._order_topic(order_id))
 
     def change_monthly_job_time(self, ctxt, order_id, run_date,
                                 clear_date_jobs=None):
@@ -27,51 +51,79 @@ class MasterAPI(proxy.RpcProxy):
                          self.make_msg('change_monthly_job_time',
                                        order_id=order_id,
                                        run_date=run_date,
-                                       clear_date_jobs=clear_date_jobs))
+                                       clear_date_jobs=clear_date_jobs),
+                         topic=self._order_topic(order_id))
 
     def delete_sched_jobs(self, ctxt, order_id):
         return self.cast(ctxt,
                          self.make_msg('delete_sched_jobs',
-                                       order_id=order_id))
+                                       order_id=order_id),
+                         topic=self._order_topic(order_id))
 
     def get_apsched_jobs_count(self, ctxt):
         return self.call(ctxt,
                          self.make_msg('get_apsched_jobs_count'))
 
+    def get_deduct_stats(self, ctxt):
+        return self.call(ctxt,
+                         self.make_msg('get_deduct_stats'))
+
+    def batch(self, ctxt, method, items):
+        """Call the method of master for the items of many orders
+
+        The items are grouped by the masters that own their orders, every
+        master gets one message for its items.
+        """
+        topics = {}
+        for item in items:
+            topic = self._order_topic(item['order_id'])
+            topics.setdefault(topic, []).append(item)
+        for topic, topic_items in topics.items():
+            self.cast(ctxt,
+                      self.make_msg('batch',
+                                    method=method,
+                                    items=topic_items),
+                      topic=topic)
+
     def resource_created(self, ctxt, order_id, action_time, remarks):
         return self.cast(ctxt,
                          self.make_msg('resource_created',
                                        order_id=order_id,
                                        action_time=action_time,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
 
     def resource_created_again(self, ctxt, order_id, action_time, remarks):
         return self.cast(ctxt,
                          self.make_msg('resource_created_again',
                                        order_id=order_id,
                                        action_time=action_time,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
 
     def resource_started(self, ctxt, order_id, action_time, remarks):
         return self.cast(ctxt,
                          self.make_msg('resource_started',
                                        order_id=order_id,
                                        action_time=action_time,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
 
     def resource_stopped(self, ctxt, order_id, action_time, remarks):
         return self.cast(ctxt,
                          self.make_msg('resource_stopped',
                                        order_id=order_id,
                                        action_time=action_time,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
 
     def resource_deleted(self, ctxt, order_id, action_time, remarks):
         return self.cast(ctxt,
                          self.make_msg('resource_deleted',
                                        order_id=order_id,
                                        action_time=action_time,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
 
     def resource_changed(self, ctxt, order_id, action_time, change_to, remarks):
         return self.cast(ctxt,
@@ -79,7 +131,8 @@ class MasterAPI(proxy.RpcProxy):
                                        order_id=order_id,
                                        action_time=action_time,
                                        change_to=change_to,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
 
     def resource_resized(self, ctxt, order_id, action_time, quantity, remarks):
         return self.call(ctxt,
@@ -87,13 +140,15 @@ class MasterAPI(proxy.RpcProxy):
                                        order_id=order_id,
                                        action_time=action_time,
                                        quantity=quantity,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
 
     def instance_stopped(self, ctxt, order_id, action_time):
         return self.cast(ctxt,
                          self.make_msg('instance_stopped',
                                        order_id=order_id,
-                                       action_time=action_time))
+                                       action_time=action_time),
+                         topic=self._order_topic(order_id))
 
     def instance_resized(self, ctxt, order_id, action_time,
                          new_flavor, old_flavor,
@@ -106,4 +161,5 @@ class MasterAPI(proxy.RpcProxy):
                                        old_flavor=old_flavor,
                                        service=service,
                                        region_id=region_id,
-                                       remarks=remarks))
+                                       remarks=remarks),
+                         topic=self._order_topic(order_id))
@@ -1,7 +1,13 @@
 import datetime
+import functools
+import hashlib
+import inspect
 import time
 
+from apscheduler.jobstores import memory as memory_store
+from apscheduler.jobstores import sqlalchemy as sqlalchemy_store
 from apscheduler.schedulers import background  # noqa
+from eventlet import greenpool
 from eventlet.green import threading as gthreading  # noqa
 from oslo_config import cfg
 import pytz
@@ -9,7 +15,9 @@ import pytz
 from gringotts.client import client
 from gringotts import constants as const
 from gringotts import context
+from gringotts import coordination
 from gringotts.openstack.common import log
+from gringotts.openstack.common.rpc import proxy
 from gringotts.openstack.common.rpc import service as rpc_service
 from gringotts.openstack.common import service as os_service
 from gringotts.openstack.common import timeutils
@@ -33,6 +41,57 @@ OPTS = [
     cfg.IntOpt('clean_date_jobs_interval',
                default=30,
                help="The interval to clean date jobs, unit is minute"),
+    cfg.IntOpt('order_lock_stripes',
+               default=1024,
+               help="The number of locks that serialize the operations of "
+                    "orders, orders hashed to the same lock are serialized "
+                    "with each other"),
+    cfg.BoolOpt('enable_partitioning',
+                default=False,
+                help="Shard the orders across the masters that join the "
+                     "coordination group, every master only schedules the "
+                     "jobs of the orders hashed to it. It requires "
+                     "coordination.backend_url to be set for the masters "
+                     "and the services that call master"),
+    cfg.StrOpt('job_store_url',
+               default=None,
+               help="The database URL of the job store that persists the "
+                    "scheduled jobs, so master restarts without reloading "
+                    "all the orders. Jobs are kept in memory and rebuilt "
+                    "from the orders on every start if it is not set"),
+    cfg.StrOpt('job_store_table',
+               default='master_jobs',
+               help="The table of the job store, every master needs its own "
+                    "table if partitioning is enabled"),
+    cfg.IntOpt('catch_up_workers',
+               default=8,
+               help="The number of green threads that bill the overdue "
+                    "orders concurrently when loading the hourly jobs"),
+    cfg.IntOpt('deduct_spread_window',
+               default=0,
+               help="Delay the hourly deduction of every order by a stable "
+                    "offset within this many seconds, to spread the orders "
+                    "created at the same time over the window. It should "
+                    "be less than 3600, 0 disables it"),
+    cfg.FloatOpt('deduct_rate',
+                 default=0,
+                 help="The max number of scheduled deductions per second "
+                      "that master sends to the API, the excess ones wait "
+                      "for their turn. 0 means no limit"),
+    cfg.IntOpt('deduct_burst',
+               default=0,
+               help="The number of scheduled deductions that are allowed "
+                    "to exceed deduct_rate at once, defaults to the rate"),
+    cfg.IntOpt('snapshot_refresh_interval',
+               default=0,
+               help="The interval to fold the deferred hourly deductions "
+                    "into the accounts, unit is second. It should be set "
+                    "if defer_hourly_deduction is enabled for the API, 0 "
+                    "disables it"),
+    cfg.IntOpt('snapshot_refresh_limit',
+               default=1000,
+               help="The max number of accounts whose balance snapshots "
+                    "are refreshed at a time"),
 ]
 
 OPTS_GLOBAL = [
@@ -51,25 +110,132 @@ cfg.CONF.register_opts(OPTS_GLOBAL)
 cfg.CONF.register_opts(OPTS, group="master")
 cfg.CONF.import_opt('region_name', 'gringotts.waiter.service')
 
+PARTITIONING_GROUP_NAME = 'gringotts_master'
+
+# Prefixes of the ids of the jobs that are scheduled for an order
+JOB_ID_PREFIXES = ('30-days-', 'cron-', 'date-', 'monthly-')
+
+# States of the orders that have cron jobs
+CRON_STATES = (const.STATE_RUNNING, const.STATE_STOPPED, const.STATE_SUSPEND)
+
+# Methods of the orders that can be called in batches
+BATCH_METHODS = ('resource_created', 'resource_created_again',
+                 'resource_deleted', 'resource_changed', 'instance_stopped')
+
+# Job store of the jobs that are not bound to orders, they are added on
+# every start so they should never be persisted
+VOLATILE_JOB_STORE = 'volatile'
+
+# NOTE: Jobs of the persistent job store can only refer to module level
+# functions, so they run the methods of the master service of this process
+# through the functions below.
+_master_service = None
+
+
+def pre_deduct(order_id):
+    _master_service._pre_deduct(order_id)
+
+
+def handle_monthly_order(order_id):
+    _master_service._handle_monthly_order(order_id)
+
+
+def delete_owed_resource(resource_type, resource_id, region_id):
+    _master_service._delete_owed_resource(resource_type, resource_id,
+                                          region_id)
+
+
+def owned_order(func):
+    """Forward the message of an order to the master that owns it
+
+    The callers route the messages by their own view of the group, which
+    may be stale, or fall back to the shared topic, so a master may get
+    the messages of the orders of others. Handling them here would
+    schedule a second hourly job besides the one of the owner, and deduct
+    the order twice, so they are forwarded to the owner by the view of
+    this master.
+
+    A message is forwarded only once. If the owner sees the order as not
+    its own either, the views of the group have not converged yet, it
+    handles the message anyway, and the rebalance after the views converge
+    moves the jobs to the owner.
+    """
+    @functools.wraps(func)
+    def wrapper(self, ctxt, *args, **kwargs):
+        forwarded = kwargs.pop('forwarded', False)
+        callargs = inspect.getcallargs(func, self, ctxt, *args, **kwargs)
+        order_id = callargs['order_id']
+        owner = self._get_order_owner(order_id)
+        if owner and not forwarded:
+            LOG.warn('Order %s is owned by master %s, forward %s to it',
+                     order_id, owner, func.__name__)
+            del callargs['self'], callargs['ctxt']
+            return self.forward_rpcapi.cast(
+                ctxt,
+                self.forward_rpcapi.make_msg(func.__name__, forwarded=True,
+                                             **callargs),
+                topic='%s.%s' % (cfg.CONF.master.master_topic, owner))
+        if owner:
+            LOG.warn('Order %s is owned by master %s in the view of this '
+                     'master, handle the forwarded %s anyway',
+                     order_id, owner, func.__name__)
+        return func(self, ctxt, *args, **kwargs)
+    return wrapper
+
 
 class MasterService(rpc_service.Service):
 
     def __init__(self, *args, **kwargs):
+        global _master_service
+
         kwargs.update(
             host=cfg.CONF.host,
             topic=cfg.CONF.master.master_topic,
         )
 
-        self.locks = {}
+        self.partition_coordinator = None
+        self.forward_rpcapi = proxy.RpcProxy(
+            topic=cfg.CONF.master.master_topic, default_version='1.0')
+        self.rebalance_lock = gthreading.Lock()
+        self.locks = utils.StripedLock(cfg.CONF.master.order_lock_stripes,
+                                       gthreading.Lock)
         self.gclient = client.get_client()
         self.ctxt = context.get_admin_context()
 
+        self.deduct_bucket = None
+        if cfg.CONF.master.deduct_rate > 0:
+            self.deduct_bucket = utils.TokenBucket(
+                cfg.CONF.master.deduct_rate,
+                cfg.CONF.master.deduct_burst or None)
+        self.deduct_stats = {
+            'deducted': 0,
+            'lag_total': 0.0,
+            'lag_max': 0.0,
+            'throttled': 0.0,
+        }
+
+        # NOTE: The runs that are missed while master is down are run once
+        # when it starts again, however late they are. A late hourly run
+        # bills the order up to now, so the other missed runs must be
+        # coalesced into it rather than replayed, every replay would bill
+        # one more hour in advance.
         job_defaults = {
             'misfire_grace_time': 6048000,
-            'coalesce': False,
+            'coalesce': True,
             'max_instances': 24,
         }
+        if cfg.CONF.master.job_store_url:
+            self.job_store = sqlalchemy_store.SQLAlchemyJobStore(
+                url=cfg.CONF.master.job_store_url,
+                tablename=cfg.CONF.master.job_store_table)
+        else:
+            self.job_store = memory_store.MemoryJobStore()
+        jobstores = {
+            'default': self.job_store,
+            VOLATILE_JOB_STORE: memory_store.MemoryJobStore(),
+        }
         self.apsched = background.BackgroundScheduler(
+            jobstores=jobstores,
             job_defaults=job_defaults,
             timezone=pytz.utc)
 
@@ -77,31 +243,198 @@ class MasterService(rpc_service.Service):
         self.STOP_METHOD_MAP = services.STOP_METHOD_MAP
         self.RESOURCE_GET_MAP = services.RESOURCE_GET_MAP
 
+        _master_service = self
         super(MasterService, self).__init__(*args, **kwargs)
 
+    def _has_persisted_jobs(self):
+        if isinstance(self.job_store, sqlalchemy_store.SQLAlchemyJobStore):
+            # APScheduler>=3.1 creates the table of the job store only when
+            # the scheduler starts, which is too late to query it
+            self.job_store.jobs_t.create(self.job_store.engine,
+                                         checkfirst=True)
+        return self.job_store.get_next_run_time() is not None
+
     def start(self):
+        # The jobs persisted by the last run are still scheduled, there is
+        # no need to rebuild them from the orders
+        warm_start = self._has_persisted_jobs()
+
         self.apsched.start()
-        self.load_hourly_cron_jobs()
-        # dirty hack, remove it latter
-        if cfg.CONF.region_name == 'uc' or \
-                cfg.CONF.region_name == 'RegionOne':
-            self.load_monthly_cron_jobs()
-        LOG.warning('Load cron jobs successfully.')
+        if cfg.CONF.master.enable_partitioning:
+            self.start_partitioning()
+
+        if warm_start:
+            LOG.warning('Load cron jobs from the job store.')
+            self.reconcile_jobs()
+        else:
+            self.load_hourly_cron_jobs()
+            # dirty hack, remove it latter
+            if cfg.CONF.region_name == 'uc' or \
+                    cfg.CONF.region_name == 'RegionOne':
+                self.load_monthly_cron_jobs()
+            LOG.warning('Load cron jobs successfully.')
 
         if cfg.CONF.enable_owe:
-            self.load_date_jobs()
+            if not warm_start:
+                self.load_date_jobs()
             self.load_clean_date_jobs()
 
+        if cfg.CONF.master.snapshot_refresh_interval > 0:
+            self.apsched.add_job(
+                self.refresh_balance_snapshots,
+                'interval',
+                jobstore=VOLATILE_JOB_STORE,
+                seconds=cfg.CONF.master.snapshot_refresh_interval)
+
         super(MasterService, self).start()
         LOG.warning('Master started successfully.')
 
         # Add a dummy thread to have wait() working
         self.tg.add_timer(604800, lambda: None)
 
+    def start_partitioning(self):
+        """Join the group of masters to own a slice of the orders
+
+        The member id is the host, so that the callers can cast the
+        messages of an order to the node topic of its owner.
+        """
+        self.partition_coordinator = coordination.PartitionCoordinator(
+            cfg.CONF.host)
+        self.partition_coordinator.start()
+        self.partition_coordinator.join_group(PARTITIONING_GROUP_NAME)
+
+        if self.partition_coordinator.is_active():
+            self.partition_coordinator.watch_group(PARTITIONING_GROUP_NAME,
+                                                   self._members_changed)
+            self.apsched.add_job(self.partition_coordinator.heartbeat,
+                                 'interval',
+                                 jobstore=VOLATILE_JOB_STORE,
+                                 seconds=cfg.CONF.coordination.heartbeat)
+            self.apsched.add_job(self.partition_coordinator.run_watchers,
+                                 'interval',
+                                 jobstore=VOLATILE_JOB_STORE,
+                                 seconds=cfg.CONF.coordination.check_watchers)
+
+    def _members_changed(self, event):
+        LOG.warn('Members of group %s changed, rebalancing orders',
+                 PARTITIONING_GROUP_NAME)
+        self.rebalance()
+
+    def _extract_my_orders(self, orders):
+        if not self.partition_coordinator:
+            return orders
+        order_ids = set(self.partition_coordinator.extract_my_subset(
+            PARTITIONING_GROUP_NAME, [o['order_id'] for o in orders]))
+        return [o for o in orders if o['order_id'] in order_ids]
+
+    def _get_order_owner(self, order_id):
+        """Return the master that owns the order, None if it is this one
+
+        The orders are handled by this master if the owner is unknown, e.g.
+        partitioning is disabled or the coordination backend is down.
+        """
+        if not self.partition_coordinator or \
+                not self.partition_coordinator.is_active():
+            return None
+        ring = self.partition_coordinator.get_ring(PARTITIONING_GROUP_NAME)
+        if not ring or self.partition_coordinator.extract_my_subset(
+                PARTITIONING_GROUP_NAME, [order_id]):
+            return None
+        return ring.get_node(order_id)
+
+    @staticmethod
+    def _get_job_order_id(job_id):
+        for prefix in JOB_ID_PREFIXES:
+            if job_id.startswith(prefix):
+                return job_id[len(prefix):]
+
+    def rebalance(self):
+        """Reschedule the jobs after the members of the group changed
+
+        Drop the jobs of the orders that are owned by other masters now, and
+        load the jobs of the orders that are taken over by this master.
+        """
+        with self.rebalance_lock:
+            members = self.partition_coordinator.get_members(
+                PARTITIONING_GROUP_NAME)
+            if cfg.CONF.host not in members:
+                # NOTE: keep the jobs rather than dropping all of them if
+                # the coordination backend is unavailable for the moment
+                LOG.warn('Master %s is not a member of group %s, skip '
+                         'rebalancing', cfg.CONF.host,
+                         PARTITIONING_GROUP_NAME)
+                return
+
+            jobs = dict((job.id, self._get_job_order_id(job.id))
+                        for job in self.apsched.get_jobs())
+            order_ids = set(order_id for order_id in jobs.values()
+                            if order_id)
+            my_order_ids = set(self.partition_coordinator.extract_my_subset(
+                PARTITIONING_GROUP_NAME, list(order_ids)))
+            for job_id, order_id in jobs.iteritems():
+                if order_id and order_id not in my_order_ids:
+                    self._delete_apsched_job(job_id)
+
+            self.load_hourly_cron_jobs()
+            if cfg.CONF.region_name == 'uc' or \
+                    cfg.CONF.region_name == 'RegionOne':
+                self.load_monthly_cron_jobs()
+            if cfg.CONF.enable_owe:
+                self.load_date_jobs()
+            LOG.warning('Rebalance orders successfully, own %s jobs now.',
+                        len(self.apsched.get_jobs()))
+
+    def reconcile_jobs(self):
+        """Reconcile the persisted jobs with the orders on a warm start
+
+        The orders may change while master is down, so the jobs of the
+        orders that are not active any more are dropped, and only the
+        orders that have no job, e.g. the ones created in the meantime,
+        are fetched to load their jobs. The jobs that are overdue are run
+        once by the scheduler when it starts, as their runs are coalesced.
+        """
+        orders = self.gclient.get_active_orders(
+            fields=['order_id', 'unit', 'owed', 'region_id'])
+        active_order_ids = set(order['order_id'] for order in orders)
+        job_ids = set()
+        for job in self.apsched.get_jobs():
+            order_id = self._get_job_order_id(job.id)
+            if order_id and order_id not in active_order_ids:
+                self._delete_apsched_job(job.id)
+            else:
+                job_ids.add(job.id)
+
+        hourly_orders = []
+        monthly_orders = []
+        for order in self._extract_my_orders(orders):
+            order_id = order['order_id']
+            if order['unit'] == 'hour':
+                if order['region_id'] == cfg.CONF.region_name and \
+                        self._make_cron_job_id(order_id) not in job_ids:
+                    hourly_orders.append(order_id)
+            elif order['unit'] in ('month', 'year'):
+                if not order['owed'] and \
+                        self._make_monthly_job_id(order_id) not in job_ids:
+                    monthly_orders.append(order_id)
+
+        self._load_hourly_cron_jobs(self._get_cron_orders_by_ids(
+            hourly_orders), job_ids)
+        if cfg.CONF.region_name == 'uc' or \
+                cfg.CONF.region_name == 'RegionOne':
+            self._load_monthly_cron_jobs(self._get_cron_orders_by_ids(
+                monthly_orders), job_ids)
+        if cfg.CONF.enable_owe:
+            self.load_date_jobs()
+        LOG.warning('Reconcile jobs successfully, loaded %s orders without '
+                    'jobs, own %s jobs now.',
+                    len(hourly_orders) + len(monthly_orders),
+                    len(self.apsched.get_jobs()))
+
     def load_clean_date_jobs(self):
         self.clean_date_jobs()
         self.apsched.add_job(self.clean_date_jobs,
                              'interval',
+                             jobstore=VOLATILE_JOB_STORE,
                              minutes=cfg.CONF.master.clean_date_jobs_interval)
         LOG.warn('Load clean date jobs successfully')
 
@@ -114,7 +447,7 @@ class MasterService(rpc_service.Service):
             orders = self.gclient.get_orders(status=s, owed=True,
                                              region_id=cfg.CONF.region_name)
 
-            for order in orders:
+            for order in self._extract_my_orders(orders):
                 # load delete resource date job
                 if isinstance(order['date_time'], basestring):
                     date_time = timeutils.parse_strtime(
@@ -141,15 +474,28 @@ class MasterService(rpc_service.Service):
 
     def _get_cron_orders(self, bill_methods=None, owed=None, region_id=None):
         orders = []
-        states = [const.STATE_RUNNING, const.STATE_STOPPED,
-                  const.STATE_SUSPEND]
-        for s in states:
+        for s in CRON_STATES:
             orders += self.gclient.get_orders(status=s,
                                               owed=owed,
                                               bill_methods=bill_methods,
                                               region_id=region_id)
         return orders
 
+    def _get_cron_orders_by_ids(self, order_ids):
+        orders = []
+        for order_id in order_ids:
+            try:
+                order = self.gclient.get_order(order_id)
+            except Exception:
+                LOG.exception('Fail to get the order: %s', order_id)
+                continue
+            if order and order['status'] in CRON_STATES:
+                orders.append(order)
+        return orders
+
+    def _get_job_ids(self):
+        return set(job.id for job in self.apsched.get_jobs())
+
     def load_monthly_cron_jobs(self):
         """Load monthly cron jobs
 
@@ -159,7 +505,14 @@ class MasterService(rpc_service.Service):
         # owed="" will be tranlated to owed=False by wsme
         orders = self._get_cron_orders(bill_methods=['month', 'year'],
                                        owed="")
+        self._load_monthly_cron_jobs(self._extract_my_orders(orders),
+                                     self._get_job_ids())
+
+    def _load_monthly_cron_jobs(self, orders, job_ids):
         for order in orders:
+            # the order is scheduled already before rebalancing
+            if self._make_monthly_job_id(order['order_id']) in job_ids:
+                continue
             if not order['cron_time']:
                 continue
             elif isinstance(order['cron_time'], basestring):
@@ -174,12 +527,19 @@ class MasterService(rpc_service.Service):
             # distinguish the danger_time
             self._create_monthly_job(order['order_id'],
                                      run_date=cron_time)
-            self.locks[order['order_id']] = gthreading.Lock()
 
     def load_hourly_cron_jobs(self):
         orders = self._get_cron_orders(bill_methods=['hour'],
                                        region_id=cfg.CONF.region_name)
+        self._load_hourly_cron_jobs(self._extract_my_orders(orders),
+                                    self._get_job_ids())
+
+    def _load_hourly_cron_jobs(self, orders, job_ids):
+        pool = greenpool.GreenPool(max(cfg.CONF.master.catch_up_workers, 1))
         for order in orders:
+            # the order is scheduled already before rebalancing
+            if self._make_cron_job_id(order['order_id']) in job_ids:
+                continue
             if not order['cron_time']:
                 continue
             elif isinstance(order['cron_time'], basestring):
@@ -202,11 +562,25 @@ class MasterService(rpc_service.Service):
                 cron_time -= datetime.timedelta(hours=1)
                 action_time = utils.format_datetime(
                     timeutils.strtime(cron_time))
-                self._create_bill(self.ctxt,
-                                  order['order_id'],
-                                  action_time,
+                pool.spawn_n(self._catch_up_order, order['order_id'],
+                             action_time)
+        pool.waitall()
+
+    def _catch_up_order(self, order_id, action_time):
+        self._throttle_deduct()
+        try:
+            with self._get_lock(order_id):
+                # the order may be billed or deleted by the messages
+                # handled since it was loaded
+                if self.apsched.get_job(self._make_cron_job_id(order_id)):
+                    return
+                order = self.gclient.get_order(order_id)
+                if order['status'] == const.STATE_DELETED:
+                    return
+                self._create_bill(self.ctxt, order_id, action_time,
                                   "System Adjust")
-            self.locks[order['order_id']] = gthreading.Lock()
+        except Exception:
+            LOG.exception("Fail to catch up the overdue order: %s", order_id)
 
     def _make_30_days_job_id(self, order_id):
         return "30-days-" + order_id
@@ -271,7 +645,7 @@ class MasterService(rpc_service.Service):
             action_time = timeutils.parse_strtime(action_time,
                                                   fmt=ISO8601_UTC_TIME_FORMAT)
 
-        self.apsched.add_job(self._delete_owed_resource,
+        self.apsched.add_job(delete_owed_resource,
                              'date',
                              args=[resource_type,
                                    resource_id,
@@ -305,8 +679,11 @@ class MasterService(rpc_service.Service):
             action_time = timeutils.parse_strtime(action_time,
                                                   fmt=TIMESTAMP_TIME_FORMAT)
             start_date = action_time + datetime.timedelta(hours=1)
+        if start_date and cfg.CONF.master.deduct_spread_window > 0:
+            start_date += datetime.timedelta(
+                seconds=self._get_deduct_delay(order_id))
 
-        self.apsched.add_job(self._pre_deduct,
+        self.apsched.add_job(pre_deduct,
                              'interval',
                              args=[order_id],
                              id=job_id,
@@ -319,7 +696,7 @@ class MasterService(rpc_service.Service):
         if isinstance(run_date, basestring):
             run_date = timeutils.parse_isotime(run_date)
 
-        self.apsched.add_job(self._handle_monthly_order,
+        self.apsched.add_job(handle_monthly_order,
                              'date',
                              args=[order_id],
                              id=job_id,
@@ -327,18 +704,54 @@ class MasterService(rpc_service.Service):
         LOG.warn('create monthly job for order: %s', order_id)
 
     def _get_lock(self, order_id):
-        if order_id not in self.locks:
-            self.locks[order_id] = gthreading.Lock()
-
         return self.locks.get(order_id)
 
-    def _delete_lock(self, order_id):
-        if order_id in self.locks:
-            del self.locks[order_id]
+    @staticmethod
+    def _get_deduct_delay(order_id):
+        """Return the stable offset of the hourly deduction of the order"""
+        digest = hashlib.md5(utils.smart_str(order_id)).hexdigest()
+        return int(digest[:8], 16) % cfg.CONF.master.deduct_spread_window
+
+    def _throttle_deduct(self):
+        if self.deduct_bucket:
+            self.deduct_stats['throttled'] += self.deduct_bucket.consume()
+
+    def _record_deduct_lag(self, cron_time):
+        lag = max((timeutils.utcnow() - cron_time).total_seconds(), 0)
+        self.deduct_stats['deducted'] += 1
+        self.deduct_stats['lag_total'] += lag
+        self.deduct_stats['lag_max'] = max(self.deduct_stats['lag_max'], lag)
+
+    def get_deduct_stats(self, ctxt):
+        """Get the lag of the hourly deductions behind their cron time
+
+        The lag includes the delay of deduct_spread_window, and throttled is
+        the total seconds that deductions waited for deduct_rate.
+        """
+        stats = dict(self.deduct_stats)
+        stats['lag_avg'] = (stats['lag_total'] / stats['deducted']
+                            if stats['deducted'] else 0.0)
+        return stats
+
+    def batch(self, ctxt, method, items):
+        """Call the method for each of the items, which are its kwargs
+
+        A failed item doesn't stop the other ones.
+        """
+        if method not in BATCH_METHODS:
+            LOG.error('Method %s can not be called in batches', method)
+            return
+        handler = getattr(self, method)
+        for item in items:
+            try:
+                handler(ctxt, **item)
+            except Exception:
+                LOG.exception('Fail to call %s with %s', method, item)
 
     def _pre_deduct(self, order_id):
         LOG.warn("Prededucting order: %s", order_id)
         try:
+            self._throttle_deduct()
             with self._get_lock(order_id):
                 # check resource and order before deduct
                 order = self.gclient.get_order(order_id)
@@ -359,6 +772,7 @@ class MasterService(rpc_service.Service):
                         order['cron_time'], fmt=ISO8601_UTC_TIME_FORMAT)
                 else:
                     cron_time = order['cron_time']
+                self._record_deduct_lag(cron_time)
 
                 remarks = 'Hourly Billing'
                 now = timeutils.utcnow()
@@ -390,6 +804,7 @@ class MasterService(rpc_service.Service):
     def _handle_monthly_order(self, order_id):
         LOG.warn("Handle monthly billing order: %s", order_id)
         try:
+            self._throttle_deduct()
             with self._get_lock(order_id):
                 # check resource and order before deduct
                 order = self.gclient.get_order(order_id)
@@ -484,18 +899,21 @@ class MasterService(rpc_service.Service):
                 date_job_count, days_30_job_count)
 
 
+    @owned_order
     def resource_created(self, ctxt, order_id, action_time, remarks):
         with self._get_lock(order_id):
             LOG.debug('Resource created, its order_id: %s, action_time: %s',
                       order_id, action_time)
             self._create_bill(ctxt, order_id, action_time, remarks)
 
+    @owned_order
     def resource_created_again(self, ctxt, order_id, action_time, remarks):
         with self._get_lock(order_id):
             LOG.debug("Resource created again, its order_id: %s, "
                       "action_time: %s", order_id, action_time)
             self._create_bill(ctxt, order_id, action_time, remarks)
 
+    @owned_order
     def resource_deleted(self, ctxt, order_id, action_time, remarks):
         with self._get_lock(order_id):
             LOG.debug('Resource deleted, its order_id: %s, action_time: %s',
@@ -518,9 +936,7 @@ class MasterService(rpc_service.Service):
             # delete the date job if the order has a 30-days date job
             self._delete_30_days_job(order_id)
 
-            # delete order lock
-            self._delete_lock(order_id)
-
+    @owned_order
     def resource_stopped(self, ctxt, order_id, action_time, remarks):
         with self._get_lock(order_id):
             LOG.debug('Resource stopped, its order_id: %s, action_time: %s',
@@ -538,6 +954,7 @@ class MasterService(rpc_service.Service):
                                      remarks=remarks,
                                      end_time=action_time)
 
+    @owned_order
     def resource_started(self, ctxt, order_id, action_time, remarks):
         with self._get_lock(order_id):
             LOG.debug('Resource created, its order_id: %s, action_time: %s',
@@ -546,6 +963,7 @@ class MasterService(rpc_service.Service):
             self.gclient.change_order(order_id, const.STATE_RUNNING)
             self._create_bill(ctxt, order_id, action_time, remarks)
 
+    @owned_order
     def resource_changed(self, ctxt, order_id, action_time, change_to,
                          remarks):
         with self._get_lock(order_id):
@@ -563,6 +981,7 @@ class MasterService(rpc_service.Service):
             # delete the date job if the order has a 30-days date job
             self._delete_30_days_job(order_id)
 
+    @owned_order
     def resource_resized(self, ctxt, order_id, action_time, quantity, remarks):
         with self._get_lock(order_id):
             LOG.debug("Resource resized, its order_id: %s, action_time: %s, "
@@ -581,6 +1000,7 @@ class MasterService(rpc_service.Service):
             # create a new bill for the updated order
             self._create_bill(ctxt, order_id, action_time, remarks)
 
+    @owned_order
     def resource_restore(self, ctxt, order_id, action_time, remarks):
         """The order can be restored, when the resource restored
 
@@ -596,6 +1016,7 @@ class MasterService(rpc_service.Service):
             # create a new bill for the updated order
             self._create_bill(ctxt, order_id, action_time, remarks)
 
+    @owned_order
     def instance_stopped(self, ctxt, order_id, action_time):
         """Instance stopped for a month continuously will not be charged
 
@@ -627,6 +1048,7 @@ class MasterService(rpc_service.Service):
             # create a cron job that will execute after 30 days
             self._create_cron_job(order_id, start_date=cron_time)
 
+    @owned_order
     def instance_resized(self, ctxt, order_id, action_time,
                          new_flavor, old_flavor,
                          service, region_id, remarks):
@@ -661,22 +1083,33 @@ class MasterService(rpc_service.Service):
     def clean_date_jobs(self):
         LOG.warn('Doing clean date jobs')
         orders = self.gclient.get_active_orders(
-            charged=True, region_id=cfg.CONF.region_name)
+            charged=True, region_id=cfg.CONF.region_name,
+            fields=['order_id'])
 
         order_ids = []
-        for order in orders:
+        for order in self._extract_my_orders(orders):
             order_ids.append(order['order_id'])
             self._delete_date_job(order['order_id'])
 
         if order_ids:
             self.gclient.reset_charged_orders(order_ids)
 
+    def refresh_balance_snapshots(self):
+        limit = cfg.CONF.master.snapshot_refresh_limit
+        while True:
+            count = self.gclient.refresh_balance_snapshots(limit=limit)
+            LOG.debug('Refreshed the balance snapshots of %s accounts', count)
+            if not count or count < limit:
+                break
+
+    @owned_order
     def delete_sched_jobs(self, ctxt, order_id):
         self._delete_cron_job(order_id)
         self._delete_monthly_job(order_id)
         self._delete_date_job(order_id)
         self._delete_30_days_job(order_id)
 
+    @owned_order
     def change_monthly_job_time(self, ctxt, order_id, run_date,
                                 clear_date_jobs=None):
         if isinstance(run_date, basestring):
@@ -687,6 +1120,7 @@ class MasterService(rpc_service.Service):
             self._delete_date_job(order_id)
             self._delete_30_days_job(order_id)
 
+    @owned_order
     def create_monthly_job(self, ctxt, order_id, run_date):
         """Create a date job for monthly/yearly billing order
         """
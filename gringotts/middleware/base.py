@@ -119,16 +119,10 @@ class ProductItem(object):
                                            collection.service,
                                            collection.region_id)
         if product:
-            if 'unit_price' in product:
-                price_data = pricing.get_price_data(product['unit_price'],
-                                                    method)
-            else:
-                price_data = None
-
-            return pricing.calculate_price(
-                collection.resource_volume, price_data)
-        else:
-            return 0
+            plan = pricing.get_price_plan(product.get('unit_price'), method)
+            if plan:
+                return plan.calculate(collection.resource_volume)
+        return 0
 
 
 class BillingProtocol(object):
@@ -166,12 +166,13 @@ class ConnectionContext(rpc_common.Connection):
         self.connection.create_worker(topic, proxy, pool_name)
 
     def join_consumer_pool(self, callback, pool_name, topic, exchange_name,
-                           ack_on_error=True):
+                           ack_on_error=True, **kwargs):
         self.connection.join_consumer_pool(callback,
                                            pool_name,
                                            topic,
                                            exchange_name,
-                                           ack_on_error)
+                                           ack_on_error,
+                                           **kwargs)
 
     def consume_in_thread(self):
         self.connection.consume_in_thread()
@@ -18,6 +18,7 @@ import socket
 import ssl
 import time
 import uuid
+import weakref
 
 import eventlet
 import greenlet
@@ -131,6 +132,104 @@ def _get_queue_arguments(conf):
     return {'x-ha-policy': 'all'} if conf.rabbit_ha_queues else {}
 
 
+class AckBatcher(object):
+    """Acknowledge the deferred messages of a channel in batches.
+
+    Completed messages are acknowledged at most *interval* seconds after
+    their completion, with a single multiple=True basic.ack of the highest
+    delivery tag below every message still in progress. The remaining
+    completed messages are acknowledged one by one, so that a slow message
+    never holds back the others.
+
+    There is one batcher per channel, because delivery tags are scoped to
+    the channel and shared by all its consumers.
+    """
+
+    def __init__(self, channel, interval):
+        self.channel = channel
+        self.interval = interval
+        self.in_progress = set()
+        self.completed = set()
+        self.flusher = None
+
+    def add(self, message):
+        self.in_progress.add(message.delivery_tag)
+
+    def done(self, message, requeue=False):
+        self.in_progress.discard(message.delivery_tag)
+        if requeue:
+            message.requeue()
+            return
+        self.completed.add(message.delivery_tag)
+        if self.flusher is None:
+            self.flusher = eventlet.spawn_after(self.interval, self.flush)
+
+    def flush(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        if not self.completed:
+            return
+        completed, self.completed = sorted(self.completed), set()
+
+        lowest = min(self.in_progress) if self.in_progress else None
+        batch = [t for t in completed if lowest is None or t < lowest]
+        try:
+            if batch:
+                self.channel.basic_ack(batch[-1], multiple=True)
+            for tag in completed[len(batch):]:
+                self.channel.basic_ack(tag)
+        except Exception:
+            # NOTE: The channel may have been re-established since the
+            # messages were received, the broker will redeliver them then.
+            LOG.exception(_("Failed to acknowledge messages"))
+
+
+_ACK_BATCHERS = weakref.WeakKeyDictionary()
+
+
+def _get_ack_batcher(channel, interval):
+    if channel not in _ACK_BATCHERS:
+        _ACK_BATCHERS[channel] = AckBatcher(channel, interval)
+    return _ACK_BATCHERS[channel]
+
+
+def _flush_ack_batcher(channel):
+    """Acknowledge the completed messages of channel before it's closed"""
+    batcher = _ACK_BATCHERS.get(channel)
+    if batcher:
+        batcher.flush()
+
+
+class DeferredAck(object):
+    """Ack or requeue a message once its callback has processed it.
+
+    Passed to the callbacks of consumers declared with defer_ack=True,
+    which must call it exactly once for every message they receive.
+    """
+
+    def __init__(self, message, ack_on_error, batcher=None):
+        self.message = message
+        self.ack_on_error = ack_on_error
+        self.batcher = batcher
+        if batcher:
+            batcher.add(message)
+
+    def __call__(self, failed=False):
+        requeue = failed and not self.ack_on_error
+        try:
+            if self.batcher:
+                self.batcher.done(self.message, requeue=requeue)
+            elif requeue:
+                self.message.requeue()
+            else:
+                self.message.ack()
+        except Exception:
+            # NOTE: The channel may have been re-established since the
+            # message was received, the broker will redeliver it then.
+            LOG.exception(_("Failed to acknowledge message"))
+
+
 class ConsumerBase(object):
     """Consumer base class."""
 
@@ -149,6 +248,9 @@ class ConsumerBase(object):
         self.kwargs = kwargs
         self.queue = None
         self.ack_on_error = kwargs.get('ack_on_error', True)
+        self.defer_ack = kwargs.get('defer_ack', False)
+        self.ack_batch_interval = kwargs.get('ack_batch_interval')
+        self.prefetch_count = kwargs.get('prefetch_count')
         self.reconnect(channel)
 
     def reconnect(self, channel):
@@ -157,6 +259,10 @@ class ConsumerBase(object):
         self.kwargs['channel'] = channel
         self.queue = kombu.entity.Queue(**self.kwargs)
         self.queue.declare()
+        self.ack_batcher = None
+        if self.defer_ack and self.ack_batch_interval:
+            self.ack_batcher = _get_ack_batcher(channel,
+                                                self.ack_batch_interval)
 
     def _callback_handler(self, message, callback):
         """Call callback with deserialized message.
@@ -165,12 +271,26 @@ class ConsumerBase(object):
 
         If the message processing generates an exception, it will be
         ack'ed if ack_on_error=True. Otherwise it will be .requeue()'ed.
+
+        If defer_ack=True, the callback is also given a DeferredAck, and
+        the message is only ack'ed or requeue'd when it's called, in
+        batches if ack_batch_interval is set.
         """
 
+        deferred_ack = None
         try:
             msg = rpc_common.deserialize_msg(message.payload)
+            if self.defer_ack:
+                deferred_ack = DeferredAck(message, self.ack_on_error,
+                                           self.ack_batcher)
+                callback(msg, deferred_ack)
+                return
             callback(msg)
         except Exception:
+            if deferred_ack:
+                LOG.exception(_("Failed to process message"))
+                deferred_ack(failed=True)
+                return
             if self.ack_on_error:
                 LOG.exception(_("Failed to process message"
                                 " ... skipping it."))
@@ -206,6 +326,16 @@ class ConsumerBase(object):
             message = self.channel.message_to_python(raw_message)
             self._callback_handler(message, callback)
 
+        if self.prefetch_count:
+            # NOTE: a_global=False limits the unacknowledged messages of
+            # every consumer started afterwards on the channel, so it's
+            # reset once this consumer has started.
+            self.channel.basic_qos(0, self.prefetch_count, False)
+            try:
+                self.queue.consume(*args, callback=_callback, **options)
+            finally:
+                self.channel.basic_qos(0, 0, False)
+            return
         self.queue.consume(*args, callback=_callback, **options)
 
     def cancel(self):
@@ -640,6 +770,7 @@ class Connection(object):
         """Close/release this connection."""
         self.cancel_consumer_thread()
         self.wait_on_proxy_callbacks()
+        _flush_ack_batcher(self.channel)
         self.connection.release()
         self.connection = None
 
@@ -647,6 +778,7 @@ class Connection(object):
         """Reset a connection so it can be used again."""
         self.cancel_consumer_thread()
         self.wait_on_proxy_callbacks()
+        _flush_ack_batcher(self.channel)
         self.channel.close()
         self.channel = self.connection.channel()
         # work around 'memory' transport bug in 1.1.3
@@ -739,14 +871,20 @@ class Connection(object):
         self.declare_consumer(DirectConsumer, topic, callback)
 
     def declare_topic_consumer(self, topic, callback=None, queue_name=None,
-                               exchange_name=None, ack_on_error=True):
+                               exchange_name=None, ack_on_error=True,
+                               defer_ack=False, ack_batch_interval=None,
+                               prefetch_count=None):
         """Create a 'topic' consumer."""
-        self.declare_consumer(functools.partial(TopicConsumer,
-                                                name=queue_name,
-                                                exchange_name=exchange_name,
-                                                ack_on_error=ack_on_error,
-                                                ),
-                              topic, callback)
+        consumer_cls = functools.partial(
+            TopicConsumer,
+            name=queue_name,
+            exchange_name=exchange_name,
+            ack_on_error=ack_on_error,
+            defer_ack=defer_ack,
+            ack_batch_interval=ack_batch_interval,
+            prefetch_count=prefetch_count,
+        )
+        self.declare_consumer(consumer_cls, topic, callback)
 
     def declare_fanout_consumer(self, topic, callback):
         """Create a 'fanout' consumer."""
@@ -810,7 +948,9 @@ class Connection(object):
         self.declare_topic_consumer(topic, proxy_cb, pool_name)
 
     def join_consumer_pool(self, callback, pool_name, topic,
-                           exchange_name=None, ack_on_error=True):
+                           exchange_name=None, ack_on_error=True,
+                           defer_ack=False, ack_batch_interval=None,
+                           prefetch_count=None):
         """Register as a member of a group of consumers for a given topic from
         the specified exchange.
 
@@ -818,7 +958,31 @@ class Connection(object):
 
         A message will be delivered to multiple pools, if more than
         one is created.
+
+        If defer_ack=True, the callback is invoked in the consumer thread
+        with the message and a DeferredAck, it's responsible for running
+        the message processing elsewhere and acknowledging the message
+        when the processing completes. If ack_batch_interval is set, the
+        completed messages are acknowledged in batches at that interval.
+
+        If prefetch_count is set, the broker delivers at most that many
+        unacknowledged messages to this member. It's only used with
+        defer_ack=True, as the other messages are acknowledged as soon as
+        their callbacks are spawned.
         """
+        if defer_ack:
+            self.declare_topic_consumer(
+                queue_name=pool_name,
+                topic=topic,
+                exchange_name=exchange_name,
+                callback=callback,
+                ack_on_error=ack_on_error,
+                defer_ack=True,
+                ack_batch_interval=ack_batch_interval,
+                prefetch_count=prefetch_count,
+            )
+            return
+
         callback_wrapper = rpc_amqp.CallbackWrapper(
             conf=self.conf,
             callback=callback,
@@ -58,15 +58,18 @@ class NotificationBase(PluginBase):
         return any(map(lambda e: fnmatch.fnmatch(event_type, e),
                        event_type_to_handle))
 
-    def do_actions(self, notification):
+    def do_actions(self, notification, matched=False):
         """Do actions based on *process_notification* for the given
         notification, if it's handled by this notification handler.
 
         :param notification: The notification to process.
+        :param matched: Whether the caller has already matched the event
+                        type against *event_types*, if so, don't match it
+                        again.
 
         """
         if 'month_billing' in notification.get('_context_roles', []):
             return
-        if self._handle_event_type(notification['event_type'],
-                                   self.event_types):
+        if matched or self._handle_event_type(notification['event_type'],
+                                              self.event_types):
             self.process_notification(notification)
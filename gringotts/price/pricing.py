@@ -1,12 +1,127 @@
 
+import bisect
 from decimal import Decimal
+import hashlib
+import threading
 
 from gringotts import exception
+from gringotts.openstack.common import jsonutils
 from gringotts import utils as gringutils
 
 
 quantize_decimal = gringutils._quantize_decimal
 
+# Prices are stored with 4 decimal places, PricePlan calculates them in
+# integer units of 1/10000
+PRICE_UNITS = 10000
+
+# The max number of compiled price plans that are cached
+PRICE_PLAN_CACHE_SIZE = 1024
+
+_price_plans = {}
+_price_plans_lock = threading.Lock()
+
+
+def _to_units(price):
+    return int(quantize_decimal(price) * PRICE_UNITS)
+
+
+def _from_units(units):
+    return quantize_decimal(Decimal(units) / PRICE_UNITS)
+
+
+class PricePlan(object):
+    """Segmented price data compiled for repeated calculation
+
+    The tiers are sorted by count and the price of the quantity at every
+    tier boundary is accumulated beforehand, so a price is calculated with
+    a binary search and one multiplication of integers in 1/10000 units.
+    """
+
+    def __init__(self, price_data):
+        tiers = sorted((int(p['count']), _to_units(p['price']))
+                       for p in price_data['segmented'])
+        self.base_price = _to_units(price_data.get('base_price', 0))
+        self.counts = [count for count, price in tiers]
+        self.prices = [price for count, price in tiers]
+        # the price of the quantity of every tier boundary
+        self.accumulated = [0]
+        for i in range(1, len(tiers)):
+            self.accumulated.append(
+                self.accumulated[-1] +
+                (self.counts[i] - self.counts[i - 1]) * self.prices[i - 1])
+
+    def _calculate_units(self, quantity):
+        i = bisect.bisect_left(self.counts, quantity) - 1
+        if i < 0:
+            return self.base_price
+        return (self.base_price + self.accumulated[i] +
+                (quantity - self.counts[i]) * self.prices[i])
+
+    def calculate(self, quantity):
+        return _from_units(self._calculate_units(int(quantity)))
+
+    def calculate_many(self, quantities):
+        """Calculate the prices of a list of quantities"""
+        return [_from_units(self._calculate_units(int(q)))
+                for q in quantities]
+
+
+def price_plan_hash(unit_price):
+    """Hash the content of the unit_price JSON text
+
+    The text is normalized first, so the same plan written with different
+    key orders or spaces has the same hash.
+    """
+    try:
+        unit_price = jsonutils.dumps(jsonutils.loads(unit_price),
+                                     sort_keys=True)
+    except ValueError:
+        pass
+    if isinstance(unit_price, unicode):
+        unit_price = unit_price.encode('utf-8')
+    return hashlib.sha1(unit_price).hexdigest()
+
+
+def compile_price_data(price_data):
+    """Compile the price data, None if it is not a segmented price"""
+    if price_data and not isinstance(price_data, dict):
+        raise exception.InvalidParameterValue('price_data should be a dict')
+
+    if price_data and price_data.get('type') == 'segmented' and \
+            'segmented' in price_data:
+        return PricePlan(price_data)
+
+
+def get_price_plan(unit_price, method=None):
+    """Get the compiled price plan of the bill method from unit_price
+
+    unit_price is the JSON text of a product or subscription, the plans
+    compiled from it are cached by the text, so it is parsed only once.
+    A dict is compiled every time.
+    """
+    if not unit_price:
+        return None
+    if isinstance(unit_price, dict):
+        return compile_price_data(get_price_data(unit_price, method))
+
+    key = (unit_price, method)
+    try:
+        return _price_plans[key]
+    except KeyError:
+        pass
+
+    try:
+        plan = compile_price_data(
+            get_price_data(jsonutils.loads(unit_price), method))
+    except Exception:
+        plan = None
+    with _price_plans_lock:
+        if len(_price_plans) >= PRICE_PLAN_CACHE_SIZE:
+            _price_plans.clear()
+        _price_plans[key] = plan
+    return plan
+
 
 def calculate_unit_price(quantity, unit_price):
     return int(quantity) * quantize_decimal(unit_price)
@@ -43,18 +158,9 @@ def calculate_price(quantity, price_data=None):
     :param quantity: quantity of items
     :price_data: unit_price data of item
     """
-    if price_data and not isinstance(price_data, dict):
-        raise exception.InvalidParameterValue('price_data should be a dict')
-
-    if price_data and 'type' in price_data:
-        base_price = quantize_decimal(price_data.get('base_price', 0))
-
-        if (price_data['type'] == 'segmented') and (
-                'segmented' in price_data):
-            segmented_price = calculate_segmented_price(
-                quantity, price_data['segmented'])
-
-            return segmented_price + base_price
+    plan = compile_price_data(price_data)
+    if plan:
+        return plan.calculate(quantity)
 
 
 def validate_segmented_price(price_data):
@@ -68,6 +68,7 @@ def wrap_exception(exc_type=None, with_raise=False):
 
 RESOURCE_LIST_METHOD = []
 RESOURCE_DELETE_METHOD = []
+RESOURCE_CHANGES_METHOD = []
 
 RESOURCE_GET_MAP = {}
 RESOURCE_STOPPED_STATE = {}
@@ -94,6 +95,8 @@ def register(ks_client, service=None, resource=None, mtype=None,
                 RESOURCE_LIST_METHOD.append(f)
             elif mtype == 'deletes':
                 RESOURCE_DELETE_METHOD.append(f)
+            elif mtype == 'changes':
+                RESOURCE_CHANGES_METHOD.append(f)
             elif mtype == 'get':
                 RESOURCE_GET_MAP[resource] = f
                 RESOURCE_STOPPED_STATE[resource] = stopped_state
@@ -138,6 +138,16 @@ def server_list(project_id, region_name=None, detailed=True, project_name=None):
     return formatted_servers
 
 
+@register(mtype='changes')
+@wrap_exception(exc_type='list', with_raise=True)
+def server_changed_projects(since, region_name=None):
+    """Return the ids of projects whose servers changed since the time"""
+    search_opts = {'all_tenants': 1,
+                   'changes-since': timeutils.isotime(since)}
+    servers = get_novaclient(region_name).servers.list(True, search_opts)
+    return list(set(server.tenant_id for server in servers))
+
+
 def server_with_flavor_and_image(server, region_name):
     flavor = flavor_get(region_name, server.flavor_id)
     image = image_get(region_name, server.image_id)
@@ -160,6 +160,65 @@ class AccountTestCase(rest.RestfulTestCase):
         self.put(query_url, headers=self.demo_headers,
                  body=body, expected_status=403)
 
+    def test_get_owed_accounts(self):
+        order = self.create_order_in_db(
+            1, 'hour', self.demo_account.user_id,
+            self.demo_account.project_id, 'instance', 'running')
+
+        query_url = self.account_path + \
+            '/owed?bill_methods=hour&days_to_owe=7'
+        resp = self.get(query_url, headers=self.admin_headers)
+        self.assertEqual([self.demo_account.user_id],
+                         [a['user_id'] for a in resp.json_body])
+        projects = resp.json_body[0]['projects']
+        self.assertEqual([self.demo_account.project_id],
+                         [p['project_id'] for p in projects])
+        self.assertEqual([order.order_id],
+                         [o['order_id'] for o in projects[0]['orders']])
+
+        query_url = self.account_path + '/owed?bill_methods=hour'
+        resp = self.get(query_url, headers=self.admin_headers)
+        self.assertEqual([], resp.json_body)
+
+    def test_get_owed_accounts_at_days_to_owe_boundary(self):
+        # About 10 per day, and the balance of 72 lasts 7.2 days, which
+        # rounds to 7 days
+        self.create_order_in_db(
+            '0.4167', 'hour', self.demo_account.user_id,
+            self.demo_account.project_id, 'instance', 'running')
+        self.dbconn.update_account(self.admin_req_context,
+                                   self.demo_account.user_id,
+                                   value=72, type='money')
+
+        query_url = self.account_path + \
+            '/owed?bill_methods=hour&days_to_owe=7'
+        resp = self.get(query_url, headers=self.admin_headers)
+        self.assertEqual([self.demo_account.user_id],
+                         [a['user_id'] for a in resp.json_body])
+
+        query_url = self.account_path + \
+            '/owed?bill_methods=hour&days_to_owe=6'
+        resp = self.get(query_url, headers=self.admin_headers)
+        self.assertEqual([], resp.json_body)
+
+    def test_get_owed_accounts_without_detail(self):
+        self.create_order_in_db(
+            1, 'hour', self.demo_account.user_id,
+            self.demo_account.project_id, 'instance', 'running')
+
+        query_url = self.account_path + \
+            '/owed?bill_methods=hour&days_to_owe=7&detail=false'
+        resp = self.get(query_url, headers=self.admin_headers)
+        self.assertEqual([self.demo_account.user_id],
+                         [a['user_id'] for a in resp.json_body])
+        self.assertFalse(resp.json_body[0].get('projects'))
+
+        query_url = self.account_path + \
+            '/owed?bill_methods=hour&days_to_owe=7&user_ids=%s' % \
+            self.new_user_id()
+        resp = self.get(query_url, headers=self.admin_headers)
+        self.assertEqual([], resp.json_body)
+
     def test_get_account_estimate(self):
         pass
 
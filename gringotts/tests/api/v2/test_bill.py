@@ -181,6 +181,45 @@ class BillTestCase(rest.RestfulTestCase):
         self.assertEqual(gring_const.BILL_PAYED, bill.status)
         self.assertPriceEqual(total_price, bill.total_price)
 
+    def test_update_bill_with_deferred_deduction(self):
+        self.config_fixture.config(defer_hourly_deduction=True,
+                                   ledger_fold_delay=-1)
+        product = self.product_fixture.instance_products[0]
+        order_id = self.new_order_id()
+        user_id = self.admin_account.user_id
+        project_id = self.admin_account.project_id
+
+        subs = self.create_subs_in_db(
+            product, 1, gring_const.STATE_RUNNING,
+            order_id, project_id, user_id,
+        )
+        order = self.create_order_in_db(
+            float(self.quantize(subs.unit_price)), subs.unit, user_id,
+            project_id, gring_const.RESOURCE_INSTANCE, subs.type,
+            order_id=order_id
+        )
+        self.dbconn.create_bill(self.admin_req_context, order.order_id,
+                                action_time=self.utcnow())
+        account = self.dbconn.get_account(self.admin_req_context, user_id)
+
+        self.put('/v2/bills/update', headers=self.headers,
+                 body=self.new_bill_ref(order.order_id), expected_status=200)
+
+        # read from the snapshot plus the deferred tail
+        deferred = self.dbconn.get_account(self.admin_req_context, user_id)
+        self.assertPriceEqual(account.balance - order.unit_price,
+                              deferred.balance)
+        self.assertPriceEqual(account.consumption + order.unit_price,
+                              deferred.consumption)
+
+        self.assertEqual(1, self.dbconn.refresh_balance_snapshots(
+            self.admin_req_context))
+        self.assertEqual(0, self.dbconn.refresh_balance_snapshots(
+            self.admin_req_context))
+        folded = self.dbconn.get_account(self.admin_req_context, user_id)
+        self.assertPriceEqual(deferred.balance, folded.balance)
+        self.assertPriceEqual(deferred.consumption, folded.consumption)
+
     def test_get_bills(self):
         pass
 
@@ -1,3 +1,5 @@
+import datetime
+
 from gringotts import constants as gring_const
 from gringotts.openstack.common import log as logging
 from gringotts.tests import rest
@@ -37,6 +39,29 @@ class OrderTestCase(rest.RestfulTestCase):
         order = self.dbconn.get_order(self.admin_req_context, order_id)
         self.assertOrderEqual(order_ref, order.as_dict())
 
+    def test_create_orders_in_batch(self):
+        product = self.product_fixture.instance_products[0]
+        user_id = self.admin_account.user_id
+        project_id = self.admin_account.project_id
+
+        order_refs = []
+        for i in range(2):
+            order_id = self.new_order_id()
+            subs = self.create_subs_in_db(product, 1,
+                                          gring_const.STATE_RUNNING,
+                                          order_id, project_id, user_id)
+            order_refs.append(self.new_order_ref(
+                float(self.quantize(subs.unit_price)), subs.unit,
+                user_id, project_id, gring_const.RESOURCE_INSTANCE,
+                gring_const.STATE_RUNNING, order_id))
+        self.post(self.order_path + '/batch', headers=self.admin_headers,
+                  body={'orders': order_refs}, expected_status=204)
+
+        for order_ref in order_refs:
+            order = self.dbconn.get_order(self.admin_req_context,
+                                          order_ref['order_id'])
+            self.assertOrderEqual(order_ref, order.as_dict())
+
     def test_order_change_state(self):
         product = self.product_fixture.instance_products[0]
         resource_volume = 1
@@ -176,5 +201,76 @@ class OrderTestCase(rest.RestfulTestCase):
         path = "%s/%s" % (self.order_path, 'active')
         self.check_invalid_limit_or_offset(path)
 
+    def test_get_active_orders_with_fields(self):
+        product = self.product_fixture.instance_products[0]
+        user_id = self.admin_account.user_id
+        project_id = self.admin_account.project_id
+        order_id = self.new_order_id()
+
+        subs = self.create_subs_in_db(product, 1, gring_const.STATE_RUNNING,
+                                      order_id, project_id, user_id)
+        self.create_order_in_db(
+            float(self.quantize(subs.unit_price)), subs.unit, user_id,
+            project_id, gring_const.RESOURCE_INSTANCE, subs.type,
+            order_id=order_id)
+
+        orders = list(self.dbconn.get_active_orders(
+            self.admin_req_context, user_id=user_id,
+            fields=['order_id', 'type']))
+        self.assertEqual(
+            [(order_id, gring_const.RESOURCE_INSTANCE)], orders)
+
+        path = '%s/active?user_id=%s&fields=order_id&fields=type' % (
+            self.order_path, user_id)
+        resp = self.get(path, headers=self.admin_headers)
+        self.assertEqual(
+            [{'order_id': order_id, 'type': gring_const.RESOURCE_INSTANCE}],
+            resp.json_body)
+
+    def test_get_orders_with_count(self):
+        product = self.product_fixture.instance_products[0]
+        user_id = self.admin_account.user_id
+        project_id = self.admin_account.project_id
+        for i in range(3):
+            order_id = self.new_order_id()
+            subs = self.create_subs_in_db(product, 1,
+                                          gring_const.STATE_RUNNING,
+                                          order_id, project_id, user_id)
+            self.create_order_in_db(
+                float(self.quantize(subs.unit_price)), subs.unit, user_id,
+                project_id, gring_const.RESOURCE_INSTANCE, subs.type,
+                order_id=order_id)
+
+        for limit, offset, count in [(2, 0, 2), (2, 2, 1), (2, 4, 0),
+                                     (None, None, 3)]:
+            orders, total_count = self.dbconn.get_orders(
+                self.admin_req_context, user_id=user_id, limit=limit,
+                offset=offset, with_count=True)
+            self.assertEqual(count, len(list(orders)))
+            self.assertEqual(3, total_count)
+
+    def test_get_projects_of_changed_orders(self):
+        product = self.product_fixture.instance_products[0]
+        user_id = self.admin_account.user_id
+        project_id = self.admin_account.project_id
+        order_id = self.new_order_id()
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+
+        subs = self.create_subs_in_db(product, 1, gring_const.STATE_RUNNING,
+                                      order_id, project_id, user_id)
+        self.create_order_in_db(
+            float(self.quantize(subs.unit_price)), subs.unit, user_id,
+            project_id, gring_const.RESOURCE_INSTANCE, subs.type,
+            order_id=order_id)
+
+        path = '%s/changed?since=%s' % (self.order_path, since.isoformat())
+        resp = self.get(path, headers=self.admin_headers)
+        self.assertEqual([project_id], resp.json_body)
+
+        since = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+        path = '%s/changed?since=%s' % (self.order_path, since.isoformat())
+        resp = self.get(path, headers=self.admin_headers)
+        self.assertEqual([], resp.json_body)
+
     def test_activate_auto_renew(self):
         pass
@@ -1,8 +1,11 @@
 
+import mock
 import six
 import testtools
 
 from gringotts import constants as gring_const
+from gringotts.db.sqlalchemy import api as db_api
+from gringotts.db.sqlalchemy import models as sa_models
 from gringotts import exception
 from gringotts.openstack.common import jsonutils
 from gringotts.openstack.common import log as logging
@@ -408,6 +411,107 @@ class ProductTestCase(rest.RestfulTestCase):
             self.assertEqual(extra, jsonutils.loads(sub.extra))
         self.assertDecimalEqual(expected_price, order.unit_price)
 
+    def test_reset_product_in_chunks(self):
+        product = self.product_fixture.instance_products[0]
+        user_id = self.admin_account.user_id
+        project_id = self.admin_account.project_id
+        resource_type = gring_const.RESOURCE_INSTANCE
+
+        orders = {}
+        for quantity, order_price in [(1, '0.1'), (2, '0.1'), (3, '0.1'),
+                                      (4, '0.1'), (5, '0')]:
+            order_id = self.new_order_id()
+            subs = self.create_subs_in_db(
+                product, quantity, gring_const.STATE_RUNNING,
+                order_id, project_id, user_id)
+            self.create_order_in_db(
+                order_price, product.unit, user_id, project_id,
+                resource_type, subs.type, order_id=order_id)
+            orders[order_id] = quantity
+        free_order_id = order_id
+        # the last repriced order is stopped after its price is read
+        stopped_order_id = max(o for o in orders if o != free_order_id)
+
+        def reprice_orders(subs, reprice=self.dbconn._reprice_orders):
+            if stopped_order_id in [sub[0] for sub in subs]:
+                session = db_api.get_session()
+                with session.begin():
+                    session.query(sa_models.Order).\
+                        filter_by(order_id=stopped_order_id).\
+                        update({'status': gring_const.STATE_STOPPED})
+            return reprice(subs)
+
+        price_data = self.build_segmented_price_data(
+            '0.0000', [{'count': 0, 'price': '0.5'}])
+        product.unit_price = jsonutils.dumps({'price': price_data})
+        with mock.patch.object(self.dbconn, '_reprice_orders',
+                               side_effect=reprice_orders) as reprice:
+            count = self.dbconn.reset_product(self.admin_req_context,
+                                              product, chunk_size=2)
+        self.assertEqual(2, reprice.call_count)
+        self.assertEqual(3, count)
+
+        for order_id, quantity in orders.items():
+            order = self.dbconn.get_order(self.admin_req_context, order_id)
+            if order_id == free_order_id:
+                expected_price = 0
+            elif order_id == stopped_order_id:
+                expected_price = '0.1'
+            else:
+                expected_price = quantity * self.quantize('0.5')
+            self.assertDecimalEqual(expected_price, order.unit_price)
+
+    def test_get_price_plan_id_dedups_plans(self):
+        price_data = self.build_segmented_price_data(
+            '1.0000', [{'count': 0, 'price': '0.5'}])
+        unit_price = jsonutils.dumps({'price': price_data})
+        formatted = jsonutils.dumps({'price': price_data},
+                                    sort_keys=True, indent=4)
+        plan_id = db_api.get_price_plan_id(unit_price)
+        self.assertEqual(plan_id, db_api.get_price_plan_id(unit_price))
+        # not cached, the plan is found by its hash
+        with mock.patch.dict(db_api._PRICE_PLAN_IDS, clear=True):
+            self.assertEqual(plan_id, db_api.get_price_plan_id(formatted))
+
+        session = db_api.get_session()
+        plans = session.query(sa_models.PricePlan).\
+            filter_by(plan_hash=pricing.price_plan_hash(unit_price)).all()
+        self.assertEqual([plan_id], [plan.id for plan in plans])
+        self.assertIsNone(db_api.get_price_plan_id(None))
+
+    def test_subscription_unit_price_is_read_from_plan(self):
+        product = self.product_fixture.instance_products[0]
+        user_id = self.admin_account.user_id
+        project_id = self.admin_account.project_id
+        order_id = self.new_order_id()
+        subs = self.create_subs_in_db(
+            product, 2, gring_const.STATE_RUNNING,
+            order_id, project_id, user_id)
+        self.create_order_in_db(
+            '0.1', product.unit, user_id, project_id,
+            gring_const.RESOURCE_INSTANCE, subs.type, order_id=order_id)
+
+        price_data = self.build_segmented_price_data(
+            '0.0000', [{'count': 0, 'price': '0.5'}])
+        product.unit_price = jsonutils.dumps({'price': price_data})
+        self.dbconn.reset_product(self.admin_req_context, product)
+
+        session = db_api.get_session()
+        row = session.query(sa_models.Subscription).\
+            filter_by(subscription_id=subs.subscription_id).one()
+        self.assertIsNone(row.unit_price)
+        self.assertIsNotNone(row.price_plan_id)
+
+        # not cached, the unit price is read from the plan
+        with mock.patch.dict(db_api._PRICE_PLANS, clear=True):
+            subs = list(self.dbconn.get_subscriptions_by_order_id(
+                self.admin_req_context, order_id))
+        self.assertEqual(1, len(subs))
+        self.assertEqual({'price': price_data},
+                         jsonutils.loads(subs[0].unit_price))
+        order = self.dbconn.get_order(self.admin_req_context, order_id)
+        self.assertDecimalEqual('1.0', order.unit_price)
+
     def test_get_product_detail_with_negative_limit_or_offset(self):
         path = "%s/%s" % (self.product_path, 'detail')
         self.check_invalid_limit_or_offset(path)
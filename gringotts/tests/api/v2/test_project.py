@@ -1,6 +1,14 @@
 
+from decimal import Decimal
+
 import mock
+from oslo_db import exception as db_exc
+from sqlalchemy.sql import expression
 
+from gringotts import constants as gring_const
+from gringotts.db.sqlalchemy import api as db_api
+from gringotts.db.sqlalchemy import models as sa_models
+from gringotts import exception
 from gringotts.openstack.common import log as logging
 from gringotts.services import keystone
 from gringotts.tests import rest
@@ -165,8 +173,99 @@ class ProjectTestCase(rest.RestfulTestCase):
         self.assertInUserProjectsList(user_id, project_id, user_projects)
         self.assertInUserProjectsList(user_id, project_id2, user_projects)
 
+    def test_freeze_and_unfreeze_balance(self):
+        self.assertRaises(exception.NotSufficientFund,
+                          self.dbconn.freeze_balance,
+                          self.admin_req_context,
+                          self.demo_account.project_id, Decimal('1'))
+
+        # accounts of level 9 can always freeze
+        project_id = self.admin_account.project_id
+        account = self.dbconn.freeze_balance(self.admin_req_context,
+                                             project_id, Decimal('1'))
+        self.assertEqual(Decimal('-1'), account.balance)
+        self.assertEqual(Decimal('1'), account.frozen_balance)
+
+        self.assertRaises(exception.NotSufficientFrozenBalance,
+                          self.dbconn.unfreeze_balance,
+                          self.admin_req_context, project_id, Decimal('2'))
+        account = self.dbconn.unfreeze_balance(self.admin_req_context,
+                                               project_id, Decimal('1'))
+        self.assertEqual(Decimal('0'), account.balance)
+        self.assertEqual(Decimal('0'), account.frozen_balance)
+
     def test_change_billing_owner(self):
         project_id = self.admin_account.project_id
         new_owner = {'user_id': self.admin_account.user_id}
         query_url = self.build_project_query_url(project_id, 'billing_owner')
         self.put(query_url, headers=self.headers, body=new_owner)
+
+    def test_change_billing_owner_in_db(self):
+        project_id = self.demo_account.project_id
+        old_owner = self.demo_account.user_id
+        new_owner = self.admin_account.user_id
+        orders = [self.create_order_in_db(
+            '0.1', 'hour', user_id, project_id,
+            gring_const.RESOURCE_INSTANCE, gring_const.STATE_RUNNING)
+            for user_id in (old_owner, old_owner, new_owner)]
+        session = db_api.get_session()
+        with session.begin():
+            session.query(sa_models.Order).\
+                filter_by(order_id=orders[1].order_id).\
+                update({'user_id': None})
+
+        inserts = []
+        get_session = db_api.get_session
+
+        def get_session_with_duplicate(*args, **kwargs):
+            session = get_session(*args, **kwargs)
+            execute = session.execute
+
+            def execute_with_duplicate(statement, *args, **kwargs):
+                if isinstance(statement, expression.Insert) and \
+                        statement.table is sa_models.UserProject.__table__:
+                    inserts.append(statement)
+                    if len(inserts) == 1:
+                        # as if inserted by a concurrent transaction
+                        raise db_exc.DBDuplicateEntry()
+                return execute(statement, *args, **kwargs)
+            session.execute = execute_with_duplicate
+            return session
+
+        with mock.patch.object(db_api, 'get_session',
+                               side_effect=get_session_with_duplicate):
+            count = self.dbconn.change_billing_owner(
+                self.admin_req_context, project_id, new_owner)
+
+        # the order of the new owner and its updates are not counted
+        self.assertEqual(2, count)
+        self.assertEqual(2, len(inserts))
+        for order in orders:
+            order = self.dbconn.get_order(self.admin_req_context,
+                                          order.order_id)
+            self.assertEqual(new_owner, order.user_id)
+        project = self.dbconn.get_project(self.admin_req_context,
+                                          project_id)
+        self.assertEqual(new_owner, project.user_id)
+        user_projects = db_api.get_session().query(sa_models.UserProject).\
+            filter_by(user_id=new_owner, project_id=project_id).all()
+        self.assertEqual(1, len(user_projects))
+
+    def test_freeze_balance_counts_deferred_tail(self):
+        self.config_fixture.config(defer_hourly_deduction=True)
+        user_id = self.demo_account.user_id
+        project_id = self.demo_account.project_id
+        self.dbconn.update_account(self.admin_req_context, user_id,
+                                   value=10, type='money')
+        session = db_api.get_session()
+        with session.begin():
+            self.dbconn._append_ledger(session, self.dbconn._ledger_entry(
+                gring_const.LEDGER_BILL, user_id, balance=Decimal('-8'),
+                consumption=Decimal('8'), deferred=True))
+
+        self.assertRaises(exception.NotSufficientFund,
+                          self.dbconn.freeze_balance,
+                          self.admin_req_context, project_id, Decimal('5'))
+        account = self.dbconn.freeze_balance(self.admin_req_context,
+                                             project_id, Decimal('2'))
+        self.assertEqual(Decimal('2'), account.frozen_balance)
@@ -0,0 +1,87 @@
+import eventlet
+from eventlet import semaphore
+import mock
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+
+from gringotts.checker import service as checker_service
+from gringotts.tests import core as tests
+
+
+class ListProjectResourcesTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(ListProjectResourcesTestCase, self).setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(cfg.CONF))
+        self.config_fixture.config(check_workers=4, service_concurrency=2,
+                                   group='checker')
+        self.checker = checker_service.CheckerService.__new__(
+            checker_service.CheckerService)
+        self.checker.region_name = 'RegionOne'
+        self.checker.gclient = mock.MagicMock()
+        self.checker.gclient.get_active_orders.return_value = []
+        self.projects = [{'project_id': 'project-%s' % i,
+                          'project_name': 'name-%s' % i}
+                         for i in range(5)]
+
+    def _set_listers(self, *listers):
+        self.checker.RESOURCE_LIST_METHOD = list(listers)
+        self.checker.service_semaphores = dict(
+            (lister, semaphore.Semaphore(
+                cfg.CONF.checker.service_concurrency))
+            for lister in listers)
+
+    @staticmethod
+    def _lister(name):
+        def list_resources(project_id, region_name=None, project_name=None):
+            eventlet.sleep(0)
+            return ['%s-%s' % (name, project_id)]
+        return list_resources
+
+    def test_results_of_services_are_merged(self):
+        self._set_listers(self._lister('volume'), self._lister('instance'))
+
+        resources = list(self.checker._list_project_resources(
+            self.projects[0]))
+
+        self.assertEqual([['volume-project-0'], ['instance-project-0']],
+                         resources)
+
+    def test_failed_service_aborts_the_check(self):
+        def failed(project_id, region_name=None, project_name=None):
+            raise Exception('failed')
+        self._set_listers(self._lister('volume'), failed)
+        bad_resources = []
+        try_to_fix = {'1': [], '2': [], '3': [], '4': [], '5': []}
+
+        with mock.patch.object(self.checker,
+                               '_check_resource_to_order') as check:
+            self.assertRaises(Exception,
+                              self.checker._check_if_resources_match_orders,
+                              bad_resources, try_to_fix, self.projects)
+
+        # the resources of the other service are not reported as missing
+        # orders
+        self.assertFalse(check.called)
+        self.assertEqual([], bad_resources)
+        self.assertEqual({'1': [], '2': [], '3': [], '4': [], '5': []},
+                         try_to_fix)
+
+    def test_service_concurrency_is_bounded(self):
+        running = []
+        max_running = []
+
+        def list_resources(project_id, region_name=None, project_name=None):
+            running.append(project_id)
+            max_running.append(len(running))
+            eventlet.sleep(0.01)
+            running.remove(project_id)
+            return []
+        self._set_listers(list_resources)
+
+        self.checker._check_if_resources_match_orders(
+            [], {'1': [], '2': [], '3': [], '4': [], '5': []},
+            self.projects)
+
+        self.assertEqual(len(self.projects), len(max_running))
+        self.assertEqual(2, max(max_running))
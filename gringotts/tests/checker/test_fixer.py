@@ -0,0 +1,69 @@
+import mock
+
+from gringotts.checker import fixer
+from gringotts import constants as const
+from gringotts.tests import core as tests
+
+
+class BatchFixerTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(BatchFixerTestCase, self).setUp()
+        self.gclient = mock.MagicMock()
+        self.master_api = mock.MagicMock()
+        self.create_cls = mock.MagicMock()
+        self.create_cls.prepare_order.side_effect = (
+            lambda resource: {'resource_id': resource.id})
+        self.create_map = {const.RESOURCE_VOLUME: self.create_cls}
+
+    def _new_fixer(self, **kwargs):
+        return fixer.BatchFixer(self.gclient, self.master_api, 'ctxt',
+                                self.create_map, batch_size=2, **kwargs)
+
+    def _new_resources(self, count):
+        return [mock.MagicMock(id='resource-%s' % i,
+                               resource_type=const.RESOURCE_VOLUME)
+                for i in range(count)]
+
+    def test_create_orders_in_batches(self):
+        resources = self._new_resources(3)
+        report = self._new_fixer().fix({'1': resources})
+
+        self.assertEqual([mock.call([{'resource_id': 'resource-0'},
+                                     {'resource_id': 'resource-1'}]),
+                          mock.call([{'resource_id': 'resource-2'}])],
+                         self.gclient.create_orders.call_args_list)
+        self.assertEqual({'1': ['resource-0', 'resource-1', 'resource-2']},
+                         report)
+
+    def test_notify_master_in_batches(self):
+        stopped = mock.MagicMock(order_id='order-0',
+                                 resource_type=const.RESOURCE_INSTANCE,
+                                 change_to=const.STATE_STOPPED,
+                                 action_time='time')
+        deleted = mock.MagicMock(order_id='order-1', deleted_at='time')
+        self._new_fixer().fix({'2': [stopped], '4': [deleted]})
+
+        self.assertEqual(
+            [mock.call('ctxt', 'instance_stopped',
+                       [{'order_id': 'order-0', 'action_time': 'time'}]),
+             mock.call('ctxt', 'resource_deleted',
+                       [{'order_id': 'order-1', 'action_time': 'time',
+                         'remarks': 'Resource Has Been Deleted'}])],
+            self.master_api.batch.call_args_list)
+
+    def test_failed_batch_does_not_stop_others(self):
+        self.gclient.create_orders.side_effect = [Exception('failed'), None]
+        report = self._new_fixer().fix({'1': self._new_resources(3)})
+
+        self.assertEqual(2, self.gclient.create_orders.call_count)
+        self.assertEqual({'1': ['resource-2']}, report)
+
+    def test_dry_run_only_reports(self):
+        resources = self._new_resources(3)
+        report = self._new_fixer(dry_run=True).fix({'1': resources})
+
+        self.assertFalse(self.create_cls.prepare_order.called)
+        self.assertFalse(self.gclient.create_orders.called)
+        self.assertEqual({'1': ['resource-0', 'resource-1', 'resource-2']},
+                         report)
@@ -0,0 +1,66 @@
+import mock
+
+from gringotts.checker import notifier
+from gringotts.tests import core as tests
+
+
+class NotificationSinkTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(NotificationSinkTestCase, self).setUp()
+        self.sink = notifier.NotificationSink(2)
+        self.notifier = mock.MagicMock(publisher_id='checker.host')
+
+    def test_publish_duplicated_notification_once(self):
+        payload = {'actions': {'email': {'to': 'user@example.com'}}}
+        self.sink.add(self.notifier, 'ctxt', 'uos.account.owed', payload)
+        self.sink.add(self.notifier, 'ctxt', 'uos.account.owed',
+                      dict(payload))
+        self.sink.add(self.notifier, 'ctxt', 'uos.account.will_owed',
+                      payload)
+        self.sink.flush()
+
+        self.assertEqual(
+            [mock.call('ctxt', 'uos.account.owed', payload),
+             mock.call('ctxt', 'uos.account.will_owed', payload)],
+            self.notifier.info.call_args_list)
+
+        # It is published again in the next run
+        self.sink.add(self.notifier, 'ctxt', 'uos.account.owed', payload)
+        self.sink.flush()
+        self.assertEqual(3, self.notifier.info.call_count)
+
+    def test_failed_notification_does_not_stop_others(self):
+        self.notifier.info.side_effect = [Exception('failed'), None]
+        self.sink.add(self.notifier, 'ctxt', 'uos.account.owed', {'a': 1})
+        self.sink.add(self.notifier, 'ctxt', 'uos.account.owed', {'a': 2})
+        self.sink.flush()
+
+        self.assertEqual(2, self.notifier.info.call_count)
+
+
+class NotifierServiceTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(NotifierServiceTestCase, self).setUp()
+        patcher = mock.patch.object(notifier.extension, 'ExtensionManager')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_every_run_gets_its_own_sink(self):
+        service = notifier.NotifierService(0, workers=2)
+        hourly_sink = service.new_sink()
+        monthly_sink = service.new_sink()
+        self.assertIsNot(hourly_sink, monthly_sink)
+
+        publisher = mock.MagicMock(publisher_id='checker.host')
+        payload = {'actions': {'email': {'to': 'user@example.com'}}}
+        hourly_sink.add(publisher, 'ctxt', 'uos.account.owed', payload)
+        monthly_sink.add(publisher, 'ctxt', 'uos.account.owed', payload)
+        hourly_sink.flush()
+        monthly_sink.flush()
+        self.assertEqual(2, publisher.info.call_count)
+
+    def test_no_sink_without_workers(self):
+        service = notifier.NotifierService(0)
+        self.assertIsNone(service.new_sink())
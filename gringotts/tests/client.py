@@ -118,6 +118,12 @@ class MasterApi(object):
     def get_apsched_jobs_count(self, *args, **kwargs):
         return self.service.get_apsched_jobs_count(*args, **kwargs)
 
+    def get_deduct_stats(self, *args, **kwargs):
+        return self.service.get_deduct_stats(*args, **kwargs)
+
+    def batch(self, *args, **kwargs):
+        return self.service.batch(*args, **kwargs)
+
     def resource_created(self, *args, **kwargs):
         return self.service.resource_created(*args, **kwargs)
 
@@ -8,6 +8,7 @@ from oslo_config import cfg
 
 from gringotts.db import impl_sqlalchemy
 from gringotts.db import models as db_models
+from gringotts.db.sqlalchemy import api as db_api
 from gringotts.db.sqlalchemy import models as sql_models
 from gringotts.openstack.common.db.sqlalchemy import session as db_session
 from gringotts.openstack.common import uuidutils
@@ -55,6 +56,9 @@ class Database(fixtures.Fixture):
         # Create all tables from sqlalchemy models
         sql_models.Base.metadata.create_all(bind=self.engine)
         self.addCleanup(sql_models.Base.metadata.drop_all, bind=self.engine)
+        # the cached price plans are gone with the tables
+        self.addCleanup(db_api._PRICE_PLANS.clear)
+        self.addCleanup(db_api._PRICE_PLAN_IDS.clear)
 
         self.conn = impl_sqlalchemy.Connection(CONF)
         self.addCleanup(delattr, self, 'conn')
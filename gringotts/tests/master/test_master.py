@@ -1,10 +1,13 @@
 """Test for resource operations within master"""
 
-import mock
+import datetime
 
+import mock
+from oslo_config import cfg
 from oslotest import mockpatch
 
 from gringotts import constants as gring_const
+from gringotts.master import service as master_service
 from gringotts.tests import service as test_service
 
 
@@ -71,3 +74,265 @@ class MasterServiceBasicTestCase(test_service.MasterServiceTestCase):
 
     def test_instance_resized(self):
         pass
+
+    def test_order_locks_are_striped(self):
+        order_ids = [self.new_order_id() for i in range(5000)]
+        locks = set(self.service._get_lock(order_id)
+                    for order_id in order_ids)
+
+        self.assertEqual(len(self.service.locks), len(locks))
+        self.assertIs(self.service._get_lock(order_ids[0]),
+                      self.service._get_lock(order_ids[0]))
+
+
+class MasterPartitioningTestCase(test_service.MasterServiceTestCase):
+
+    def setUp(self):
+        super(MasterPartitioningTestCase, self).setUp()
+        self.my_order_id = self.new_order_id()
+        self.other_order_id = self.new_order_id()
+
+        coordinator = mock.MagicMock()
+        coordinator.get_members.return_value = [cfg.CONF.host, 'other']
+        coordinator.extract_my_subset.side_effect = (
+            lambda group_id, order_ids: [order_id for order_id in order_ids
+                                         if order_id == self.my_order_id])
+        self.service.partition_coordinator = coordinator
+        self.useFixture(mockpatch.PatchObject(
+            self.service, 'load_hourly_cron_jobs'))
+
+        start_date = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        for order_id in (self.my_order_id, self.other_order_id):
+            self.service._create_cron_job(order_id, start_date=start_date)
+
+    def test_rebalance_drops_jobs_of_other_masters(self):
+        self.service.rebalance()
+
+        self.assertIsNotNone(self.service.apsched.get_job(
+            self.service._make_cron_job_id(self.my_order_id)))
+        self.assertIsNone(self.service.apsched.get_job(
+            self.service._make_cron_job_id(self.other_order_id)))
+        self.service.load_hourly_cron_jobs.assert_called_once_with()
+
+    def test_rebalance_keeps_jobs_if_not_a_member(self):
+        self.service.partition_coordinator.get_members.return_value = []
+        self.service.rebalance()
+
+        self.assertIsNotNone(self.service.apsched.get_job(
+            self.service._make_cron_job_id(self.other_order_id)))
+        self.assertFalse(self.service.load_hourly_cron_jobs.called)
+
+
+class MasterOwnershipTestCase(test_service.MasterServiceTestCase):
+
+    def setUp(self):
+        super(MasterOwnershipTestCase, self).setUp()
+        self.order_id = self.new_order_id()
+        self.other = master_service.MasterService()
+
+        # Both masters see master b as the owner of the order, but the
+        # caller sends the message to master a by its stale ring
+        self.service.partition_coordinator = self._coordinator('a', 'b')
+        self.other.partition_coordinator = self._coordinator('b', 'b')
+        for master in (self.service, self.other):
+            master.gclient = mock.MagicMock()
+            master.gclient.create_bill.return_value = {
+                'type': gring_const.BILL_NORMAL}
+        self.service.forward_rpcapi = mock.MagicMock()
+        self.service.forward_rpcapi.make_msg.side_effect = (
+            lambda method, **kwargs: (method, kwargs))
+        self.service.forward_rpcapi.cast.side_effect = (
+            lambda ctxt, msg, topic: getattr(self.other, msg[0])(ctxt,
+                                                                 **msg[1]))
+
+    @staticmethod
+    def _coordinator(my_id, owner):
+        coordinator = mock.MagicMock()
+        coordinator.get_ring.return_value.get_node.return_value = owner
+        coordinator.extract_my_subset.side_effect = (
+            lambda group_id, order_ids: order_ids if my_id == owner else [])
+        return coordinator
+
+    def _cron_job(self, master):
+        return master.apsched.get_job(
+            master._make_cron_job_id(self.order_id))
+
+    def test_message_of_other_master_is_forwarded(self):
+        action_time = self.datetime_to_str(self.utcnow())
+        self.service.resource_created(self.admin_req_context, self.order_id,
+                                      action_time, 'remarks')
+
+        self.service.forward_rpcapi.cast.assert_called_once_with(
+            self.admin_req_context, mock.ANY,
+            topic='%s.b' % cfg.CONF.master.master_topic)
+        self.assertFalse(self.service.gclient.create_bill.called)
+        self.assertIsNone(self._cron_job(self.service))
+        self.other.gclient.create_bill.assert_called_once_with(
+            self.order_id, action_time, 'remarks')
+        self.assertIsNotNone(self._cron_job(self.other))
+
+    def test_forwarded_message_is_not_forwarded_again(self):
+        # The ring of master b is stale too, it sees master a as the owner
+        self.other.partition_coordinator = self._coordinator('b', 'a')
+        self.other.forward_rpcapi = mock.MagicMock()
+
+        self.service.resource_created(self.admin_req_context, self.order_id,
+                                      self.datetime_to_str(self.utcnow()),
+                                      'remarks')
+
+        self.assertFalse(self.other.forward_rpcapi.cast.called)
+        self.assertIsNone(self._cron_job(self.service))
+        self.assertIsNotNone(self._cron_job(self.other))
+
+
+class MasterLoadJobsTestCase(test_service.MasterServiceTestCase):
+
+    def test_load_hourly_cron_jobs_catches_up_overdue_orders(self):
+        now = datetime.datetime.utcnow()
+        overdue_order_id = self.new_order_id()
+        order_id = self.new_order_id()
+        orders = [
+            {'order_id': overdue_order_id,
+             'cron_time': now - datetime.timedelta(hours=2, minutes=1)},
+            {'order_id': order_id,
+             'cron_time': now + datetime.timedelta(hours=1)},
+        ]
+        self.useFixture(mockpatch.PatchObject(
+            self.service, '_get_cron_orders', return_value=orders))
+        mocked_create_bill = mock.MagicMock()
+        self.useFixture(mockpatch.PatchObject(
+            self.service, '_create_bill', mocked_create_bill))
+        self.useFixture(mockpatch.PatchObject(
+            self.service.gclient, 'get_order',
+            return_value={'status': gring_const.STATE_RUNNING}))
+
+        self.service.load_hourly_cron_jobs()
+
+        mocked_create_bill.assert_called_once_with(
+            self.service.ctxt, overdue_order_id, mock.ANY, 'System Adjust')
+        self.assertIsNotNone(self.service.apsched.get_job(
+            self.service._make_cron_job_id(order_id)))
+
+    def test_catch_up_order_holds_order_lock(self):
+        order_id = self.new_order_id()
+        lock = mock.MagicMock()
+        self.useFixture(mockpatch.PatchObject(
+            self.service, '_get_lock', return_value=lock))
+        self.useFixture(mockpatch.PatchObject(
+            self.service.gclient, 'get_order',
+            return_value={'status': gring_const.STATE_RUNNING}))
+
+        def create_bill(*args):
+            self.assertTrue(lock.__enter__.called)
+            self.assertFalse(lock.__exit__.called)
+        self.useFixture(mockpatch.PatchObject(
+            self.service, '_create_bill', side_effect=create_bill))
+
+        self.service._catch_up_order(order_id, 'action_time')
+
+        self.service._create_bill.assert_called_once_with(
+            self.service.ctxt, order_id, 'action_time', 'System Adjust')
+        self.service._get_lock.assert_called_once_with(order_id)
+        self.assertTrue(lock.__exit__.called)
+
+    def test_catch_up_order_skips_deleted_or_billed_orders(self):
+        order_id = self.new_order_id()
+        self.useFixture(mockpatch.PatchObject(self.service, '_create_bill'))
+        self.useFixture(mockpatch.PatchObject(
+            self.service.gclient, 'get_order',
+            return_value={'status': gring_const.STATE_DELETED}))
+        self.service._catch_up_order(order_id, 'action_time')
+
+        self.service.gclient.get_order.return_value = {
+            'status': gring_const.STATE_RUNNING}
+        self.service._create_cron_job(
+            order_id,
+            start_date=datetime.datetime.utcnow() + datetime.timedelta(
+                hours=1))
+        self.service._catch_up_order(order_id, 'action_time')
+
+        self.assertFalse(self.service._create_bill.called)
+
+    def test_reconcile_jobs_on_warm_start(self):
+        active_order_id = self.new_order_id()
+        deleted_order_id = self.new_order_id()
+        new_order_id = self.new_order_id()
+        start_date = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        for order_id in (active_order_id, deleted_order_id):
+            self.service._create_cron_job(order_id, start_date=start_date)
+        self.useFixture(mockpatch.PatchObject(
+            self.service.gclient, 'get_active_orders',
+            return_value=[{'order_id': order_id, 'unit': 'hour',
+                           'owed': False, 'region_id': cfg.CONF.region_name}
+                          for order_id in (active_order_id, new_order_id)]))
+        self.useFixture(mockpatch.PatchObject(
+            self.service.gclient, 'get_order',
+            return_value={'order_id': new_order_id,
+                          'status': gring_const.STATE_RUNNING,
+                          'cron_time': start_date}))
+        self.useFixture(mockpatch.PatchObject(
+            self.service, '_get_cron_orders'))
+        self.useFixture(mockpatch.PatchObject(
+            self.service, 'load_date_jobs'))
+
+        self.service.reconcile_jobs()
+
+        for order_id in (active_order_id, new_order_id):
+            self.assertIsNotNone(self.service.apsched.get_job(
+                self.service._make_cron_job_id(order_id)))
+        self.assertIsNone(self.service.apsched.get_job(
+            self.service._make_cron_job_id(deleted_order_id)))
+        self.service.gclient.get_order.assert_called_once_with(new_order_id)
+        self.assertFalse(self.service._get_cron_orders.called)
+
+    def test_reconcile_jobs_reads_job_store_once(self):
+        order_ids = [self.new_order_id() for i in range(5)]
+        start_date = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        for order_id in order_ids:
+            self.service._create_cron_job(order_id, start_date=start_date)
+        self.useFixture(mockpatch.PatchObject(
+            self.service.gclient, 'get_active_orders',
+            return_value=[{'order_id': order_id, 'unit': 'hour',
+                           'owed': False, 'region_id': cfg.CONF.region_name}
+                          for order_id in order_ids]))
+        self.useFixture(mockpatch.PatchObject(
+            self.service.gclient, 'get_order'))
+        self.useFixture(mockpatch.PatchObject(
+            self.service, 'load_date_jobs'))
+        apsched = self.service.apsched
+        self.useFixture(mockpatch.PatchObject(
+            apsched, 'get_job', wraps=apsched.get_job))
+        self.useFixture(mockpatch.PatchObject(
+            apsched, 'get_jobs', wraps=apsched.get_jobs))
+
+        self.service.reconcile_jobs()
+
+        self.assertFalse(apsched.get_job.called)
+        # once to reconcile and once to log the number of jobs
+        self.assertEqual(2, apsched.get_jobs.call_count)
+        self.assertFalse(self.service.gclient.get_order.called)
+
+    def test_create_cron_job_spreads_deductions(self):
+        self.config_fixture.config(deduct_spread_window=600, group='master')
+        order_id = self.new_order_id()
+        start_date = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+        self.service._create_cron_job(order_id, start_date=start_date)
+
+        job = self.service.apsched.get_job(
+            self.service._make_cron_job_id(order_id))
+        delay = self.service._get_deduct_delay(order_id)
+        self.assertTrue(0 <= delay < 600)
+        self.assertEqual(
+            start_date + datetime.timedelta(seconds=delay),
+            job.trigger.start_date.replace(tzinfo=None))
+
+    def test_get_deduct_stats(self):
+        now = datetime.datetime.utcnow()
+        self.service._record_deduct_lag(now - datetime.timedelta(seconds=10))
+        self.service._record_deduct_lag(now - datetime.timedelta(seconds=30))
+
+        stats = self.service.get_deduct_stats(self.service.ctxt)
+        self.assertEqual(2, stats['deducted'])
+        self.assertTrue(stats['lag_max'] >= 30)
+        self.assertTrue(20 <= stats['lag_avg'] < stats['lag_max'])
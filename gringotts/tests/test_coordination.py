@@ -0,0 +1,90 @@
+import json
+
+import mock
+
+from gringotts import coordination
+from gringotts.tests import core as tests
+from gringotts import utils
+
+
+class PartitionCoordinatorTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(PartitionCoordinatorTestCase, self).setUp()
+        self.partition_coordinator = coordination.PartitionCoordinator('me')
+        self.tooz = mock.MagicMock()
+        self.partition_coordinator._coordinator = self.tooz
+        self.partition_coordinator._started = True
+        self.partition_coordinator._groups.add('group')
+
+        self.members = ['me', 'other']
+        self.weights = {'me': 1, 'other': 1}
+        self.tooz.get_members.side_effect = lambda group_id: mock.MagicMock(
+            get=mock.MagicMock(return_value=list(self.members)))
+        self.tooz.get_member_capabilities.side_effect = (
+            lambda group_id, member: mock.MagicMock(get=mock.MagicMock(
+                return_value=json.dumps({'weight': self.weights[member]}))))
+
+    def test_ring_is_cached_until_members_change(self):
+        items = ['project-%s' % i for i in range(100)]
+        subset = self.partition_coordinator.extract_my_subset('group', items)
+        self.partition_coordinator.extract_my_subset('group', items)
+        self.assertEqual(1, self.tooz.get_members.call_count)
+
+        ring = utils.HashRing(self.members)
+        self.assertEqual([i for i in items if ring.get_node(i) == 'me'],
+                         subset)
+
+        self.members.append('another')
+        self.weights['another'] = 1
+        self.partition_coordinator._members_changed(
+            mock.MagicMock(group_id='group'))
+        new_subset = self.partition_coordinator.extract_my_subset('group',
+                                                                  items)
+        self.assertEqual(2, self.tooz.get_members.call_count)
+        self.assertTrue(set(new_subset) < set(subset))
+
+    def test_extract_my_subset_by_key_and_size(self):
+        projects = [{'project_id': 'project-%s' % i, 'order_count': 1}
+                    for i in range(100)]
+        projects[0]['order_count'] = 1000
+        subset = self.partition_coordinator.extract_my_subset(
+            'group', projects, key=lambda p: p['project_id'],
+            size=lambda p: p['order_count'])
+
+        ring = utils.HashRing(self.members)
+        nodes = ring.get_nodes_bounded([p['project_id'] for p in projects],
+                                       [p['order_count'] for p in projects])
+        self.assertEqual([p for p, n in zip(projects, nodes) if n == 'me'],
+                         subset)
+
+    def test_weighted_member_takes_more_items(self):
+        self.weights['me'] = 3
+        items = ['project-%s' % i for i in range(1000)]
+        subset = self.partition_coordinator.extract_my_subset('group', items)
+        self.assertTrue(len(subset) > 600)
+
+
+class HashRingTestCase(tests.BaseTestCase):
+
+    def test_get_nodes_is_same_as_get_node(self):
+        ring = utils.HashRing(['a', 'b', 'c'], weights={'b': 2})
+        keys = ['key-%s' % i for i in range(100)] + [u'\u4e2d', 42]
+        self.assertEqual([ring.get_node(k) for k in keys],
+                         ring.get_nodes(keys))
+        self.assertEqual([None, None], utils.HashRing([]).get_nodes([1, 2]))
+
+    def test_get_nodes_bounded_balances_sizes(self):
+        ring = utils.HashRing(['a', 'b'])
+        keys = ['key-%s' % i for i in range(100)]
+        sizes = [1] * 100
+        sizes[0] = 50
+
+        nodes = ring.get_nodes_bounded(keys, sizes)
+        load = dict((node, 0) for node in ['a', 'b'])
+        for node, size in zip(nodes, sizes):
+            load[node] += size
+        # the capacity of every node is 1.25 * 149 / 2
+        self.assertTrue(max(load.values()) <= 93)
+        self.assertEqual(nodes, ring.get_nodes_bounded(keys[::-1],
+                                                       sizes[::-1])[::-1])
@@ -0,0 +1,72 @@
+import mock
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+
+from gringotts import context
+from gringotts.db.sqlalchemy import api as db_api
+from gringotts.tests import core as tests
+
+
+class SessionGot(Exception):
+    pass
+
+
+class ReaderTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(ReaderTestCase, self).setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(cfg.CONF))
+        self.config_fixture.config(slave_connection='mysql://replica',
+                                   group='database')
+        self.facade = mock.MagicMock()
+        self._patch('_create_facade_lazily', return_value=self.facade)
+        self.lag = 0
+        self.facade.get_engine.return_value.execute.side_effect = (
+            lambda sql: mock.MagicMock(first=mock.MagicMock(
+                return_value={'Seconds_Behind_Master': self.lag})))
+        self._patch('_REPLICA_STATE', new={'checked_at': 0, 'fresh': None})
+
+        @db_api.reader
+        def get_things():
+            return db_api.get_session()
+        self.get_things = get_things
+
+    def _patch(self, name, **kwargs):
+        patcher = mock.patch.object(db_api, name, **kwargs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_read_from_replica(self):
+        self.get_things()
+        self.facade.get_session.assert_called_once_with(use_slave=True)
+
+        db_api.get_session()
+        self.facade.get_session.assert_called_with(use_slave=False)
+
+    def test_read_from_primary_if_asked(self):
+        self.get_things(use_replica=False)
+        self.facade.get_session.assert_called_once_with(use_slave=False)
+
+    def test_read_from_primary_if_replica_lags(self):
+        self.lag = 3600
+        self.get_things()
+        self.facade.get_session.assert_called_once_with(use_slave=False)
+
+    def test_lag_is_checked_once_per_interval(self):
+        self.get_things()
+        self.lag = 3600
+        self.get_things()
+        self.assertEqual(
+            1, self.facade.get_engine.return_value.execute.call_count)
+        self.facade.get_session.assert_called_with(use_slave=True)
+
+    def test_order_reads_of_master_and_checker_from_primary(self):
+        self.facade.get_session.side_effect = SessionGot
+        conn = db_api.Connection.__new__(db_api.Connection)
+        ctxt = context.get_admin_context()
+        for method in (conn.get_orders, conn.get_active_order_count,
+                       conn.get_stopped_order_count):
+            self.assertRaises(SessionGot, method, ctxt)
+            self.facade.get_session.assert_called_with(use_slave=False)
+        self.assertFalse(
+            self.facade.get_engine.return_value.execute.called)
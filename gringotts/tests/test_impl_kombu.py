@@ -0,0 +1,93 @@
+import eventlet
+import mock
+
+from gringotts.openstack.common.rpc import impl_kombu
+from gringotts.tests import core as tests
+
+
+def _message(tag):
+    return mock.MagicMock(delivery_tag=tag)
+
+
+class AckBatcherTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(AckBatcherTestCase, self).setUp()
+        self.channel = mock.MagicMock()
+        self.batcher = impl_kombu.AckBatcher(self.channel, 0.01)
+
+    def test_flush_on_interval(self):
+        messages = [_message(tag) for tag in range(1, 4)]
+        for m in messages:
+            self.batcher.add(m)
+        for m in messages:
+            self.batcher.done(m)
+        self.assertFalse(self.channel.basic_ack.called)
+
+        eventlet.sleep(0.05)
+        self.channel.basic_ack.assert_called_once_with(3, multiple=True)
+
+    def test_message_in_progress_does_not_hold_back_others(self):
+        messages = [_message(tag) for tag in range(1, 4)]
+        for m in messages:
+            self.batcher.add(m)
+        self.batcher.done(messages[0])
+        self.batcher.done(messages[2])
+
+        self.batcher.flush()
+        self.assertEqual([mock.call(1, multiple=True), mock.call(3)],
+                         self.channel.basic_ack.call_args_list)
+
+    def test_flush_on_close(self):
+        self.batcher.add(_message(1))
+        self.batcher.done(_message(1))
+        impl_kombu._ACK_BATCHERS[self.channel] = self.batcher
+        self.addCleanup(impl_kombu._ACK_BATCHERS.pop, self.channel)
+
+        impl_kombu._flush_ack_batcher(self.channel)
+        self.channel.basic_ack.assert_called_once_with(1, multiple=True)
+
+        # the cancelled timer should not ack again
+        eventlet.sleep(0.05)
+        self.assertEqual(1, self.channel.basic_ack.call_count)
+
+
+class ConsumerTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(ConsumerTestCase, self).setUp()
+        patcher = mock.patch.object(impl_kombu.kombu.entity, 'Queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel = mock.MagicMock()
+
+    def _consumer(self, callback, **kwargs):
+        return impl_kombu.ConsumerBase(self.channel, callback, 'tag',
+                                       defer_ack=True, **kwargs)
+
+    def test_failed_message_is_acked_on_error(self):
+        def callback(msg, ack):
+            raise Exception('failed')
+
+        message = _message(1)
+        message.payload = {}
+        self._consumer(callback)._callback_handler(message, callback)
+        message.ack.assert_called_once_with()
+        self.assertFalse(message.requeue.called)
+
+    def test_failed_message_is_requeued_if_not_ack_on_error(self):
+        message = _message(1)
+        message.payload = {}
+        consumer = self._consumer(None, ack_on_error=False,
+                                  ack_batch_interval=0.01)
+        consumer._callback_handler(message, lambda msg, ack: ack(True))
+        message.requeue.assert_called_once_with()
+        self.assertFalse(self.channel.basic_ack.called)
+
+    def test_prefetch_count_only_applies_to_the_consumer(self):
+        consumer = self._consumer(mock.MagicMock(), prefetch_count=10)
+        consumer.consume()
+        self.assertEqual([mock.call(0, 10, False), mock.call(0, 0, False)],
+                         self.channel.basic_qos.call_args_list)
+        consumer.queue.consume.assert_called_once_with(
+            callback=mock.ANY, consumer_tag='tag', nowait=False)
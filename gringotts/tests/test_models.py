@@ -0,0 +1,67 @@
+import datetime
+import decimal
+
+from sqlalchemy.util import KeyedTuple
+import wsme
+
+from gringotts.api.v2 import models as api_models
+from gringotts.db import models as db_models
+from gringotts.tests import core as tests
+
+
+class ModelTestCase(tests.BaseTestCase):
+
+    def _new_order(self, **kwargs):
+        order = dict(
+            order_id='order', resource_id='resource', resource_name='name',
+            type='instance', status='running',
+            unit_price=decimal.Decimal('0.1'), unit='hour',
+            total_price=decimal.Decimal('1'), cron_time=None,
+            date_time=None, user_id='user', project_id='project',
+            region_id='RegionOne', domain_id='domain', owed=False,
+            renew=False, renew_method=None, renew_period=None,
+            charged=False, created_at=datetime.datetime(2016, 1, 1),
+            updated_at=None)
+        order.update(kwargs)
+        return db_models.Order(**order)
+
+    def test_fields_are_slots(self):
+        order = self._new_order()
+        self.assertFalse(hasattr(order, '__dict__'))
+        self.assertEqual(db_models.Order.__slots__, order.fields)
+        self.assertRaises(AttributeError, setattr, order, 'unknown', 1)
+
+    def test_as_dict_round_trip(self):
+        order = self._new_order()
+        order_dict = order.as_dict()
+        self.assertEqual(set(db_models.Order.__slots__), set(order_dict))
+        self.assertEqual('running', order_dict['status'])
+        self.assertEqual(decimal.Decimal('0.1'), order_dict['unit_price'])
+
+        copied = db_models.Order(**order_dict)
+        self.assertEqual(order, copied)
+        self.assertEqual(order_dict, copied.as_dict())
+
+        copied['status'] = 'stopped'
+        self.assertFalse(order == copied)
+
+    def test_api_model_from_db_model(self):
+        order = api_models.Order.from_db_model(self._new_order())
+        self.assertEqual('order', order.order_id)
+        self.assertEqual(decimal.Decimal('0.1'), order.unit_price)
+        self.assertEqual('2016-01-01T00:00:00Z', order.created_at)
+
+    def test_api_model_from_row_of_some_columns(self):
+        # the rows of query.with_entities() are keyed tuples
+        row = KeyedTuple(['order', 'running', decimal.Decimal('0.1')],
+                         labels=['order_id', 'status', 'unit_price'])
+        order = api_models.Order.from_db_model(row)
+
+        self.assertEqual('order', order.order_id)
+        self.assertEqual('running', order.status)
+        self.assertEqual(decimal.Decimal('0.1'), order.unit_price)
+        self.assertIs(wsme.Unset, order.resource_id)
+        self.assertIs(wsme.Unset, order.created_at)
+        self.assertEqual({'order_id': 'order', 'status': 'running',
+                          'unit_price': decimal.Decimal('0.1')},
+                         order.as_dict())
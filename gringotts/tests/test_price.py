@@ -2,9 +2,11 @@
 import testtools
 
 from gringotts import exception
+from gringotts.openstack.common import jsonutils
 from gringotts.price import pricing
 from gringotts.tests import core as tests
 from gringotts.tests import utils as test_utils
+from gringotts import utils as gring_utils
 
 
 class PricingTestCase(tests.TestCase):
@@ -67,6 +69,72 @@ class PricingTestCase(tests.TestCase):
             self.assertEqual(self.quantize(p), price)
 
 
+class PricePlanTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(PricePlanTestCase, self).setUp()
+        self.price_data = {
+            'type': 'segmented',
+            'base_price': '5.0',
+            'segmented': [{'count': 4, 'price': '0.2'},
+                          {'count': 0, 'price': '0.3'},
+                          {'count': 10, 'price': '0.1'}],
+        }
+
+    def test_calculate(self):
+        plan = pricing.PricePlan(self.price_data)
+
+        quantity_list = [0, 1, 4, 5, 10, 11]
+        expected_list = ['5.0', '5.3', '6.2', '6.4', '7.4', '7.5']
+
+        for q, p in zip(quantity_list, expected_list):
+            self.assertEqual(pricing.quantize_decimal(p), plan.calculate(q))
+        self.assertEqual([pricing.quantize_decimal(p) for p in expected_list],
+                         plan.calculate_many(quantity_list))
+
+    def test_get_price_plan_is_cached_by_unit_price(self):
+        unit_price = jsonutils.dumps({'price': self.price_data})
+        plan = pricing.get_price_plan(unit_price)
+        self.assertIs(plan, pricing.get_price_plan(unit_price))
+        self.assertEqual(pricing.quantize_decimal('7.5'), plan.calculate(11))
+
+        self.assertIsNone(pricing.get_price_plan(unit_price, 'month'))
+        self.assertIsNone(pricing.get_price_plan(None))
+        self.assertIsNone(pricing.get_price_plan('not json'))
+
+    def test_price_plan_hash_ignores_formatting(self):
+        unit_price = jsonutils.dumps({'price': self.price_data})
+        formatted = jsonutils.dumps({'price': self.price_data},
+                                    sort_keys=True, indent=4)
+        self.assertEqual(pricing.price_plan_hash(unit_price),
+                         pricing.price_plan_hash(formatted))
+
+        self.price_data['base_price'] = '6.0'
+        self.assertNotEqual(pricing.price_plan_hash(unit_price),
+                            pricing.price_plan_hash(jsonutils.dumps(
+                                {'price': self.price_data})))
+
+
+class UnitPriceStringTestCase(tests.BaseTestCase):
+
+    def test_transform_returns_new_objects(self):
+        unit_price = jsonutils.dumps({'price': {
+            'type': 'segmented', 'base_price': '1',
+            'segmented': [{'count': 0, 'price': '0.1'}]}})
+        first = gring_utils.transform_unit_price_string(unit_price)
+        self.assertEqual(pricing.quantize_decimal('1'),
+                         first.price.base_price)
+        first.price.base_price = pricing.quantize_decimal('2')
+        first.price.segmented[0].price = pricing.quantize_decimal('0.2')
+
+        second = gring_utils.transform_unit_price_string(unit_price)
+        self.assertIsNot(first, second)
+        self.assertEqual(pricing.quantize_decimal('1'),
+                         second.price.base_price)
+        self.assertEqual(pricing.quantize_decimal('0.1'),
+                         second.price.segmented[0].price)
+
+
 class ItemUnitTestCase(tests.TestCase):
 
     def setUp(self):
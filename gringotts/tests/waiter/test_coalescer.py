@@ -0,0 +1,83 @@
+import eventlet
+import mock
+
+from gringotts.tests import core as tests
+from gringotts.waiter import coalescer
+
+
+class TransitionCoalescerTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TransitionCoalescerTestCase, self).setUp()
+        self.master_api = mock.MagicMock()
+        self.coalescer = coalescer.TransitionCoalescer(self.master_api, 0.01)
+        self.order_id = self.new_uuid()
+
+    def test_merge_repeated_transitions(self):
+        self.coalescer.add(coalescer.TRANSITION_RESIZE, 'resource_resized',
+                           self.order_id, '2016-01-01 00:00:02.000000',
+                           2, 'Resized')
+        self.coalescer.add(coalescer.TRANSITION_RESIZE, 'resource_resized',
+                           self.order_id, '2016-01-01 00:00:01.000000',
+                           2, 'Resized')
+        self.assertFalse(self.master_api.resource_resized.called)
+
+        eventlet.sleep(0.05)
+        self.master_api.resource_resized.assert_called_once_with(
+            mock.ANY, self.order_id, '2016-01-01 00:00:01.000000',
+            2, 'Resized')
+
+    def test_resize_to_another_quantity_is_not_merged(self):
+        self.coalescer.add(coalescer.TRANSITION_RESIZE, 'resource_resized',
+                           self.order_id, '2016-01-01 00:00:01.000000',
+                           2, 'Resized')
+        self.coalescer.add(coalescer.TRANSITION_RESIZE, 'resource_resized',
+                           self.order_id, '2016-01-01 00:00:02.000000',
+                           3, 'Resized')
+        self.master_api.resource_resized.assert_called_once_with(
+            mock.ANY, self.order_id, '2016-01-01 00:00:01.000000',
+            2, 'Resized')
+
+        eventlet.sleep(0.05)
+        self.assertEqual([mock.call(mock.ANY, self.order_id,
+                                    '2016-01-01 00:00:01.000000',
+                                    2, 'Resized'),
+                          mock.call(mock.ANY, self.order_id,
+                                    '2016-01-01 00:00:02.000000',
+                                    3, 'Resized')],
+                         self.master_api.resource_resized.call_args_list)
+
+    def test_stop_then_start_is_not_merged(self):
+        self.coalescer.add(coalescer.TRANSITION_STATE, 'instance_stopped',
+                           self.order_id, '2016-01-01 00:00:01.000000')
+        self.coalescer.add(coalescer.TRANSITION_STATE, 'resource_changed',
+                           self.order_id, '2016-01-01 00:00:02.000000',
+                           'running', 'Started')
+        self.master_api.instance_stopped.assert_called_once_with(
+            mock.ANY, self.order_id, '2016-01-01 00:00:01.000000')
+        self.assertFalse(self.master_api.resource_changed.called)
+
+        eventlet.sleep(0.05)
+        self.master_api.resource_changed.assert_called_once_with(
+            mock.ANY, self.order_id, '2016-01-01 00:00:02.000000',
+            'running', 'Started')
+
+    def test_different_kind_flushes_buffered_transition(self):
+        self.coalescer.add(coalescer.TRANSITION_STATE, 'resource_stopped',
+                           self.order_id, '2016-01-01 00:00:01.000000',
+                           'Stopped')
+        self.coalescer.add(coalescer.TRANSITION_RESIZE, 'resource_resized',
+                           self.order_id, '2016-01-01 00:00:02.000000',
+                           2, 'Resized')
+        self.master_api.resource_stopped.assert_called_once_with(
+            mock.ANY, self.order_id, '2016-01-01 00:00:01.000000', 'Stopped')
+        self.assertFalse(self.master_api.resource_resized.called)
+
+        self.coalescer.flush(self.order_id)
+        self.master_api.resource_resized.assert_called_once_with(
+            mock.ANY, self.order_id, '2016-01-01 00:00:02.000000',
+            2, 'Resized')
+
+        # The cancelled timer should not send it again
+        eventlet.sleep(0.05)
+        self.assertEqual(1, self.master_api.resource_resized.call_count)
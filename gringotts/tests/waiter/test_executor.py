@@ -0,0 +1,151 @@
+import collections
+
+import eventlet
+from eventlet import event as eventlet_event
+import mock
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+
+from gringotts.tests import core as tests
+from gringotts.waiter import executor
+from gringotts.waiter import service as waiter_service
+
+
+class PartitionedExecutorTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(PartitionedExecutorTestCase, self).setUp()
+        self.executor = executor.PartitionedExecutor(4, 10)
+        self.addCleanup(self.executor.stop)
+
+    def test_tasks_of_same_key_run_in_order(self):
+        result = []
+
+        def task(i):
+            # yield to the other workers
+            eventlet.sleep(0.01 * (5 - i))
+            result.append(i)
+
+        for i in range(5):
+            self.executor.submit('resource-1', task, i)
+        self.executor.stop()
+
+        self.assertEqual(range(5), result)
+
+    def test_tasks_of_different_keys_run_concurrently(self):
+        event = eventlet_event.Event()
+        result = []
+
+        def blocked_task():
+            event.wait()
+            result.append('blocked')
+
+        def task():
+            result.append('done')
+            event.send()
+
+        keys = ['resource-%s' % i for i in range(10)]
+        blocked_key = keys[0]
+        # find a key that is partitioned to another worker
+        other_key = [k for k in keys
+                     if hash(k) % 4 != hash(blocked_key) % 4][0]
+
+        self.executor.submit(blocked_key, blocked_task)
+        self.executor.submit(other_key, task)
+        self.executor.stop()
+
+        self.assertEqual(['done', 'blocked'], result)
+
+    def test_callback_is_called_after_task(self):
+        callback = mock.MagicMock()
+
+        def failed_task():
+            raise Exception('failed')
+
+        self.executor.submit('resource-1', lambda: None, callback=callback)
+        self.executor.submit('resource-1', failed_task, callback=callback)
+        self.executor.stop()
+
+        self.assertEqual([mock.call(failed=False), mock.call(failed=True)],
+                         callback.call_args_list)
+
+    def test_submit_blocks_when_reaching_max_in_flight(self):
+        pool = executor.PartitionedExecutor(1, 1)
+        event = eventlet_event.Event()
+        result = []
+
+        def submit():
+            pool.submit(None, result.append, 2)
+
+        pool.submit(None, event.wait)
+        eventlet.spawn(submit)
+        eventlet.sleep(0)
+        self.assertEqual([], result)
+
+        event.send()
+        eventlet.sleep(0.01)
+        pool.stop()
+        self.assertEqual([2], result)
+
+
+class GetResourceIdTestCase(tests.BaseTestCase):
+
+    def test_get_resource_id(self):
+        self.assertEqual('instance', waiter_service.get_resource_id(
+            {'payload': {'instance_id': 'instance', 'tenant_id': 'project'}}))
+        self.assertEqual('fip', waiter_service.get_resource_id(
+            {'payload': {'floatingip': {'id': 'fip'}}}))
+        self.assertIsNone(waiter_service.get_resource_id(
+            {'payload': {'project_id': 'project', 'user_id': 'user'}}))
+        self.assertIsNone(waiter_service.get_resource_id(
+            {'payload': {'id': 'image'}}))
+        self.assertIsNone(waiter_service.get_resource_id({'payload': {}}))
+
+
+class ProcessNotificationTestCase(tests.BaseTestCase):
+
+    def setUp(self):
+        super(ProcessNotificationTestCase, self).setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(cfg.CONF))
+        self.service = waiter_service.WaiterService.__new__(
+            waiter_service.WaiterService)
+        self.failed = mock.MagicMock()
+        self.failed.obj.do_actions.side_effect = Exception('failed')
+        self.handler = mock.MagicMock()
+        self.notification = {'event_type': 'compute.instance.create.end'}
+
+    def test_notification_without_resource_id_to_fixed_partition(self):
+        self.service.executor = mock.MagicMock()
+        self.service._get_handlers = mock.MagicMock(
+            return_value=[self.handler])
+        self.service._handled_events = collections.Counter()
+        for payload in ({'project_id': 'project'}, {'user_id': 'user'}):
+            self.service.process_notification(
+                {'event_type': 'identity.project.create', 'payload': payload})
+        self.assertEqual(
+            [waiter_service.NO_RESOURCE_KEY] * 2,
+            [c[0][0] for c in self.service.executor.submit.call_args_list])
+
+    def test_error_is_swallowed_if_ack_on_event_error(self):
+        self.config_fixture.config(ack_on_event_error=True, group='waiter')
+        self.service._process_notification([self.failed, self.handler],
+                                           self.notification)
+        self.handler.obj.do_actions.assert_called_once_with(
+            self.notification, matched=True)
+
+    def test_error_is_swallowed_without_notification_workers(self):
+        self.config_fixture.config(ack_on_event_error=False, group='waiter')
+        self.service.executor = None
+        self.service._process_notification([self.failed, self.handler],
+                                           self.notification)
+        self.handler.obj.do_actions.assert_called_once_with(
+            self.notification, matched=True)
+
+    def test_error_is_raised_after_all_handlers_if_not_ack(self):
+        self.config_fixture.config(ack_on_event_error=False, group='waiter')
+        self.service.executor = mock.MagicMock()
+        self.assertRaises(Exception,
+                          self.service._process_notification,
+                          [self.failed, self.handler], self.notification)
+        self.handler.obj.do_actions.assert_called_once_with(
+            self.notification, matched=True)
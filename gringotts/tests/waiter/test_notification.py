@@ -15,6 +15,7 @@ from gringotts.waiter.plugins import share
 from gringotts.waiter.plugins import snapshot
 from gringotts.waiter.plugins import user as identity
 from gringotts.waiter.plugins import volume
+from gringotts.waiter import service as waiter_service
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
@@ -188,3 +189,46 @@ class NotificationTestCase(test_service.WaiterServiceTestCase):
     def test_volume_delete_end(self):
         self._test_notification_process(
             volume.VolumeDeleteEnd, 'volume.delete.end')
+
+    def test_unhandled_event_type_is_dropped(self):
+        message = self.build_notification_message(
+            self.admin_account.user_id, 'compute.instance.update', {})
+        with mock.patch.object(instance.InstanceCreateEnd,
+                               'process_notification') as handle:
+            self.service.process_notification(message)
+            self.service.process_notification(message)
+            self.assertFalse(handle.called)
+
+        stats = self.service.get_event_stats()
+        self.assertEqual({'handled': 0, 'dropped': 2},
+                         stats['compute.instance.update'])
+
+    def test_dropped_event_types_are_capped(self):
+        with mock.patch.object(waiter_service, 'MAX_DISPATCH_ENTRIES', 1):
+            for event_type in ('unknown.1', 'unknown.2', 'unknown.3'):
+                self.service.process_notification(
+                    self.build_notification_message(
+                        self.admin_account.user_id, event_type, {}))
+
+        stats = self.service.get_event_stats()
+        self.assertEqual(2, len(stats))
+        self.assertEqual({'handled': 0, 'dropped': 1}, stats['unknown.1'])
+        self.assertEqual({'handled': 0, 'dropped': 2},
+                         stats[waiter_service.OTHER_EVENT_TYPES])
+
+    def test_handled_event_type_is_counted(self):
+        self._test_notification_process(
+            volume.VolumeCreateEnd, 'volume.create.end')
+
+        stats = self.service.get_event_stats()
+        self.assertEqual({'handled': 1, 'dropped': 0},
+                         stats['volume.create.end'])
+
+    def test_wildcard_event_type_dispatch(self):
+        with mock.patch.object(volume.VolumeDeleteEnd, 'event_types',
+                               ['volume.delete.*']):
+            self.service.initialize_service_hook(self.service)
+            self._test_notification_process(
+                volume.VolumeDeleteEnd, 'volume.delete.end')
+            self._test_notification_process(
+                volume.VolumeDeleteEnd, 'volume.update.end', result=False)
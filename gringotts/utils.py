@@ -7,6 +7,8 @@ import json
 import six
 import struct
 import sys
+import threading
+import time
 import calendar
 
 from dateutil import tz
@@ -38,6 +40,13 @@ OPTS = [
 CONF = cfg.CONF
 CONF.register_opts(OPTS)
 
+# The max number of transformed unit prices that are cached
+UNIT_PRICE_CACHE_SIZE = 1024
+
+_unit_prices = {}
+
+UNIT_PRICE_TYPES = ('price', 'monthly_price', 'yearly_price')
+
 
 def _quantize_decimal(value):
     if isinstance(value, Decimal):
@@ -198,16 +207,27 @@ def smart_str(s, encoding='utf-8', strings_only=False, errors='strict'):
 
 class HashRing(object):
 
-    def __init__(self, nodes, replicas=100):
+    def __init__(self, nodes, replicas=100, weights=None):
+        """Build the ring of nodes
+
+        :param weights: Optional dict of node weights, a node of weight 2
+                        has twice as many replicas, thus keys, as a node of
+                        weight 1, which is the default.
+        """
         self._ring = dict()
         self._sorted_keys = []
 
+        weights = weights or {}
+        self._weights = {}
         for node in nodes:
-            for r in six.moves.range(replicas):
+            self._weights[node] = max(int(weights.get(node, 1)), 1)
+            node_replicas = replicas * self._weights[node]
+            for r in six.moves.range(node_replicas):
                 hashed_key = self._hash('%s-%s' % (node, r))
                 self._ring[hashed_key] = node
                 self._sorted_keys.append(hashed_key)
         self._sorted_keys.sort()
+        self._sorted_nodes = [self._ring[k] for k in self._sorted_keys]
 
     @staticmethod
     def _hash(key):
@@ -225,6 +245,126 @@ class HashRing(object):
         pos = self._get_position_on_ring(key)
         return self._ring[self._sorted_keys[pos]]
 
+    def get_nodes(self, keys):
+        """Return the nodes of the keys in order
+
+        It is the same as calling get_node() for every key, but with the
+        lookups hoisted out of the loop, which matters for many keys.
+        """
+        if not self._ring:
+            return [None] * len(keys)
+        md5 = hashlib.md5
+        unpack = struct.Struct('>I').unpack_from
+        locate = bisect.bisect
+        sorted_keys = self._sorted_keys
+        sorted_nodes = self._sorted_nodes
+        size = len(sorted_keys)
+        nodes = []
+        for key in keys:
+            if not isinstance(key, str):
+                key = smart_str(key)
+            pos = locate(sorted_keys, unpack(md5(key).digest())[0])
+            nodes.append(sorted_nodes[pos if pos < size else 0])
+        return nodes
+
+    def get_nodes_bounded(self, keys, sizes, load_factor=1.25):
+        """Return the nodes of the keys, bounding the load of every node
+
+        The load of a node is the sum of the sizes of its keys, and it is
+        bounded to load_factor times its share of the total size, which is
+        in proportion to its weight. A key whose node is full goes to the
+        next node on the ring that has room for it, so most keys still stay
+        on the node given by get_node(). Keys are placed from the largest to
+        the smallest, ties broken by key, so the result only depends on the
+        keys and sizes, not on their order.
+        """
+        nodes = self.get_nodes(keys)
+        if not self._ring:
+            return nodes
+
+        total_weight = float(sum(self._weights.values()))
+        total_size = sum(sizes)
+        capacity = dict((node, load_factor * total_size * weight /
+                         total_weight)
+                        for node, weight in self._weights.items())
+        load = dict((node, 0) for node in self._weights)
+        sorted_keys = self._sorted_keys
+        sorted_nodes = self._sorted_nodes
+        size = len(sorted_keys)
+
+        order = sorted(range(len(keys)),
+                       key=lambda i: (-sizes[i], smart_str(keys[i])))
+        for i in order:
+            node = nodes[i]
+            if load[node] + sizes[i] > capacity[node]:
+                pos = bisect.bisect(sorted_keys, self._hash(keys[i]))
+                tried = set()
+                for step in six.moves.range(size):
+                    candidate = sorted_nodes[(pos + step) % size]
+                    if candidate in tried:
+                        continue
+                    if load[candidate] + sizes[i] <= capacity[candidate]:
+                        node = candidate
+                        break
+                    tried.add(candidate)
+                    if len(tried) == len(load):
+                        # no node has room for it, keep it on its own node
+                        break
+            load[node] += sizes[i]
+            nodes[i] = node
+        return nodes
+
+
+class StripedLock(object):
+    """A fixed number of locks shared by keys hashed to the same stripe
+
+    Keys of the same stripe are serialized with each other, so memory is
+    bounded by the number of stripes instead of the number of keys, at the
+    cost of some false contention between unrelated keys.
+    """
+
+    def __init__(self, stripes, lock_factory):
+        if stripes < 1:
+            raise ValueError("stripes should be greater than 0")
+        self._locks = [lock_factory() for i in six.moves.range(stripes)]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def get(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class TokenBucket(object):
+    """Limit calls to *rate* per second, allowing bursts of *capacity*"""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate should be greater than 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        """Take the tokens, sleep until they are available
+
+        Callers reserve tokens in the order they come, so the waiting ones
+        are released one by one at the rate. Returns the seconds waited.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity,
+                               self._tokens +
+                               (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
 
 def true_or_false(abool):
     if isinstance(abool, bool):
@@ -251,29 +391,47 @@ def normalize_timedelta(duration):
         return datetime.timedelta(days=float(value))
     raise ValueError("unsupport time unit")
 
-def transform_unit_price_string(data):
-    price_type = ['price', 'monthly_price', 'yearly_price']
-    json_data = json.loads(data)
+def _parse_unit_price_string(data):
+    """Parse and validate the unit_price JSON text to a plain dict
 
-    for p in price_type:
+    The results are cached by the text, as the products listed share a few
+    price plans, so they should not be modified.
+    """
+    try:
+        return _unit_prices[data]
+    except KeyError:
+        pass
+
+    json_data = json.loads(data)
+    for p in UNIT_PRICE_TYPES:
         if p in json_data:
             if 'segmented' not in json_data[p]:
                 err = 'Should have the segmented'
                 raise exception.InvalidParameterValue(err=err)
-            # transform SegmentedItem
-            segmented = json_data[p]['segmented']
-            new_seg = []
-            for s in segmented:
+            for s in json_data[p]['segmented']:
                 s['price'] = _quantize_decimal(s['price'])
-                new_seg.append(models.SegmentedItem.transform(**s))
-            json_data[p]['segmented'] = new_seg
-
-            # transform PriceData
-            if 'base_price' not in json_data[p]:
-                json_data[p]['base_price'] = \
-                    _quantize_decimal(0)
             json_data[p]['base_price'] = \
-                _quantize_decimal(json_data[p]['base_price'])
-            json_data[p] = models.PriceData.transform(
-                **json_data[p])
-    return models.UnitPriceData.transform(**json_data)
+                _quantize_decimal(json_data[p].get('base_price', 0))
+
+    if len(_unit_prices) >= UNIT_PRICE_CACHE_SIZE:
+        _unit_prices.clear()
+    _unit_prices[data] = json_data
+    return json_data
+
+
+def transform_unit_price_string(data):
+    """Transform the unit_price JSON text to UnitPriceData
+
+    The text is only parsed once, but a new UnitPriceData is built every
+    time, so the callers can modify it.
+    """
+    unit_price = dict(_parse_unit_price_string(data))
+    for p in UNIT_PRICE_TYPES:
+        if p in unit_price:
+            # transform SegmentedItem and PriceData
+            price_data = dict(unit_price[p])
+            price_data['segmented'] = [
+                models.SegmentedItem.transform(**s)
+                for s in price_data['segmented']]
+            unit_price[p] = models.PriceData.transform(**price_data)
+    return models.UnitPriceData.transform(**unit_price)
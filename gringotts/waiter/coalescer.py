@@ -0,0 +1,101 @@
+"""Merge repeated transitions of a resource before notifying master.
+"""
+
+import eventlet
+
+from gringotts import context
+from gringotts.openstack.common import log
+
+
+LOG = log.getLogger(__name__)
+
+# Kinds of transitions, only the repeated transitions of the same kind are
+# merged
+TRANSITION_STATE = 'state'
+TRANSITION_RESIZE = 'resize'
+
+
+class _Transition(object):
+
+    def __init__(self, kind, method, action_time, args):
+        self.kind = kind
+        self.method = method
+        self.action_time = action_time
+        self.args = args
+        self.merged = 1
+        self.timer = None
+
+
+class TransitionCoalescer(object):
+    """Buffer the transitions of every order for a short window
+
+    The same transition repeated within *window* seconds, e.g. the
+    duplicated notifications of a rate limit update, is sent to master
+    once with the earliest action_time of them, so master closes and
+    creates bills only once for it.
+
+    A transition that changes what is billed, e.g. start after stop, or a
+    resize to another quantity, is never merged, as the interval before
+    it must be billed at the price of the buffered transition. A
+    transition is sent to master when its window closes, when a different
+    transition of the order comes, or when flush() is called before master
+    is notified of the order in other ways, e.g. the resource is deleted,
+    so master always sees them in order.
+    """
+
+    def __init__(self, master_api, window):
+        self.master_api = master_api
+        self.window = window
+        self.transitions = {}
+
+    def add(self, kind, method, order_id, action_time, *args):
+        """Buffer a call of master_api.<method>(ctxt, order_id, action_time,
+        *args)
+        """
+        transition = self.transitions.get(order_id)
+        if transition and (transition.kind != kind or
+                           transition.method != method or
+                           transition.args != args):
+            self.flush(order_id)
+            transition = None
+
+        if transition:
+            # action_time is either a datetime or a formatted string whose
+            # lexicographical order is the time order
+            transition.action_time = min(transition.action_time,
+                                         action_time)
+            transition.merged += 1
+            return
+
+        transition = _Transition(kind, method, action_time, args)
+        transition.timer = eventlet.spawn_after(self.window, self._send,
+                                                order_id, transition)
+        self.transitions[order_id] = transition
+
+    def flush(self, order_id):
+        """Send the buffered transition of the order right now"""
+        transition = self.transitions.get(order_id)
+        if transition:
+            transition.timer.cancel()
+            self._send(order_id, transition)
+
+    def flush_all(self):
+        for order_id in list(self.transitions):
+            self.flush(order_id)
+
+    def _send(self, order_id, transition):
+        if self.transitions.get(order_id) is not transition:
+            return
+        del self.transitions[order_id]
+
+        if transition.merged > 1:
+            LOG.warn('Coalesced %s repeated %s of order %s from %s',
+                     transition.merged, transition.method, order_id,
+                     transition.action_time)
+        try:
+            getattr(self.master_api, transition.method)(
+                context.get_admin_context(), order_id,
+                transition.action_time, *transition.args)
+        except Exception:
+            LOG.exception('Fail to notify master of the %s transition of '
+                          'order %s', transition.method, order_id)
@@ -0,0 +1,88 @@
+"""Green thread executor that keeps the order of tasks with the same key.
+"""
+
+import itertools
+
+from eventlet import greenpool
+from eventlet import queue
+from eventlet import semaphore
+
+from gringotts.openstack.common import log
+
+
+LOG = log.getLogger(__name__)
+
+_STOP = object()
+
+
+class PartitionedExecutor(object):
+    """Run tasks in a fixed number of green threads partitioned by key
+
+    Tasks with the same key are always run by the same green thread, so
+    they are run in the order they were submitted, while tasks with
+    different keys are run concurrently. Tasks without a key are spread
+    over all the green threads.
+
+    At most *max_in_flight* tasks are queued or running at the same time,
+    submit() blocks until one of them completes, which throttles the
+    caller, e.g. the message consumer.
+    """
+
+    def __init__(self, workers, max_in_flight):
+        if workers < 1:
+            raise ValueError("workers should be greater than 0")
+        self._queues = [queue.LightQueue() for i in range(workers)]
+        self._in_flight = semaphore.Semaphore(max(max_in_flight, 1))
+        self._counter = itertools.count()
+        self._pool = greenpool.GreenPool(workers)
+        for q in self._queues:
+            self._pool.spawn_n(self._worker, q)
+
+    def _partition(self, key):
+        if key is None:
+            index = next(self._counter)
+        else:
+            index = hash(key)
+        return self._queues[index % len(self._queues)]
+
+    def submit(self, key, func, *args, **kwargs):
+        """Run func(*args, **kwargs) after the earlier tasks of key
+
+        :param callback: Optional callable invoked with failed=True/False
+                         once func has completed.
+        """
+        callback = kwargs.pop('callback', None)
+        self._in_flight.acquire()
+        self._partition(key).put((func, args, kwargs, callback))
+
+    def _worker(self, q):
+        while True:
+            task = q.get()
+            if task is _STOP:
+                return
+            func, args, kwargs, callback = task
+            try:
+                self._run(func, args, kwargs, callback)
+            finally:
+                self._in_flight.release()
+
+    @staticmethod
+    def _run(func, args, kwargs, callback):
+        failed = False
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            failed = True
+            LOG.exception('Error occurred when running task %s', func)
+        if callback:
+            try:
+                callback(failed=failed)
+            except Exception:
+                LOG.exception('Error occurred when running callback of '
+                              'task %s', func)
+
+    def stop(self):
+        """Wait for the submitted tasks to complete and stop the workers"""
+        for q in self._queues:
+            q.put(_STOP)
+        self._pool.waitall()
@@ -12,6 +12,7 @@ from gringotts.openstack.common import log
 from gringotts import plugin
 from gringotts.price import pricing
 from gringotts import utils as gringutils
+from gringotts.waiter import coalescer
 
 
 LOG = log.getLogger(__name__)
@@ -83,13 +84,10 @@ class ProductItem(plugin.PluginBase):
             LOG.warn("The order %s has no subscriptions" % order_id)
             return 0
 
-        if 'extra' in sub:
-            price_data = pricing.get_price_data(sub['unit_price'])
-        else:
-            price_data = None
-
-        return pricing.calculate_price(
-            c.resource_volume, price_data)
+        plan = pricing.get_price_plan(sub.get('unit_price'))
+        if not plan:
+            return 0
+        return plan.calculate(c.resource_volume)
 
 
 class Order(object):
@@ -111,6 +109,9 @@ class Order(object):
 
 class NotificationBase(plugin.NotificationBase):
 
+    # Set by the waiter service if transitions should be coalesced
+    transition_coalescer = None
+
     def __init__(self):
         self.gclient = client.get_client()
         self.master_api = master.API()
@@ -168,6 +169,10 @@ class NotificationBase(plugin.NotificationBase):
         self.gclient.create_account(user_id, domain_id, balance,
                                     consumption, level, **kwargs)
 
+    def _flush_transitions(self, order_id):
+        if self.transition_coalescer:
+            self.transition_coalescer.flush(order_id)
+
     def resource_created(self, order_id, action_time, remarks):
         """Notify master that resource has been created
         """
@@ -178,6 +183,7 @@ class NotificationBase(plugin.NotificationBase):
     def resource_created_again(self, order_id, action_time, remarks):
         """Notify master that resource has been created
         """
+        self._flush_transitions(order_id)
         self.master_api.resource_created_again(context.get_admin_context(),
                                                order_id,
                                                action_time, remarks)
@@ -185,6 +191,11 @@ class NotificationBase(plugin.NotificationBase):
     def resource_started(self, order_id, action_time, remarks):
         """Notify master that resource has been started
         """
+        if self.transition_coalescer:
+            self.transition_coalescer.add(coalescer.TRANSITION_STATE,
+                                          'resource_started',
+                                          order_id, action_time, remarks)
+            return
         self.master_api.resource_started(context.get_admin_context(),
                                          order_id,
                                          action_time,
@@ -193,6 +204,11 @@ class NotificationBase(plugin.NotificationBase):
     def resource_stopped(self, order_id, action_time, remarks):
         """Notify master that resource has been stopped
         """
+        if self.transition_coalescer:
+            self.transition_coalescer.add(coalescer.TRANSITION_STATE,
+                                          'resource_stopped',
+                                          order_id, action_time, remarks)
+            return
         self.master_api.resource_stopped(context.get_admin_context(),
                                          order_id,
                                          action_time,
@@ -201,6 +217,7 @@ class NotificationBase(plugin.NotificationBase):
     def resource_deleted(self, order_id, action_time, remarks):
         """Notify master that resource has been deleted
         """
+        self._flush_transitions(order_id)
         self.master_api.resource_deleted(context.get_admin_context(),
                                          order_id,
                                          action_time,
@@ -209,6 +226,12 @@ class NotificationBase(plugin.NotificationBase):
     def resource_resized(self, order_id, action_time, quantity, remarks):
         """Notify master that resource has been resized
         """
+        if self.transition_coalescer:
+            self.transition_coalescer.add(coalescer.TRANSITION_RESIZE,
+                                          'resource_resized',
+                                          order_id, action_time,
+                                          quantity, remarks)
+            return
         self.master_api.resource_resized(context.get_admin_context(),
                                          order_id,
                                          action_time, quantity, remarks)
@@ -216,6 +239,12 @@ class NotificationBase(plugin.NotificationBase):
     def resource_changed(self, order_id, action_time, change_to, remarks):
         """Notify master that resource has been changed
         """
+        if self.transition_coalescer:
+            self.transition_coalescer.add(coalescer.TRANSITION_STATE,
+                                          'resource_changed',
+                                          order_id, action_time,
+                                          change_to, remarks)
+            return
         self.master_api.resource_changed(context.get_admin_context(),
                                          order_id,
                                          action_time, change_to, remarks)
@@ -223,6 +252,11 @@ class NotificationBase(plugin.NotificationBase):
     def instance_stopped(self, order_id, action_time):
         """Notify master that instance has been stopped
         """
+        if self.transition_coalescer:
+            self.transition_coalescer.add(coalescer.TRANSITION_STATE,
+                                          'instance_stopped',
+                                          order_id, action_time)
+            return
         self.master_api.instance_stopped(context.get_admin_context(),
                                          order_id, action_time)
 
@@ -231,6 +265,7 @@ class NotificationBase(plugin.NotificationBase):
                          remarks):
         """Notify master that instance has been resized
         """
+        self._flush_transitions(order_id)
         # change subscirption's product
         self.gclient.change_flavor_subscription(order_id,
                                                 new_flavor, old_flavor,
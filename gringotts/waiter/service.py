@@ -1,11 +1,18 @@
+import collections
+import fnmatch
+import re
+
 from oslo_config import cfg
 from stevedore import extension
 
+from gringotts import master
 from gringotts.openstack.common import log
 from gringotts.openstack.common.rpc import service as rpc_service
 from gringotts.openstack.common import service as os_service
 
 from gringotts.service import prepare_service
+from gringotts.waiter import coalescer
+from gringotts.waiter import executor
 
 
 LOG = log.getLogger(__name__)
@@ -28,8 +35,49 @@ OPTS = [
                help='initial balance when an user be created'),
     cfg.IntOpt('user_initial_level',
                default=3,
-               help='The limit that a user can deduct')
-
+               help='The limit that a user can deduct'),
+    cfg.IntOpt('event_stats_interval',
+               default=3600,
+               help='The interval in seconds to log the handled and dropped '
+                    'notification counters of every event type, 0 means '
+                    'never log them'),
+    cfg.IntOpt('notification_workers',
+               default=0,
+               help='The number of green threads to process notifications '
+                    'concurrently, notifications of the same resource are '
+                    'always processed in order, and a notification is only '
+                    'acknowledged after it has been processed. 0 means '
+                    'processing notifications in the consumer thread'),
+    cfg.IntOpt('max_in_flight_notifications',
+               default=100,
+               help='The max number of notifications that are being '
+                    'processed by notification workers, the consumer stops '
+                    'receiving notifications when reaching it'),
+    cfg.IntOpt('prefetch_count',
+               default=0,
+               help='The max number of unacknowledged notifications the '
+                    'broker delivers to every consumer of this waiter, so '
+                    'that waiters share the load of notification storms. '
+                    'It requires notification_workers, without them the '
+                    'notifications are acknowledged once they are received '
+                    'and it is ignored. 0 means no limit'),
+    cfg.FloatOpt('ack_batch_interval',
+                 default=0,
+                 help='The interval in seconds to acknowledge processed '
+                      'notifications in batches, only works with '
+                      'notification workers. 0 means acknowledging every '
+                      'notification once it has been processed'),
+    cfg.FloatOpt('coalesce_window',
+                 default=0,
+                 help='The window in seconds to buffer the state changes and '
+                      'resizes of a resource, and notify master once of the '
+                      'repeated ones with the earliest action time. Every '
+                      'transition is buffered, so master is notified up to '
+                      'coalesce_window seconds later, unless another state, '
+                      'quantity or the deletion of the resource comes first '
+                      'and flushes it. Buffered transitions are lost if the '
+                      'waiter crashes within the window. 0 means notifying '
+                      'master of every one at once'),
 ]
 
 OPTS_GLOBAL = [
@@ -46,6 +94,39 @@ OPTS_GLOBAL = [
 cfg.CONF.register_opts(OPTS, group="waiter")
 cfg.CONF.register_opts(OPTS_GLOBAL)
 
+# Event types seen on the bus are a small set, but don't let a misbehaving
+# publisher grow the dispatch table without limit.
+MAX_DISPATCH_ENTRIES = 4096
+
+# The event types that are counted after the counters reach
+# MAX_DISPATCH_ENTRIES event types
+OTHER_EVENT_TYPES = '<other>'
+
+# Payload keys of the resource id that notifications are partitioned by
+# when processing them concurrently, the first one found is used.
+RESOURCE_ID_KEYS = ('instance_id', 'volume_id', 'snapshot_id', 'share_id',
+                    'alarm_id', 'router_id', 'loadbalancer_id')
+RESOURCE_KEYS = ('floatingip', 'floatingipset', 'router', 'listener',
+                 'loadbalancer')
+
+# The partition key of the notifications without a resource id, so they are
+# processed in order by one worker
+NO_RESOURCE_KEY = ''
+
+
+def get_resource_id(notification):
+    """Get the id of the resource that the notification is about"""
+    payload = notification.get('payload')
+    if not isinstance(payload, dict):
+        return None
+    for key in RESOURCE_KEYS:
+        if isinstance(payload.get(key), dict) and payload[key].get('id'):
+            return payload[key]['id']
+    for key in RESOURCE_ID_KEYS:
+        if payload.get(key):
+            return payload[key]
+    return None
+
 
 class WaiterService(rpc_service.Service):
 
@@ -54,12 +135,34 @@ class WaiterService(rpc_service.Service):
     def start(self):
         super(WaiterService, self).start()
         LOG.warn("Waiter Loaded Successfully")
+        if cfg.CONF.waiter.event_stats_interval > 0:
+            self.tg.add_timer(cfg.CONF.waiter.event_stats_interval,
+                              self._log_event_stats)
         # Add a dummy thread to have wait() working
         self.tg.add_timer(604800, lambda: None)
 
+    def stop(self):
+        if getattr(self, 'executor', None):
+            # Stop receiving notifications before waiting for the
+            # in-flight ones, so that they can still be acknowledged.
+            try:
+                self.conn.cancel_consumer_thread()
+            except Exception:
+                pass
+            self.executor.stop()
+        if getattr(self, 'coalescer', None):
+            self.coalescer.flush_all()
+        super(WaiterService, self).stop()
+
     def initialize_service_hook(self, service):
         """Consumers must be declared before consume_thread start."""
 
+        self.executor = None
+        if cfg.CONF.waiter.notification_workers > 0:
+            self.executor = executor.PartitionedExecutor(
+                cfg.CONF.waiter.notification_workers,
+                cfg.CONF.waiter.max_in_flight_notifications)
+
         self.notification_manager = \
             extension.ExtensionManager(
                 namespace=self.NOTIFICATION_NAMESPACE,
@@ -69,7 +172,85 @@ class WaiterService(rpc_service.Service):
         if not list(self.notification_manager):
             LOG.warning('Failed to load any notification handlers for %s',
                         self.NOTIFICATION_NAMESPACE)
+        self.coalescer = None
+        if cfg.CONF.waiter.coalesce_window > 0:
+            self.coalescer = coalescer.TransitionCoalescer(
+                master.API(), cfg.CONF.waiter.coalesce_window)
+            for ext in self.notification_manager:
+                ext.obj.transition_coalescer = self.coalescer
+
         self.notification_manager.map(self._setup_subscription)
+        self._build_dispatch_table()
+
+    def _build_dispatch_table(self):
+        """Index notification handlers by the event types they handle
+
+        Every exact event type is mapped to its handlers directly, event
+        types with shell-style wildcards are compiled once and only
+        matched against the event types that are not indexed yet.
+        """
+        self._handler_specs = []
+        exact_event_types = set()
+        for ext in self.notification_manager:
+            exact = set()
+            patterns = []
+            for event_type in ext.obj.event_types:
+                if re.search(r'[*?[]', event_type):
+                    patterns.append(re.compile(fnmatch.translate(event_type)))
+                else:
+                    exact.add(event_type)
+            self._handler_specs.append((ext, exact, patterns))
+            exact_event_types |= exact
+
+        self._dispatch_table = dict(
+            (event_type, self._resolve_handlers(event_type))
+            for event_type in exact_event_types)
+        self._handled_events = collections.Counter()
+        self._dropped_events = collections.Counter()
+
+    def _resolve_handlers(self, event_type):
+        """Get the handlers of event_type in notification_manager order"""
+        handlers = []
+        for ext, exact, patterns in self._handler_specs:
+            if (event_type in exact or
+                    any(p.match(event_type) for p in patterns)):
+                handlers.append(ext)
+        return handlers
+
+    def _get_handlers(self, event_type):
+        try:
+            return self._dispatch_table[event_type]
+        except KeyError:
+            if not event_type:
+                return []
+            handlers = self._resolve_handlers(event_type)
+            if len(self._dispatch_table) < MAX_DISPATCH_ENTRIES:
+                self._dispatch_table[event_type] = handlers
+            return handlers
+
+    @staticmethod
+    def _count_event(counter, event_type):
+        """Count event_type in counter, capped like the dispatch table"""
+        if event_type not in counter and \
+                len(counter) >= MAX_DISPATCH_ENTRIES:
+            event_type = OTHER_EVENT_TYPES
+        counter[event_type] += 1
+
+    def get_event_stats(self):
+        """Get handled and dropped notification counters by event type"""
+        stats = {}
+        for event_type, count in self._handled_events.items():
+            stats.setdefault(event_type, {'handled': 0, 'dropped': 0})
+            stats[event_type]['handled'] = count
+        for event_type, count in self._dropped_events.items():
+            stats.setdefault(event_type, {'handled': 0, 'dropped': 0})
+            stats[event_type]['dropped'] = count
+        return stats
+
+    def _log_event_stats(self):
+        for event_type, stat in sorted(self.get_event_stats().items()):
+            LOG.warn('Event type: %s, handled: %s, dropped: %s',
+                     event_type, stat['handled'], stat['dropped'])
 
     def _setup_subscription(self, ext, *args, **kwds):
         """Connect to message bus to get notifications
@@ -89,6 +270,19 @@ class WaiterService(rpc_service.Service):
                   ext.name, ', '.join(handler.event_types),
                   ack_on_error)
 
+        kwargs = {}
+        if self.executor:
+            kwargs['defer_ack'] = True
+            if cfg.CONF.waiter.ack_batch_interval > 0:
+                kwargs['ack_batch_interval'] = \
+                    cfg.CONF.waiter.ack_batch_interval
+        if cfg.CONF.waiter.prefetch_count > 0:
+            if self.executor:
+                kwargs['prefetch_count'] = cfg.CONF.waiter.prefetch_count
+            else:
+                LOG.warning('waiter.prefetch_count is ignored without '
+                            'waiter.notification_workers')
+
         for exchange_topic in handler.get_exchange_topics(cfg.CONF):
             for topic in exchange_topic.topics:
                 try:
@@ -97,37 +291,77 @@ class WaiterService(rpc_service.Service):
                         pool_name=cfg.CONF.waiter.queue_name,
                         topic=topic,
                         exchange_name=exchange_topic.exchange,
-                        ack_on_error=ack_on_error)
+                        ack_on_error=ack_on_error,
+                        **kwargs)
                 except Exception:
                     LOG.exception('Could not join consumer pool %s/%s' %
                                   (topic, exchange_topic.exchange))
 
-    def process_notification(self, notification):
+    def process_notification(self, notification, ack=None):
         """RPC endpoint for notification messages
 
         When another service sends a notification over the message
         bus, this method receives it. See _setup_subscription().
 
+        If notification workers are enabled, the notification is handed
+        over to the worker of its resource, and *ack* is called when the
+        worker has processed it.
+
+        """
+        event_type = notification.get('event_type')
+        handlers = self._get_handlers(event_type)
+        if not handlers:
+            self._count_event(self._dropped_events, event_type)
+            if ack:
+                ack()
+            return
+
+        self._count_event(self._handled_events, event_type)
+        if self.executor:
+            key = get_resource_id(notification)
+            if key is None:
+                key = NO_RESOURCE_KEY
+            self.executor.submit(key,
+                                 self._process_notification,
+                                 handlers, notification,
+                                 callback=ack)
+        else:
+            self._process_notification(handlers, notification)
+
+    def _process_notification(self, handlers, notification):
+        """Run all the handlers, then re-raise the first error if any
+
+        The error is only re-raised by notification workers if
+        ack_on_event_error is False, so the message is requeued instead of
+        acknowledged. The errors are logged and ignored in the consumer
+        thread.
         """
-        self.notification_manager.map(self._process_notification_for_ext,
-                                      notification=notification)
+        error = None
+        for ext in handlers:
+            try:
+                self._process_notification_for_ext(ext, notification)
+            except Exception as e:
+                error = error or e
+        if (error and getattr(self, 'executor', None) and
+                not cfg.CONF.waiter.ack_on_event_error):
+            raise error
 
     def _process_notification_for_ext(self, ext, notification):
         """Wrapper for doing actions  when a notification arrives
 
         When a message is received by process_notification(), it calls
-        this method with each notification plugin to allow all the
-        plugins process the notification.
+        this method with each notification plugin that handles the event
+        type of the notification.
 
         """
-        # FIXME(suo): Spawn green thread?
         try:
-            ext.obj.do_actions(notification)
+            ext.obj.do_actions(notification, matched=True)
         except Exception:
             LOG.exception("Some errors occured when handling event_type: %s,"
                           "the message content is: %s",
                           notification.get('event_type'),
                           notification)
+            raise
 
 
 def waiter():